@@ -2,14 +2,32 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
 import os
+import threading
+from . import metrics
 
 # Secret key settings
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Hashes with fewer rounds than PASSWORD_HASH_ROUNDS are rehashed on the
+# next successful login
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+# Worker processes for password hashing and the number of hashes that may be
+# running or queued before requests are turned away
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", str(PASSWORD_HASH_WORKERS * 8)))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS
+)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -17,6 +35,80 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+class HashingOverloaded(Exception):
+    pass
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+_pending = 0
+
+def _get_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            # spawn, so workers don't inherit the server's threads and DB connections
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _hash_pool
+
+def _release(future):
+    global _pending
+    with _hash_pool_lock:
+        _pending -= 1
+
+async def _run_in_hash_pool(fn, *args):
+    global _pending
+    pool = _get_hash_pool()
+    with _hash_pool_lock:
+        if _pending >= PASSWORD_HASH_QUEUE_LIMIT:
+            raise HashingOverloaded()
+        _pending += 1
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        _release(None)
+        raise
+    # The slot is held until the worker finishes, even if the request is cancelled
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+async def get_password_hash_async(password):
+    return await _run_in_hash_pool(get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    return await _run_in_hash_pool(verify_and_update_password, plain_password, hashed_password)
+
+def hash_pool_stats():
+    with _hash_pool_lock:
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "pending": _pending,
+            "queue_limit": PASSWORD_HASH_QUEUE_LIMIT,
+            "rounds": PASSWORD_HASH_ROUNDS
+        }
+
+def _metrics():
+    stats = hash_pool_stats()
+    return [
+        ("password_hash_pending", "gauge", "Password hashes running or queued in the worker pool.", [({}, stats["pending"])]),
+        ("password_hash_queue_limit", "gauge", "Hashes allowed in flight before logins get 503.", [({}, stats["queue_limit"])]),
+    ]
+
+metrics.register_collector(_metrics)
+
+def shutdown_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        pool, _hash_pool = _hash_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
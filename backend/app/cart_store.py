@@ -0,0 +1,452 @@
+"""Cart storage backends behind the cart router.
+
+"postgres" (default) reads and writes cart_items directly. "memory" keeps
+active carts in sharded in-process maps, rehydrated from Postgres on first
+use, and writes changed lines (not whole carts) behind in batches from a
+background thread. The memory backend assumes a single API process owns the
+carts.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from sqlalchemy import select, update, delete, bindparam, func, literal, Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .database import engine
+
+CART_STORE = os.getenv("CART_STORE", "postgres")
+CART_STORE_SHARDS = int(os.getenv("CART_STORE_SHARDS", "16"))
+# Clean carts beyond this many per shard are dropped from memory (least
+# recently used first); dirty carts are kept until written
+CART_STORE_MAX_CARTS_PER_SHARD = int(os.getenv("CART_STORE_MAX_CARTS_PER_SHARD", "5000"))
+CART_FLUSH_BATCH_SIZE = int(os.getenv("CART_FLUSH_BATCH_SIZE", "200"))
+CART_FLUSH_INTERVAL_SECONDS = float(os.getenv("CART_FLUSH_INTERVAL_SECONDS", "1.0"))
+
+class ProductNotFound(Exception):
+    pass
+
+class CartItemNotFound(Exception):
+    pass
+
+async def get_or_create_cart_id(db: AsyncSession, user_id: int) -> int:
+    cart_id = await db.scalar(select(models.Cart.id).where(models.Cart.user_id == user_id))
+    if cart_id is None:
+        # Concurrent first requests for the same user may both get here
+        await db.execute(
+            insert(models.Cart).values(user_id=user_id).on_conflict_do_nothing(index_elements=["user_id"])
+        )
+        await db.commit()
+        cart_id = await db.scalar(select(models.Cart.id).where(models.Cart.user_id == user_id))
+    return cart_id
+
+class PostgresCartStore:
+    name = "postgres"
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    async def get_cart(self, db: AsyncSession, user_id: int):
+        cart_id = await get_or_create_cart_id(db, user_id)
+        # Items, their products and the cart total in one query, plus one for
+        # product images; populate_existing picks up this request's changes
+        query = select(models.CartItem, func.sum(models.CartItem.quantity * models.Product.price).over())\
+            .join(models.CartItem.product)\
+            .where(models.CartItem.cart_id == cart_id)\
+            .order_by(models.CartItem.id)\
+            .options(contains_eager(models.CartItem.product).selectinload(models.Product.images))\
+            .execution_options(populate_existing=True)
+        rows = (await db.execute(query)).all()
+        return {
+            "id": cart_id,
+            "user_id": user_id,
+            "items": [item for item, _ in rows],
+            "total_price": rows[0][1] if rows else 0.0
+        }
+
+    async def add_item(self, db: AsyncSession, user_id: int, product_id: int, quantity: int):
+        cart_id = await get_or_create_cart_id(db, user_id)
+        # Insert the line or add to its quantity; selecting from products makes
+        # an unknown product insert nothing
+        statement = insert(models.CartItem).from_select(
+            ["cart_id", "product_id", "quantity"],
+            select(literal(cart_id, Integer), models.Product.id, literal(quantity, Integer))
+            .where(models.Product.id == product_id)
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["cart_id", "product_id"],
+            set_={"quantity": models.CartItem.quantity + statement.excluded.quantity}
+        ).returning(models.CartItem.id)
+        if await db.scalar(statement) is None:
+            raise ProductNotFound()
+        await db.commit()
+
+    async def set_quantity(self, db: AsyncSession, user_id: int, item_id: int, quantity: int):
+        if quantity <= 0:
+            return await self.remove_item(db, user_id, item_id)
+        cart_id = await get_or_create_cart_id(db, user_id)
+        statement = update(models.CartItem)\
+            .where(models.CartItem.id == item_id, models.CartItem.cart_id == cart_id)\
+            .values(quantity=quantity)\
+            .returning(models.CartItem.id)
+        if await db.scalar(statement) is None:
+            raise CartItemNotFound()
+        await db.commit()
+
+    async def remove_item(self, db: AsyncSession, user_id: int, item_id: int):
+        cart_id = await get_or_create_cart_id(db, user_id)
+        statement = delete(models.CartItem)\
+            .where(models.CartItem.id == item_id, models.CartItem.cart_id == cart_id)\
+            .returning(models.CartItem.id)
+        if await db.scalar(statement) is None:
+            raise CartItemNotFound()
+        await db.commit()
+
+    def flush_user(self, user_id: int):
+        pass
+
+    def forget_items(self, user_id: int, purchased):
+        pass
+
+    def stats(self):
+        return {"backend": self.name}
+
+class _CachedCart:
+    def __init__(self, cart_id, lines):
+        self.cart_id = cart_id
+        self.lines = lines # item_id -> [product_id, quantity, added_at]
+        # Changes not yet written. Only these are written, so rows removed
+        # from cart_items outside the store (checkout) are never put back.
+        self.inserted = set()
+        self.updated = set()
+        self.deleted = set()
+
+    @property
+    def dirty(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def add(self, item_id, line):
+        self.lines[item_id] = line
+        self.inserted.add(item_id)
+
+    def set_quantity(self, item_id, quantity):
+        self.lines[item_id][1] = quantity
+        if item_id not in self.inserted:
+            self.updated.add(item_id)
+
+    def remove(self, item_id):
+        del self.lines[item_id]
+        self.updated.discard(item_id)
+        if item_id in self.inserted:
+            self.inserted.discard(item_id)
+        else:
+            self.deleted.add(item_id)
+
+    def take_changes(self):
+        changes = (
+            [(item_id, *self.lines[item_id]) for item_id in self.inserted],
+            [(item_id, self.lines[item_id][1]) for item_id in self.updated],
+            list(self.deleted)
+        )
+        self.inserted, self.updated, self.deleted = set(), set(), set()
+        return changes
+
+    def restore_changes(self, changes):
+        # A write failed: merge its changes back under any made since
+        inserts, updates, deletes = changes
+        for item_id, *_ in inserts:
+            if item_id in self.lines:
+                self.updated.discard(item_id)
+                self.inserted.add(item_id)
+        for item_id, _ in updates:
+            if item_id in self.lines and item_id not in self.inserted:
+                self.updated.add(item_id)
+        self.deleted.update(deletes)
+
+class MemoryCartStore:
+    name = "memory"
+
+    def __init__(self, shards, max_carts_per_shard, batch_size, flush_interval):
+        self.max_carts_per_shard = max_carts_per_shard
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self._dirty = set()
+        self._condition = threading.Condition()
+        # Serializes writes so an older snapshot never lands after a newer one
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.rehydrated = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def _shard(self, user_id):
+        return self._shards[user_id % len(self._shards)]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="cart-store-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Write every dirty cart before the process exits
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+        self._flush(self._take_dirty(None))
+        if self._dirty:
+            print(f"Warning: {len(self._dirty)} carts could not be written on shutdown")
+
+    async def _cart(self, db: AsyncSession, user_id: int):
+        lock, carts = self._shard(user_id)
+        with lock:
+            cart = carts.get(user_id)
+            if cart is not None:
+                carts.move_to_end(user_id)
+                return cart
+
+        cart_id = await get_or_create_cart_id(db, user_id)
+        rows = (await db.execute(
+            select(models.CartItem.id, models.CartItem.product_id, models.CartItem.quantity, models.CartItem.added_at)
+            .where(models.CartItem.cart_id == cart_id)
+        )).all()
+        loaded = _CachedCart(cart_id, {row.id: [row.product_id, row.quantity, row.added_at] for row in rows})
+
+        with lock:
+            # Another request may have loaded the cart meanwhile
+            cart = carts.setdefault(user_id, loaded)
+            carts.move_to_end(user_id)
+            if cart is loaded:
+                self.rehydrated += 1
+                self._evict_clean(carts)
+            return cart
+
+    def _attach(self, user_id, cart):
+        # Called with the shard lock held: a clean cart may have been evicted
+        # since it was looked up, so put it back (or use a newer copy)
+        _, carts = self._shard(user_id)
+        return carts.setdefault(user_id, cart)
+
+    def _evict_clean(self, carts):
+        if len(carts) <= self.max_carts_per_shard:
+            return
+        for user_id in [user_id for user_id, cart in carts.items() if not cart.dirty]:
+            if len(carts) <= self.max_carts_per_shard:
+                break
+            del carts[user_id]
+
+    def _mark_dirty(self, user_id, cart):
+        with self._condition:
+            self._dirty.add(user_id)
+            if len(self._dirty) >= self.batch_size:
+                self._condition.notify()
+
+    async def get_cart(self, db: AsyncSession, user_id: int):
+        cart = await self._cart(db, user_id)
+        lock, _ = self._shard(user_id)
+        with lock:
+            lines = sorted((item_id, line[0], line[1]) for item_id, line in cart.lines.items())
+
+        products = {}
+        if lines:
+            products = {product.id: product for product in (await db.scalars(
+                select(models.Product)
+                .where(models.Product.id.in_({product_id for _, product_id, _ in lines}))
+                .options(selectinload(models.Product.images))
+            )).all()}
+
+        # Same attributes as CartItem, so callers can treat both backends alike
+        items = [
+            SimpleNamespace(id=item_id, product_id=product_id, quantity=quantity, product=products[product_id])
+            for item_id, product_id, quantity in lines
+            if product_id in products
+        ]
+        return {
+            "id": cart.cart_id,
+            "user_id": user_id,
+            "items": items,
+            "total_price": sum(item.quantity * item.product.price for item in items)
+        }
+
+    async def add_item(self, db: AsyncSession, user_id: int, product_id: int, quantity: int):
+        if await db.scalar(select(models.Product.id).where(models.Product.id == product_id)) is None:
+            raise ProductNotFound()
+        cart = await self._cart(db, user_id)
+        lock, _ = self._shard(user_id)
+
+        new_item_id = None
+        while True:
+            with lock:
+                cart = self._attach(user_id, cart)
+                item_id = next((item_id for item_id, line in cart.lines.items() if line[0] == product_id), None)
+                if item_id is not None:
+                    cart.set_quantity(item_id, cart.lines[item_id][1] + quantity)
+                elif new_item_id is not None:
+                    cart.add(new_item_id, [product_id, quantity, datetime.now(timezone.utc)])
+                if item_id is not None or new_item_id is not None:
+                    self._mark_dirty(user_id, cart)
+                    return
+            # New lines take ids from the table's sequence so they stay valid
+            # when written
+            new_item_id = await db.scalar(select(func.nextval("cart_items_id_seq")))
+
+    async def set_quantity(self, db: AsyncSession, user_id: int, item_id: int, quantity: int):
+        cart = await self._cart(db, user_id)
+        lock, _ = self._shard(user_id)
+        with lock:
+            cart = self._attach(user_id, cart)
+            line = cart.lines.get(item_id)
+            if line is None:
+                raise CartItemNotFound()
+            if quantity <= 0:
+                cart.remove(item_id)
+            else:
+                cart.set_quantity(item_id, quantity)
+            self._mark_dirty(user_id, cart)
+
+    async def remove_item(self, db: AsyncSession, user_id: int, item_id: int):
+        await self.set_quantity(db, user_id, item_id, 0)
+
+    def flush_user(self, user_id: int):
+        """Write the user's cart now, so Postgres reflects it for checkout."""
+        with self._condition:
+            self._dirty.discard(user_id)
+        # Runs even when the cart isn't queued: taking the write lock waits
+        # out a batch that may be writing it right now
+        self._flush([user_id])
+
+    def forget_items(self, user_id: int, purchased):
+        """Account for lines checkout removed from cart_items (item_id -> quantity bought)."""
+        lock, carts = self._shard(user_id)
+        with lock:
+            cart = carts.get(user_id)
+            if cart is None:
+                return
+            readded = False
+            for item_id, quantity in purchased.items():
+                line = cart.lines.get(item_id)
+                if line is None:
+                    continue
+                # Its row is gone, so a pending quantity update has nothing to update
+                cart.updated.discard(item_id)
+                if line[1] > quantity:
+                    # Added to while the order was placed: the rest goes back in
+                    line[1] -= quantity
+                    cart.inserted.add(item_id)
+                    readded = True
+                else:
+                    del cart.lines[item_id]
+            if readded:
+                self._mark_dirty(user_id, cart)
+
+    def stats(self):
+        with self._condition:
+            dirty = len(self._dirty)
+        return {
+            "backend": self.name,
+            "carts": sum(len(carts) for _, carts in self._shards),
+            "dirty": dirty,
+            "rehydrated": self.rehydrated,
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes
+        }
+
+    def _take_dirty(self, limit):
+        with self._condition:
+            user_ids = list(self._dirty)[:limit] if limit else list(self._dirty)
+            self._dirty.difference_update(user_ids)
+        return user_ids
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._dirty) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+            if stopping:
+                return
+            self._flush(self._take_dirty(self.batch_size))
+
+    def _flush(self, user_ids):
+        if not user_ids:
+            return
+        with self._write_lock:
+            snapshots = []
+            for user_id in user_ids:
+                lock, carts = self._shard(user_id)
+                with lock:
+                    cart = carts.get(user_id)
+                    if cart is not None and cart.dirty:
+                        snapshots.append((user_id, cart, cart.take_changes()))
+            if not snapshots:
+                return
+
+            try:
+                self._write(snapshots)
+            except Exception as e:
+                self.failed_flushes += 1
+                for user_id, cart, changes in snapshots:
+                    lock, _ = self._shard(user_id)
+                    with lock:
+                        cart.restore_changes(changes)
+                with self._condition:
+                    self._dirty.update(user_id for user_id, _, _ in snapshots)
+                print(f"Warning: Could not write {len(snapshots)} carts. Error: {e}")
+                return
+            self.flushed += len(snapshots)
+
+    def _write(self, snapshots):
+        # Only changed lines are written, all carts of the batch in one transaction
+        cart_items = models.CartItem.__table__
+        inserts = [(cart, line) for _, cart, (lines, _, _) in snapshots for line in lines]
+        updates = [line for _, _, (_, lines, _) in snapshots for line in lines]
+        deletes = [item_id for _, _, (_, _, item_ids) in snapshots for item_id in item_ids]
+        with engine.begin() as connection:
+            if deletes:
+                connection.execute(delete(cart_items).where(cart_items.c.id.in_(deletes)))
+            if updates:
+                # Rows deleted meanwhile (checked out) stay deleted
+                connection.execute(
+                    update(cart_items).where(cart_items.c.id == bindparam("item_id")).values(quantity=bindparam("new_quantity")),
+                    [{"item_id": item_id, "new_quantity": quantity} for item_id, quantity in updates]
+                )
+            product_ids = {product_id for _, (_, product_id, _, _) in inserts}
+            existing = set()
+            if product_ids:
+                existing = set(connection.scalars(
+                    select(models.Product.id).where(models.Product.id.in_(product_ids))
+                ))
+            rows = [
+                {"id": item_id, "cart_id": cart.cart_id, "product_id": product_id, "quantity": quantity, "added_at": added_at}
+                for cart, (item_id, product_id, quantity, added_at) in inserts
+                if product_id in existing
+            ]
+            if rows:
+                connection.execute(insert(cart_items).on_conflict_do_nothing(), rows)
+
+if CART_STORE == "memory":
+    store = MemoryCartStore(
+        shards=CART_STORE_SHARDS,
+        max_carts_per_shard=CART_STORE_MAX_CARTS_PER_SHARD,
+        batch_size=CART_FLUSH_BATCH_SIZE,
+        flush_interval=CART_FLUSH_INTERVAL_SECONDS
+    )
+else:
+    store = PostgresCartStore()
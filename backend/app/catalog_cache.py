@@ -0,0 +1,58 @@
+"""Read-through cache of serialized product responses.
+
+The cache lives in each API process, so explicit invalidation only reaches
+the process that made the change; CATALOG_CACHE_TTL_SECONDS bounds how stale
+other workers can be.
+"""
+import os
+import threading
+from .cache import LRUCache
+
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() == "true"
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "5000"))
+CATALOG_CACHE_MAX_BYTES = int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "30"))
+
+cache = LRUCache(
+    max_entries=CATALOG_CACHE_MAX_ENTRIES,
+    ttl=CATALOG_CACHE_TTL_SECONDS,
+    max_bytes=CATALOG_CACHE_MAX_BYTES
+)
+
+# Bumped on every invalidation. List keys embed it, so a change to any product
+# retires every cached list at once; entries from older epochs age out of the
+# LRU. It also stops a request that read the database before an invalidation
+# from caching what it read.
+_epoch = 0
+_epoch_lock = threading.Lock()
+
+def current_epoch():
+    return _epoch
+
+def product_key(product_id: int):
+    return ("product", product_id)
+
+def list_key(epoch: int, params: dict):
+    return ("list", epoch, tuple(sorted(params.items())))
+
+def get(key):
+    if not CATALOG_CACHE_ENABLED:
+        return None
+    return cache.get(key)
+
+def store(key, body: bytes, epoch: int):
+    if not CATALOG_CACHE_ENABLED:
+        return
+    with _epoch_lock:
+        if epoch == _epoch:
+            cache.set(key, body)
+
+def invalidate_products(product_ids=()):
+    global _epoch
+    with _epoch_lock:
+        _epoch += 1
+        for product_id in product_ids:
+            cache.delete(product_key(product_id))
+
+def stats():
+    return {"enabled": CATALOG_CACHE_ENABLED, "epoch": _epoch, **cache.stats()}
@@ -0,0 +1,146 @@
+import asyncio
+import os
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+import stripe
+from . import models, order_rollups, catalog_cache, cart_store, inventory, outbound
+from .cache import LRUCache
+from .database import SessionLocal
+
+# How long verify-session answers from memory: paid is final, other states
+# are re-checked with Stripe after a short delay
+CHECKOUT_PAID_TTL_SECONDS = float(os.getenv("CHECKOUT_PAID_TTL_SECONDS", "300"))
+CHECKOUT_PENDING_TTL_SECONDS = float(os.getenv("CHECKOUT_PENDING_TTL_SECONDS", "2"))
+
+PAID = "paid"
+PENDING = "pending"
+
+session_status = LRUCache(max_entries=10000, ttl=CHECKOUT_PAID_TTL_SECONDS)
+
+# session id -> task of the verification currently talking to Stripe
+_inflight = {}
+
+def handle_checkout_session(session, db: Session):
+    """Create a paid order from the user's cart for a completed checkout session.
+
+    Does not commit. Returns a result to pass to after_checkout_commit once
+    the caller has committed, or None if no order was created (including
+    when the session already has one).
+    """
+    user_id = session.get('client_reference_id')
+    if not user_id:
+        return None
+
+    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+    if not user:
+        return None
+
+    # Create Order
+    # Note: In a real app, you might want to store more details from the session
+    # For now, we'll create an order based on the user's current cart
+    # This assumes the cart hasn't changed since the checkout session was created
+    # A more robust way is to pass cart items in metadata or retrieve line items from Stripe
+
+    cart_store.store.flush_user(user.id)
+    cart = user.cart
+    if not cart or not cart.items:
+        return None
+
+    total_price = sum(item.product.price * item.quantity for item in cart.items)
+
+    # The unique checkout_session_id makes a second attempt for the same
+    # session (webhook and verify racing, redeliveries) insert nothing; a
+    # concurrent attempt waits here until the first one commits
+    order_id = db.scalar(
+        insert(models.Order)
+        .values(
+            user_id=user.id,
+            total_price=total_price,
+            status=models.OrderStatus.PAID.value,
+            checkout_session_id=session.get('id')
+        )
+        .on_conflict_do_nothing(index_elements=["checkout_session_id"])
+        .returning(models.Order.id)
+    )
+    if order_id is None:
+        return None
+
+    db.execute(insert(models.OrderItem), [
+        {
+            "order_id": order_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "price_at_time": item.product.price
+        }
+        for item in cart.items
+    ])
+    order_rollups.record_order_created(db, models.OrderStatus.PAID, total_price)
+
+    # Decrement Stock; the order is already paid, so short lines are backordered
+    inventory.reserve_stock(
+        db,
+        inventory.merge_lines((item.product_id, item.quantity) for item in cart.items),
+        allow_backorder=True
+    )
+
+    # Clear Cart
+    result = {
+        "session_id": session.get('id'),
+        "user_id": user.id,
+        "product_ids": [item.product_id for item in cart.items],
+        "cart_items": {item.id: item.quantity for item in cart.items}
+    }
+    for item in cart.items:
+        db.delete(item)
+    db.flush()
+    return result
+
+def after_checkout_commit(result):
+    if result is None:
+        return
+    if result["session_id"]:
+        session_status.set(result["session_id"], PAID)
+    cart_store.store.forget_items(result["user_id"], result["cart_items"])
+    catalog_cache.invalidate_products(result["product_ids"])
+
+def _complete_paid_session(session):
+    with SessionLocal() as db:
+        result = handle_checkout_session(session, db)
+        db.commit()
+    after_checkout_commit(result)
+
+async def _verify_and_cache(session_id: str) -> str:
+    try:
+        session = await outbound.stripe_api.call(stripe.checkout.Session.retrieve, session_id)
+        status = PENDING
+        if session.payment_status == 'paid':
+            await run_in_threadpool(_complete_paid_session, session)
+            status = PAID
+        session_status.set(session_id, status, ttl=None if status == PAID else CHECKOUT_PENDING_TTL_SECONDS)
+        return status
+    finally:
+        _inflight.pop(session_id, None)
+
+async def verify_session(session_id: str, db: AsyncSession) -> str:
+    """Return PAID or PENDING for a checkout session, creating its order once paid.
+
+    Answers from the status cache or an existing order when possible;
+    concurrent calls for the same session share one Stripe request.
+    """
+    status = session_status.get(session_id)
+    if status is not None:
+        return status
+
+    if await db.scalar(select(models.Order.id).where(models.Order.checkout_session_id == session_id)) is not None:
+        session_status.set(session_id, PAID)
+        return PAID
+
+    task = _inflight.get(session_id)
+    if task is None:
+        task = asyncio.create_task(_verify_and_cache(session_id))
+        _inflight[session_id] = task
+    # shield: a caller going away must not cancel the shared request
+    return await asyncio.shield(task)
@@ -0,0 +1,64 @@
+"""Image decoding and re-encoding, run in worker processes by app.images.
+
+Kept free of app imports so spawned workers only load Pillow.
+"""
+import io
+import os
+from PIL import Image, ImageOps
+
+# Variant name -> longest side in pixels
+IMAGE_VARIANTS = {
+    "thumbnail": int(os.getenv("IMAGE_THUMBNAIL_SIZE", "160")),
+    "card": int(os.getenv("IMAGE_CARD_SIZE", "480")),
+    "full": int(os.getenv("IMAGE_FULL_SIZE", "1600")),
+}
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# Larger images are rejected before decoding (decompression bombs)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+def _flatten(image):
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+def render_variants(data: bytes):
+    """Decode an upload and return its variants.
+
+    The result maps each name in IMAGE_VARIANTS to width, height and the
+    encoded "jpeg" and "webp" bytes. Orientation from EXIF is applied and
+    all metadata is dropped. Images are never upscaled.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        if source.width * source.height > IMAGE_MAX_PIXELS:
+            raise ValueError("Image is too large")
+        # Let the JPEG decoder downscale while decoding; the largest variant
+        # still gets at least its full size
+        largest = max(IMAGE_VARIANTS.values())
+        source.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if _has_alpha(image) else "RGB")
+    # Drop EXIF, ICC and comments so no encoder copies them over
+    image.info = {}
+
+    variants = {}
+    # Largest first, so each smaller variant is resized from the previous one
+    for name, size in sorted(IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        jpeg, webp = io.BytesIO(), io.BytesIO()
+        (_flatten(image) if image.mode == "RGBA" else image).save(
+            jpeg, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True
+        )
+        image.save(webp, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+        variants[name] = {
+            "width": image.width,
+            "height": image.height,
+            "jpeg": jpeg.getvalue(),
+            "webp": webp.getvalue()
+        }
+    return variants
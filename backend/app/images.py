@@ -0,0 +1,282 @@
+"""Responsive variants for uploaded product images.
+
+Every uploaded original is recorded as an ImageAsset. Worker tasks claim
+pending assets with FOR UPDATE SKIP LOCKED, marking them processing in a
+short transaction of their own, then read the original back from storage and
+render its variants (app.image_processing) on a process pool, so neither the
+upload request nor the event loop waits on decoding. No transaction (or
+pooled connection) is held while rendering and uploading; the result is
+written in a second short transaction. A claim older than
+IMAGE_LEASE_SECONDS is taken to belong to a worker that died and is put back
+in the queue, counting as a failed attempt. Variants are
+stored under the content hash of the original: an identical upload reuses the
+variants of the first one without being decoded again. Finished variants are
+copied onto matching product_images rows, so product reads need no join.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, func, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, catalog_cache, outbound
+from .database import AsyncSessionLocal
+from .image_processing import render_variants
+from .storage import storage, UPLOAD_FOLDER
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_POLL_SECONDS = float(os.getenv("IMAGE_POLL_SECONDS", "5"))
+IMAGE_MAX_ATTEMPTS = int(os.getenv("IMAGE_MAX_ATTEMPTS", "3"))
+IMAGE_LEASE_SECONDS = float(os.getenv("IMAGE_LEASE_SECONDS", "600"))
+
+VARIANT_FORMATS = ("jpeg", "webp")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, so workers don't inherit the server's threads and DB connections
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+async def find_by_hash(db: AsyncSession, sha256: str):
+    """A processed asset with the same content, if there is one."""
+    return await db.scalar(
+        select(models.ImageAsset)
+        .where(models.ImageAsset.sha256 == sha256, models.ImageAsset.status == models.ImageAssetStatus.READY.value)
+        .order_by(models.ImageAsset.id)
+        .limit(1)
+    )
+
+async def register(db: AsyncSession, url: str, sha256: str = None):
+    """Queue an uploaded original for processing. Does not commit."""
+    await db.execute(
+        insert(models.ImageAsset)
+        .values(source_url=url, sha256=sha256)
+        .on_conflict_do_nothing(index_elements=["source_url"])
+    )
+
+async def variants_for(db: AsyncSession, urls):
+    """url -> variants for the given image URLs that have been processed."""
+    if not urls:
+        return {}
+    rows = await db.execute(
+        select(models.ImageAsset.source_url, models.ImageAsset.variants)
+        .where(models.ImageAsset.source_url.in_(urls), models.ImageAsset.status == models.ImageAssetStatus.READY.value)
+    )
+    return dict(rows.all())
+
+async def _render_and_store(data: bytes, sha256: str):
+    rendered = await asyncio.wrap_future(_get_pool().submit(render_variants, data))
+    names = [(name, format) for name in rendered for format in VARIANT_FORMATS]
+    urls = await asyncio.gather(*(
+        storage.put(f"{UPLOAD_FOLDER}/variants/{sha256}/{name}", rendered[name][format], format)
+        for name, format in names
+    ))
+    variants = {name: {"width": variant["width"], "height": variant["height"]} for name, variant in rendered.items()}
+    for (name, format), url in zip(names, urls):
+        variants[name][format] = url
+    return variants
+
+def _retry_or_fail():
+    """Status for an asset whose attempt just failed."""
+    return case(
+        (models.ImageAsset.attempts + 1 >= IMAGE_MAX_ATTEMPTS, models.ImageAssetStatus.FAILED.value),
+        else_=models.ImageAssetStatus.PENDING.value
+    )
+
+async def requeue_stale(db: AsyncSession) -> int:
+    """Put assets whose claim has lapsed back in the queue. Returns how many."""
+    result = await db.execute(
+        update(models.ImageAsset)
+        .where(
+            models.ImageAsset.status == models.ImageAssetStatus.PROCESSING.value,
+            models.ImageAsset.claimed_at < func.now() - timedelta(seconds=IMAGE_LEASE_SECONDS)
+        )
+        .values(
+            attempts=models.ImageAsset.attempts + 1,
+            last_error="Claim expired before processing finished",
+            status=_retry_or_fail(),
+            claimed_at=None
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+async def _claim(db: AsyncSession):
+    """Mark the oldest pending asset as processing and commit.
+
+    Returns (id, source_url, claimed_at), or None if none was pending.
+    """
+    pending = (
+        select(models.ImageAsset.id)
+        .where(models.ImageAsset.status == models.ImageAssetStatus.PENDING.value)
+        .order_by(models.ImageAsset.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    claimed = (await db.execute(
+        update(models.ImageAsset)
+        .where(models.ImageAsset.id == pending)
+        .values(status=models.ImageAssetStatus.PROCESSING.value, claimed_at=func.now())
+        .returning(models.ImageAsset.id, models.ImageAsset.source_url, models.ImageAsset.claimed_at)
+    )).first()
+    await db.commit()
+    return claimed
+
+def _update_claimed(asset_id, claimed_at):
+    # Matches nothing once the claim has lapsed and the asset was requeued,
+    # so a late worker can't overwrite a newer attempt
+    return update(models.ImageAsset).where(
+        models.ImageAsset.id == asset_id,
+        models.ImageAsset.status == models.ImageAssetStatus.PROCESSING.value,
+        models.ImageAsset.claimed_at == claimed_at
+    )
+
+async def process_next(db: AsyncSession) -> bool:
+    """Claim and process one pending asset. Returns False if none was pending."""
+    claimed = await _claim(db)
+    if claimed is None:
+        return False
+
+    asset_id, source_url, claimed_at = claimed
+    try:
+        data = await storage.read(source_url)
+        sha256 = content_hash(data)
+        existing = await find_by_hash(db, sha256)
+        variants = existing.variants if existing is not None else None
+        # Give the connection back before rendering and uploading
+        await db.rollback()
+        if variants is None:
+            variants = await _render_and_store(data, sha256)
+    except outbound.ProviderUnavailable:
+        # Not the image's fault: put it back without using an attempt
+        await db.rollback()
+        await db.execute(
+            _update_claimed(asset_id, claimed_at)
+            .values(status=models.ImageAssetStatus.PENDING.value, claimed_at=None)
+        )
+        await db.commit()
+        raise
+    except Exception as e:
+        await db.rollback()
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()[:2000]
+        await db.execute(
+            _update_claimed(asset_id, claimed_at)
+            .values(
+                attempts=models.ImageAsset.attempts + 1,
+                last_error=error,
+                status=_retry_or_fail(),
+                claimed_at=None
+            )
+        )
+        await db.commit()
+        print(f"Warning: Could not process image {source_url}. Error: {error}")
+        return True
+
+    finished = await db.scalar(
+        _update_claimed(asset_id, claimed_at)
+        .values(
+            sha256=sha256,
+            variants=variants,
+            status=models.ImageAssetStatus.READY.value,
+            attempts=models.ImageAsset.attempts + 1,
+            last_error=None,
+            claimed_at=None,
+            processed_at=datetime.now(timezone.utc)
+        )
+        .returning(models.ImageAsset.id)
+    )
+    if finished is None:
+        await db.rollback()
+        print(f"Warning: Claim on image {source_url} expired before it was processed; discarding the result")
+        return True
+    product_ids = (await db.scalars(
+        update(models.ProductImage)
+        .where(models.ProductImage.image_url == source_url)
+        .values(variants=variants)
+        .returning(models.ProductImage.product_id)
+    )).all()
+    await db.commit()
+    if product_ids:
+        catalog_cache.invalidate_products(set(product_ids))
+    return True
+
+async def stats(db: AsyncSession):
+    rows = (await db.execute(
+        select(models.ImageAsset.status, func.count()).group_by(models.ImageAsset.status)
+    )).all()
+    return {status: count for status, count in rows}
+
+class ImageWorkers:
+    """Tasks on the event loop draining the image_assets table.
+
+    The decoding itself runs in the process pool, one job per task.
+    """
+
+    def __init__(self, size, poll_interval):
+        self.size = size
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.size)]
+
+    async def stop(self):
+        # An asset being processed stays claimed and is requeued once its
+        # lease expires
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            delay = self.poll_interval
+            # Cleared before draining, so a notify during the drain isn't lost
+            self._wakeup.clear()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await requeue_stale(db)
+                    while await process_next(db):
+                        pass
+            except outbound.ProviderUnavailable as e:
+                delay = e.retry_after
+            except Exception as e:
+                print(f"Warning: Image worker failed. Error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+workers = ImageWorkers(IMAGE_WORKERS, IMAGE_POLL_SECONDS)
@@ -0,0 +1,264 @@
+import os
+import threading
+from sqlalchemy import text, select, delete
+from sqlalchemy.orm import Session
+from . import models, catalog_cache
+from .database import SessionLocal
+
+# Default number of stock shards for a product put into flash-sale mode
+FLASH_SALE_SHARDS = int(os.getenv("FLASH_SALE_SHARDS", "16"))
+# How often shard stock is folded back into products.stock (0 disables the
+# background job; reconcile_flash_sales.py can still be run by hand)
+FLASH_SALE_RECONCILE_SECONDS = float(os.getenv("FLASH_SALE_RECONCILE_SECONDS", "5"))
+
+class ProductNotFound(Exception):
+    def __init__(self, product_id):
+        super().__init__(product_id)
+        self.product_id = product_id
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, product_name):
+        super().__init__(product_id)
+        self.product_id = product_id
+        self.product_name = product_name
+
+# Rows are locked in id order first so concurrent multi-product orders can't
+# deadlock, then every line is decremented only if enough stock is left.
+# Flash-sale products are skipped here and reserved from their shards.
+RESERVE_STOCK_SQL = text("""
+    WITH requested AS (
+        SELECT * FROM unnest(CAST(:product_ids AS integer[]), CAST(:quantities AS integer[])) AS r(id, quantity)
+    ), locked AS (
+        SELECT p.id FROM products p
+        WHERE p.id = ANY(CAST(:product_ids AS integer[])) AND NOT p.flash_sale
+        ORDER BY p.id
+        FOR UPDATE
+    )
+    UPDATE products p
+    SET stock = p.stock - requested.quantity
+    FROM requested
+    JOIN locked ON locked.id = requested.id
+    WHERE p.id = requested.id AND p.stock >= requested.quantity AND NOT p.flash_sale
+    RETURNING p.id, p.name, p.price
+""")
+
+# Take the whole quantity from one random shard that has enough, skipping
+# shards other buyers hold
+RESERVE_FROM_SHARD_SQL = text("""
+    UPDATE product_stock_shards s
+    SET stock = s.stock - :quantity
+    WHERE (s.product_id, s.shard) = (
+        SELECT product_id, shard FROM product_stock_shards
+        WHERE product_id = :product_id AND stock >= :quantity
+        ORDER BY random()
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING s.shard
+""")
+
+LOCK_SHARDS_SQL = text("""
+    SELECT shard, stock FROM product_stock_shards
+    WHERE product_id = :product_id
+    ORDER BY shard
+    FOR UPDATE
+""")
+
+SET_SHARDS_SQL = text("""
+    UPDATE product_stock_shards s
+    SET stock = s.stock - t.take
+    FROM unnest(CAST(:shards AS integer[]), CAST(:takes AS integer[])) AS t(shard, take)
+    WHERE s.product_id = :product_id AND s.shard = t.shard
+""")
+
+def merge_lines(lines):
+    """Sum quantities per product from (product_id, quantity) pairs."""
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+def reserve_stock(db: Session, quantities: dict, allow_backorder: bool = False):
+    """Decrement stock for {product_id: quantity}.
+
+    Returns {product_id: (name, price)}. Raises ProductNotFound or
+    InsufficientStock if any line can't be reserved; stock decremented for
+    the other lines is only undone when the caller rolls back. With
+    allow_backorder, lines without enough stock are taken anyway and stock
+    goes negative (for orders that are already paid).
+    """
+    product_ids = sorted(quantities)
+    rows = db.execute(RESERVE_STOCK_SQL, {
+        "product_ids": product_ids,
+        "quantities": [quantities[product_id] for product_id in product_ids]
+    }).all()
+    reserved = {row.id: (row.name, row.price) for row in rows}
+    if len(reserved) == len(product_ids):
+        return reserved
+
+    # Lines left over are flash-sale products, missing products or lines
+    # without enough stock
+    missing = [product_id for product_id in product_ids if product_id not in reserved]
+    products = {row.id: row for row in db.execute(
+        select(models.Product.id, models.Product.name, models.Product.price, models.Product.flash_sale)
+        .where(models.Product.id.in_(missing))
+    ).all()}
+    for product_id in missing:
+        product = products.get(product_id)
+        if product is None:
+            raise ProductNotFound(product_id)
+        quantity = quantities[product_id]
+        if product.flash_sale and _reserve_from_shards(db, product_id, quantity):
+            pass
+        elif allow_backorder:
+            _backorder(db, product, quantity)
+        else:
+            raise InsufficientStock(product_id, product.name)
+        reserved[product_id] = (product.name, product.price)
+    return reserved
+
+def _reserve_from_shards(db: Session, product_id: int, quantity: int) -> bool:
+    if db.execute(RESERVE_FROM_SHARD_SQL, {"product_id": product_id, "quantity": quantity}).first():
+        return True
+
+    # No single free shard had enough: wait for all shards and draw the
+    # quantity across them
+    shards = db.execute(LOCK_SHARDS_SQL, {"product_id": product_id}).all()
+    if not shards:
+        # Flash sale was turned off meanwhile; stock is back on the product
+        return bool(db.execute(RESERVE_STOCK_SQL, {"product_ids": [product_id], "quantities": [quantity]}).first())
+    if sum(max(shard.stock, 0) for shard in shards) < quantity:
+        return False
+
+    takes = {}
+    remaining = quantity
+    for shard in shards:
+        if remaining == 0:
+            break
+        take = min(max(shard.stock, 0), remaining)
+        if take:
+            takes[shard.shard] = take
+            remaining -= take
+    db.execute(SET_SHARDS_SQL, {"product_id": product_id, "shards": list(takes), "takes": list(takes.values())})
+    return True
+
+def _backorder(db: Session, product, quantity: int):
+    print(f"Warning: Backordering {quantity} x product {product.id} ({product.name})")
+    if product.flash_sale:
+        shard = db.execute(text("""
+            UPDATE product_stock_shards SET stock = stock - :quantity
+            WHERE product_id = :product_id
+              AND shard = (SELECT shard FROM product_stock_shards WHERE product_id = :product_id ORDER BY random() LIMIT 1)
+            RETURNING shard
+        """), {"product_id": product.id, "quantity": quantity}).first()
+        if shard:
+            return
+    db.execute(text("UPDATE products SET stock = stock - :quantity WHERE id = :product_id"),
+               {"product_id": product.id, "quantity": quantity})
+
+def _split(total: int, shards: int):
+    base, extra = divmod(total, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+def _lock_product(db: Session, product_id: int):
+    product = db.scalar(select(models.Product).where(models.Product.id == product_id).with_for_update())
+    if product is None:
+        raise ProductNotFound(product_id)
+    return product
+
+def enable_flash_sale(db: Session, product_id: int, shards: int = FLASH_SALE_SHARDS):
+    """Move the product's stock into `shards` shard rows. The caller commits."""
+    product = _lock_product(db, product_id)
+    total = product.stock or 0
+    if product.flash_sale:
+        # Re-sharding: start from what is left in the current shards
+        total = sum(row.stock for row in db.execute(LOCK_SHARDS_SQL, {"product_id": product_id}).all())
+        db.execute(delete(models.ProductStockShard).where(models.ProductStockShard.product_id == product_id))
+    db.add_all(
+        models.ProductStockShard(product_id=product_id, shard=shard, stock=stock)
+        for shard, stock in enumerate(_split(total, shards))
+    )
+    product.flash_sale = True
+    product.stock = total
+    return product
+
+def disable_flash_sale(db: Session, product_id: int):
+    """Fold shard stock back into products.stock. The caller commits."""
+    product = _lock_product(db, product_id)
+    if not product.flash_sale:
+        return product
+    shards = db.execute(LOCK_SHARDS_SQL, {"product_id": product_id}).all()
+    db.execute(delete(models.ProductStockShard).where(models.ProductStockShard.product_id == product_id))
+    product.flash_sale = False
+    product.stock = sum(row.stock for row in shards)
+    return product
+
+def reconcile_flash_sales(db: Session):
+    """Write shard totals to products.stock and even out the shards.
+
+    Commits after each product so shard locks are held briefly. Returns
+    {product_id: stock} for the products that were reconciled.
+    """
+    reconciled = {}
+    product_ids = db.scalars(select(models.Product.id).where(models.Product.flash_sale)).all()
+    for product_id in product_ids:
+        # Product row before shards, the same order disable_flash_sale uses
+        locked = db.execute(
+            text("SELECT id FROM products WHERE id = :product_id AND flash_sale FOR UPDATE"),
+            {"product_id": product_id}
+        ).first()
+        shards = db.execute(LOCK_SHARDS_SQL, {"product_id": product_id}).all() if locked else []
+        if not shards:
+            db.rollback()
+            continue
+        total = sum(row.stock for row in shards)
+        balanced = _split(total, len(shards))
+        db.execute(SET_SHARDS_SQL, {
+            "product_id": product_id,
+            "shards": [row.shard for row in shards],
+            "takes": [row.stock - stock for row, stock in zip(shards, balanced)]
+        })
+        db.execute(text("UPDATE products SET stock = :stock WHERE id = :product_id"),
+                   {"product_id": product_id, "stock": total})
+        db.commit()
+        reconciled[product_id] = total
+    return reconciled
+
+class FlashSaleReconciler:
+    """Background thread running reconcile_flash_sales on an interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_stock = {}
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="flash-sale-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with SessionLocal() as db:
+                    reconciled = reconcile_flash_sales(db)
+            except Exception as e:
+                print(f"Warning: Could not reconcile flash-sale stock. Error: {e}")
+                continue
+            # Only products whose displayed stock moved need new catalog entries
+            changed = [product_id for product_id, stock in reconciled.items() if self._last_stock.get(product_id) != stock]
+            self._last_stock = reconciled
+            if changed:
+                catalog_cache.invalidate_products(changed)
+
+reconciler = FlashSaleReconciler(FLASH_SALE_RECONCILE_SECONDS)
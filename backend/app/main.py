@@ -1,7 +1,18 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 from sqlalchemy import text
-from .database import engine, Base
+from .database import engine, async_engine, Base, SessionLocal
+from .models import PRODUCT_SEARCH_VECTOR_SQL
+from . import visitor_buffer, order_rollups, query_stats, auth_utils, cart_store, inventory, stripe_events, images, metrics, profiling
+from .provinces import seed_provinces
+from .storage import storage
 from .routers import auth, products, orders, analytics, cart, users, payments, upload
 
 # Enable PostGIS extension if not exists
@@ -12,10 +23,91 @@ try:
 except Exception as e:
     print(f"Warning: Could not enable PostGIS extension. Error: {e}")
 
+# Enable pg_trgm for typo-tolerant product search
+try:
+    with engine.connect() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.commit()
+except Exception as e:
+    print(f"Warning: Could not enable pg_trgm extension. Error: {e}")
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+# create_all() only creates missing tables, so columns and indexes added
+# to existing tables are applied here
+SCHEMA_UPGRADES = [
+    "ALTER TABLE visitor_locations ADD COLUMN IF NOT EXISTS province_id INTEGER REFERENCES provinces(id)",
+    "CREATE INDEX IF NOT EXISTS ix_visitor_locations_province_id ON visitor_locations (province_id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_products_price_id ON products (price, id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_id ON products (name, id)",
+    f"ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({PRODUCT_SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_products_description_trgm ON products USING gin (description gin_trgm_ops)",
+    # Merge duplicate cart lines before enforcing one row per (cart, product)
+    """UPDATE cart_items c SET quantity = d.quantity
+       FROM (SELECT min(id) AS id, sum(quantity) AS quantity FROM cart_items
+             GROUP BY cart_id, product_id HAVING count(*) > 1) d
+       WHERE c.id = d.id""",
+    """DELETE FROM cart_items a USING cart_items b
+       WHERE a.cart_id = b.cart_id AND a.product_id = b.product_id AND a.id > b.id""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_product ON cart_items (cart_id, product_id)",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS flash_sale BOOLEAN NOT NULL DEFAULT false",
+    "CREATE INDEX IF NOT EXISTS ix_products_flash_sale ON products (id) WHERE flash_sale",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS checkout_session_id VARCHAR",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_orders_checkout_session_id ON orders (checkout_session_id)",
+    "ALTER TABLE product_images ADD COLUMN IF NOT EXISTS variants JSONB",
+    "CREATE INDEX IF NOT EXISTS ix_product_images_image_url ON product_images (image_url)",
+    "ALTER TABLE image_assets ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS ix_image_assets_processing ON image_assets (claimed_at) WHERE status = 'processing'",
+]
+
+try:
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+except Exception as e:
+    print(f"Warning: Could not apply schema upgrades. Error: {e}")
+
+# Seed reference data
+try:
+    with engine.begin() as connection:
+        seed_provinces(connection)
+except Exception as e:
+    print(f"Warning: Could not seed provinces. Error: {e}")
+
+# Build order rollups for databases that predate them
+try:
+    with SessionLocal() as db:
+        order_rollups.ensure_populated(db)
+except Exception as e:
+    print(f"Warning: Could not build order rollups. Error: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    profiling.install(asyncio.get_running_loop())
+    if visitor_buffer.VISITOR_INGEST_MODE == "buffered":
+        visitor_buffer.buffer.start()
+    cart_store.store.start()
+    inventory.reconciler.start()
+    stripe_events.workers.start()
+    images.workers.start()
+    yield
+    await images.workers.stop()
+    await run_in_threadpool(images.shutdown_pool)
+    await run_in_threadpool(stripe_events.workers.stop)
+    # Drain queued visitor points before the process exits
+    await run_in_threadpool(visitor_buffer.buffer.stop)
+    # Write back carts held by the in-memory cart store
+    await run_in_threadpool(cart_store.store.stop)
+    await run_in_threadpool(inventory.reconciler.stop)
+    await run_in_threadpool(auth_utils.shutdown_hash_pool)
+    await run_in_threadpool(profiling.sampler.stop)
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS
 origins = [
@@ -24,6 +116,11 @@ origins = [
     "https://iot-shop.onrender.com"
 ]
 
+def _route_template(request: Request):
+    # The matched route's path template keeps label values bounded
+    route = request.scope.get("route")
+    return route.path if route else "<unmatched>"
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -32,6 +129,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    # One middleware for query stats and metrics; each extra layer costs latency
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    profile = profiling.start(request)
+    try:
+        with query_stats.track() as stats:
+            response = await call_next(request)
+    except Exception:
+        route = _route_template(request)
+        metrics.REQUEST_EXCEPTIONS.inc(request.method, route)
+        metrics.REQUESTS.inc(request.method, route, "500")
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, route)
+        if profile is not None:
+            profiling.finish(profile, route, 500, stats)
+        raise
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.inc(amount=-1)
+
+    route = _route_template(request)
+    metrics.REQUESTS.inc(request.method, route, str(response.status_code))
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, route)
+    query_stats.record_route(route, stats)
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profiling.finish(profile, route, response.status_code, stats).id
+    if query_stats.DEBUG_QUERY_HEADERS:
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.duration * 1000:.2f}"
+    return response
+
 app.include_router(auth.router)
 app.include_router(products.router)
 app.include_router(orders.router)
@@ -41,6 +169,15 @@ app.include_router(users.router)
 app.include_router(payments.router)
 app.include_router(upload.router)
 
+# Files written by the local storage backend
+if storage.name == "local":
+    os.makedirs(storage.directory, exist_ok=True)
+    app.mount(storage.base_url, StaticFiles(directory=storage.directory), name="media")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
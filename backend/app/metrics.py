@@ -0,0 +1,176 @@
+"""Process metrics in the Prometheus text exposition format.
+
+Counters and histograms are recorded into a per-thread shard, so the hot
+path is a couple of dict operations with no lock; shards are only summed
+when /metrics is scraped. A scrape can see a histogram mid-update on another
+thread (count one ahead of its buckets), which Prometheus tolerates.
+
+Values that already live elsewhere (pool sizes, breaker states) are read at
+scrape time by collectors that modules add with register_collector.
+Labels must come from bounded sets: route templates, never raw paths.
+"""
+import bisect
+import math
+import threading
+import anyio.to_thread
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = {}
+        with _shards_lock:
+            _shards.append(shard)
+        _local.shard = shard
+        return shard
+
+class Counter:
+    """Monotonic count per label set. Also used for up/down gauges via inc(-1)."""
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=(), type=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        if type:
+            self.type = type
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        shard = _shard()
+        values = shard.get(self)
+        if values is None:
+            values = shard[self] = {}
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in list(_shards):
+            values = shard.get(self)
+            if values:
+                for labels, value in values.copy().items():
+                    totals[labels] = totals.get(labels, 0) + value
+        return [(dict(zip(self.labelnames, labels)), value) for labels, value in totals.items()]
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        shard = _shard()
+        values = shard.get(self)
+        if values is None:
+            values = shard[self] = {}
+        # Per-bucket counts (not cumulative), then the +Inf bucket, sum and count
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def collect(self):
+        totals = {}
+        for shard in list(_shards):
+            values = shard.get(self)
+            if values:
+                for labels, counts in values.copy().items():
+                    total = totals.get(labels)
+                    if total is None:
+                        totals[labels] = list(counts)
+                    else:
+                        for index, count in enumerate(counts):
+                            total[index] += count
+        samples = []
+        for labels, counts in totals.items():
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(("_bucket", {**base, "le": _format_value(bound)}, cumulative))
+            samples.append(("_sum", base, counts[-2]))
+            samples.append(("_count", base, counts[-1]))
+        return samples
+
+def register_collector(collect):
+    """Add a function returning [(name, type, help, [(labels, value), ...]), ...]."""
+    _collectors.append(collect)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def render():
+    """All metrics as Prometheus text. Call from the event loop (reads the thread limiter)."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        if metric.type == "histogram":
+            for suffix, labels, value in metric.collect():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        else:
+            for labels, value in metric.collect():
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Warning: Metrics collector {getattr(collect, '__name__', collect)} failed. Error: {e}")
+            continue
+        for name, type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# --- HTTP ---
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time until the response starts, by route template.", ("method", "route"))
+REQUESTS_IN_FLIGHT = Counter("http_requests_in_flight", "Requests currently being handled.", type="gauge")
+REQUEST_EXCEPTIONS = Counter("http_request_exceptions_total", "Requests that raised an unhandled exception.", ("method", "route"))
+
+# --- Outbound providers ---
+OUTBOUND_LATENCY = Histogram(
+    "outbound_request_duration_seconds",
+    "Calls to external providers, including waiting for a concurrency slot.",
+    ("provider", "outcome"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+OUTBOUND_REJECTED = Counter("outbound_rejected_total", "Calls refused by an open circuit breaker.", ("provider",))
+
+def _threadpool():
+    # Sync endpoints and run_in_threadpool share anyio's default limiter
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return [
+        ("threadpool_threads_busy", "gauge", "Worker threads running sync handlers and blocking calls.",
+         [({}, limiter.borrowed_tokens)]),
+        ("threadpool_threads_max", "gauge", "Size of the worker thread limiter.", [({}, limiter.total_tokens)]),
+        ("threadpool_tasks_waiting", "gauge", "Tasks waiting for a worker thread.", [({}, limiter.statistics().tasks_waiting)]),
+    ]
+
+register_collector(_threadpool)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, Enum, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from geoalchemy2 import Geometry
 import enum
@@ -16,6 +17,24 @@ class OrderStatus(str, enum.Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+class ImageAssetStatus(str, enum.Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+class StripeEventStatus(str, enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    DEAD = "dead"
+
+# Text search configuration and document used for products.search_vector
+PRODUCT_SEARCH_CONFIG = "english"
+PRODUCT_SEARCH_VECTOR_SQL = (
+    f"setweight(to_tsvector('{PRODUCT_SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+    f"setweight(to_tsvector('{PRODUCT_SEARCH_CONFIG}', coalesce(description, '')), 'B')"
+)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -39,17 +58,49 @@ class Product(Base):
     price = Column(Float, nullable=False)
     stock = Column(Integer, default=0)
     category = Column(String, index=True, nullable=True)
+    # Stock is held in product_stock_shards while a flash sale is on; stock
+    # above is then the last reconciled total
+    flash_sale = Column(Boolean, nullable=False, default=False, server_default="false")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Maintained by Postgres on every insert/update of name or description;
+    # deferred so product loads don't fetch it
+    search_vector = deferred(Column(TSVECTOR, Computed(PRODUCT_SEARCH_VECTOR_SQL, persisted=True)))
 
     order_items = relationship("OrderItem", back_populates="product")
     images = relationship("ProductImage", back_populates="product", cascade="all, delete-orphan")
 
+    @property
+    def image_variants(self):
+        # Parallel to images; None for images that have not been processed
+        return [image.variants for image in self.images]
+
+    __table_args__ = (
+        # Composite indexes backing keyset pagination for each sort order
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        # Full-text and trigram (pg_trgm) search indexes
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_products_description_trgm", "description", postgresql_using="gin", postgresql_ops={"description": "gin_trgm_ops"}),
+        # Lets the flash sale reconciler find the (few) products on sale without a scan
+        Index("ix_products_flash_sale", "id", postgresql_where=flash_sale),
+    )
+
+class ProductStockShard(Base):
+    __tablename__ = "product_stock_shards"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
 class ProductImage(Base):
     __tablename__ = "product_images"
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
-    image_url = Column(String, nullable=False)
+    image_url = Column(String, nullable=False, index=True)
+    # Copied from the image's ImageAsset once it has been processed
+    variants = Column(JSONB, nullable=True)
 
     product = relationship("Product", back_populates="images")
 
@@ -74,7 +125,9 @@ class Order(Base):
     address_id = Column(Integer, ForeignKey("addresses.id"), nullable=True)
     total_price = Column(Float, default=0.0)
     status = Column(String, default=OrderStatus.PENDING)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # Stripe checkout session that paid for the order; at most one order each
+    checkout_session_id = Column(String, nullable=True, unique=True, index=True)
 
     user = relationship("User", back_populates="orders")
     address = relationship("Address", back_populates="orders")
@@ -92,6 +145,21 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
 
+class OrderStatusRollup(Base):
+    __tablename__ = "order_status_rollups"
+
+    status = Column(String, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class OrderTimeRollup(Base):
+    __tablename__ = "order_time_rollups"
+
+    granularity = Column(String, primary_key=True) # hour, day
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
 class Cart(Base):
     __tablename__ = "carts"
 
@@ -101,10 +169,14 @@ class Cart(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     user = relationship("User", back_populates="cart")
-    items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
+    items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan", order_by="CartItem.id")
 
 class CartItem(Base):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # One row per product in a cart; adds upsert into it
+        Index("uq_cart_items_cart_product", "cart_id", "product_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     cart_id = Column(Integer, ForeignKey("carts.id"))
@@ -120,4 +192,53 @@ class VisitorLocation(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     location = Column(Geometry('POINT', srid=4326), nullable=False)
+    province_id = Column(Integer, ForeignKey("provinces.id"), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Province(Base):
+    __tablename__ = "provinces"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    location = Column(Geometry('POINT', srid=4326, spatial_index=True), nullable=False)
+
+class StripeEvent(Base):
+    """Incoming Stripe webhook event, processed by app.stripe_events workers."""
+    __tablename__ = "events"
+
+    id = Column(String, primary_key=True) # Stripe event id
+    type = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    status = Column(String, nullable=False, default=StripeEventStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(String, nullable=True)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Workers claim the oldest due pending event
+        Index("ix_events_pending_due", "next_attempt_at", postgresql_where=(status == StripeEventStatus.PENDING.value)),
+    )
+
+class ImageAsset(Base):
+    """An uploaded original and its resized variants, built by app.images workers."""
+    __tablename__ = "image_assets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_url = Column(String, unique=True, nullable=False)
+    # Content hash of the original, known once it has been read
+    sha256 = Column(String, nullable=True, index=True)
+    status = Column(String, nullable=False, default=ImageAssetStatus.PENDING)
+    variants = Column(JSONB, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    # When a worker claimed the asset; the claim lapses after IMAGE_LEASE_SECONDS
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_image_assets_pending", "id", postgresql_where=(status == ImageAssetStatus.PENDING.value)),
+        Index("ix_image_assets_processing", "claimed_at", postgresql_where=(status == ImageAssetStatus.PROCESSING.value)),
+    )
@@ -0,0 +1,104 @@
+import math
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from . import models
+
+# Time buckets maintained in order_time_rollups (date_trunc field names)
+GRANULARITIES = ("hour", "day")
+
+def _status_value(status):
+    return getattr(status, "value", status)
+
+def _bump_status(db: Session, status, order_count, revenue):
+    table = models.OrderStatusRollup
+    stmt = insert(table).values(status=_status_value(status), order_count=order_count, revenue=revenue)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.status],
+        set_={
+            "order_count": table.order_count + stmt.excluded.order_count,
+            "revenue": table.revenue + stmt.excluded.revenue
+        }
+    )
+    db.execute(stmt)
+
+def _bump_time_buckets(db: Session, order_count, revenue):
+    table = models.OrderTimeRollup
+    for granularity in GRANULARITIES:
+        # now() is the transaction start time, the same value the order's
+        # created_at default receives
+        stmt = insert(table).values(
+            granularity=granularity,
+            bucket_start=func.date_trunc(granularity, func.now()),
+            order_count=order_count,
+            revenue=revenue
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.granularity, table.bucket_start],
+            set_={
+                "order_count": table.order_count + stmt.excluded.order_count,
+                "revenue": table.revenue + stmt.excluded.revenue
+            }
+        )
+        db.execute(stmt)
+
+def record_order_created(db: Session, status, total_price):
+    """Count a new order. Must run in the order's transaction; never commits."""
+    _bump_status(db, status, 1, total_price or 0.0)
+    _bump_time_buckets(db, 1, total_price or 0.0)
+
+def rebuild(db: Session):
+    """Recompute all rollups from the orders table.
+
+    Returns the status rows whose stored values differed from the recomputed
+    ones, as (status, stored, actual) tuples.
+    """
+    # Block concurrent rollup updates so orders committed while rebuilding
+    # are neither lost nor counted twice
+    db.execute(text("LOCK TABLE order_status_rollups, order_time_rollups IN EXCLUSIVE MODE"))
+
+    stored = {
+        row.status: (row.order_count, row.revenue)
+        for row in db.query(models.OrderStatusRollup).all()
+    }
+    actual = {
+        status: (count, revenue)
+        for status, count, revenue in db.query(
+            models.Order.status,
+            func.count(models.Order.id),
+            func.coalesce(func.sum(models.Order.total_price), 0.0)
+        ).group_by(models.Order.status).all()
+    }
+
+    drift = []
+    for status in sorted(set(stored) | set(actual), key=str):
+        stored_count, stored_revenue = stored.get(status, (0, 0.0))
+        actual_count, actual_revenue = actual.get(status, (0, 0.0))
+        if stored_count != actual_count or not math.isclose(stored_revenue, actual_revenue, abs_tol=0.01):
+            drift.append((status, stored.get(status), actual.get(status)))
+
+    db.query(models.OrderStatusRollup).delete()
+    db.query(models.OrderTimeRollup).delete()
+    db.execute(text("""
+        INSERT INTO order_status_rollups (status, order_count, revenue)
+        SELECT status, count(*), coalesce(sum(total_price), 0)
+        FROM orders
+        GROUP BY status
+    """))
+    for granularity in GRANULARITIES:
+        db.execute(text("""
+            INSERT INTO order_time_rollups (granularity, bucket_start, order_count, revenue)
+            SELECT :granularity, date_trunc(:granularity, created_at), count(*), coalesce(sum(total_price), 0)
+            FROM orders
+            GROUP BY 2
+        """), {"granularity": granularity})
+
+    db.commit()
+    return drift
+
+def ensure_populated(db: Session):
+    if db.query(models.OrderStatusRollup).first() is not None:
+        return
+    if db.query(models.Order.id).first() is None:
+        return
+    rebuild(db)
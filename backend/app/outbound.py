@@ -0,0 +1,179 @@
+"""Calls to external providers (Stripe, Cloudinary).
+
+The provider SDKs are blocking, so calls run on worker threads with a
+per-provider concurrency cap (waiting for a slot doesn't hold a thread) and
+timeouts configured on the SDK's HTTP client, which keeps connections alive
+between calls. A circuit breaker per provider fails fast with
+ProviderUnavailable after repeated failures, then lets a single trial call
+through once OUTBOUND_BREAKER_RESET_SECONDS have passed.
+
+STRIPE_API_BASE and CLOUDINARY_UPLOAD_PREFIX point the SDKs elsewhere, e.g.
+at fake_providers.py for offline latency and failure testing.
+"""
+import functools
+import os
+import threading
+import time
+import anyio
+import cloudinary
+import cloudinary.exceptions
+import stripe
+from . import metrics
+
+OUTBOUND_BREAKER_FAILURES = int(os.getenv("OUTBOUND_BREAKER_FAILURES", "5"))
+OUTBOUND_BREAKER_RESET_SECONDS = float(os.getenv("OUTBOUND_BREAKER_RESET_SECONDS", "30"))
+
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "10"))
+STRIPE_MAX_CONCURRENCY = int(os.getenv("STRIPE_MAX_CONCURRENCY", "20"))
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+
+CLOUDINARY_TIMEOUT_SECONDS = float(os.getenv("CLOUDINARY_TIMEOUT_SECONDS", "30"))
+CLOUDINARY_MAX_CONCURRENCY = int(os.getenv("CLOUDINARY_MAX_CONCURRENCY", "8"))
+CLOUDINARY_UPLOAD_PREFIX = os.getenv("CLOUDINARY_UPLOAD_PREFIX")
+
+class ProviderUnavailable(Exception):
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is unavailable")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Return 0 if the call may proceed, else seconds until it may."""
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            # Half-open: one trial call decides whether to close again
+            if self._trial_running:
+                return 1
+            self.state = "half_open"
+            self._trial_running = True
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_ignored(self):
+        # The call finished with a client error: says nothing about the provider
+        with self._lock:
+            self._trial_running = False
+
+class Provider:
+    def __init__(self, name, max_concurrency, client_errors=()):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        # Exceptions caused by the request itself, which don't trip the breaker
+        self.client_errors = client_errors
+        self.breaker = CircuitBreaker(OUTBOUND_BREAKER_FAILURES, OUTBOUND_BREAKER_RESET_SECONDS)
+        self._limiter = None
+        self.calls = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def limiter(self):
+        # Created lazily: it must be made inside the running event loop
+        if self._limiter is None:
+            self._limiter = anyio.CapacityLimiter(self.max_concurrency)
+        return self._limiter
+
+    async def call(self, fn, *args, **kwargs):
+        retry_after = self.breaker.before_call()
+        if retry_after:
+            self.rejected += 1
+            metrics.OUTBOUND_REJECTED.inc(self.name)
+            raise ProviderUnavailable(self.name, retry_after)
+
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            result = await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=self.limiter)
+        except self.client_errors:
+            self.breaker.record_ignored()
+            metrics.OUTBOUND_LATENCY.observe(time.perf_counter() - start, self.name, "client_error")
+            raise
+        except Exception:
+            self.failed += 1
+            self.breaker.record_failure()
+            metrics.OUTBOUND_LATENCY.observe(time.perf_counter() - start, self.name, "error")
+            raise
+        except BaseException:
+            # Cancelled while waiting or running; don't leave a trial pending
+            self.breaker.record_ignored()
+            raise
+        self.breaker.record_success()
+        metrics.OUTBOUND_LATENCY.observe(time.perf_counter() - start, self.name, "ok")
+        return result
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self._limiter.borrowed_tokens if self._limiter else 0,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+# Stripe: timeouts and keep-alive come from its default HTTP client
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+_new_http_client = getattr(stripe, "new_default_http_client", None) or stripe.http_client.new_default_http_client
+stripe.default_http_client = _new_http_client(timeout=STRIPE_TIMEOUT_SECONDS)
+
+stripe_api = Provider(
+    "stripe",
+    STRIPE_MAX_CONCURRENCY,
+    client_errors=(stripe.error.InvalidRequestError, stripe.error.CardError)
+)
+
+# Cloudinary: uploads pass a timeout per call; its urllib3 pool is shared
+if CLOUDINARY_UPLOAD_PREFIX:
+    cloudinary.config(upload_prefix=CLOUDINARY_UPLOAD_PREFIX)
+
+cloudinary_api = Provider(
+    "cloudinary",
+    CLOUDINARY_MAX_CONCURRENCY,
+    client_errors=(cloudinary.exceptions.BadRequest,)
+)
+
+def stats():
+    return {provider.name: provider.stats() for provider in (stripe_api, cloudinary_api)}
+
+BREAKER_STATES = ("closed", "half_open", "open")
+
+def _metrics():
+    providers = stats()
+    return [
+        ("outbound_in_flight", "gauge", "Provider calls running or waiting for a slot.",
+         [({"provider": name}, provider["in_flight"]) for name, provider in providers.items()]),
+        ("outbound_breaker_state", "gauge", "1 for the current circuit breaker state of each provider.",
+         [({"provider": name, "state": state}, int(provider["state"] == state))
+          for name, provider in providers.items() for state in BREAKER_STATES]),
+    ]
+
+metrics.register_collector(_metrics)
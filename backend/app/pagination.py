@@ -0,0 +1,59 @@
+import base64
+import json
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+class InvalidCursor(Exception):
+    pass
+
+def encode_cursor(sort_key: str, values: list) -> str:
+    payload = json.dumps({"s": sort_key, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+# Bounds of the int4 id column; larger values fail in the driver, not here
+ID_MIN, ID_MAX = -2 ** 31, 2 ** 31 - 1
+
+def _coerce(value, value_type):
+    # bool is an int in Python, but never a valid cursor value
+    if isinstance(value, bool):
+        raise InvalidCursor()
+    if value_type is int:
+        if not isinstance(value, int) or not ID_MIN <= value <= ID_MAX:
+            raise InvalidCursor()
+        return value
+    if value_type is float:
+        if not isinstance(value, (int, float)):
+            raise InvalidCursor()
+        return float(value)
+    # Postgres text can't hold NUL
+    if not isinstance(value, value_type) or (value_type is str and "\x00" in value):
+        raise InvalidCursor()
+    return value
+
+def decode_cursor(cursor: str, sort_key: str, value_types: tuple) -> list:
+    """Cursor values checked against value_types, e.g. (float, int) for (price, id)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["v"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor()
+    # A cursor is only meaningful for the ordering that produced it
+    if payload.get("s") != sort_key or not isinstance(values, list) or len(values) != len(value_types):
+        raise InvalidCursor()
+    return [_coerce(value, value_type) for value, value_type in zip(values, value_types)]
+
+async def estimate_count(db: AsyncSession, query: Select) -> int:
+    # Use the planner's row estimate instead of running count(*) over the
+    # whole filtered set
+    connection = await db.connection()
+    compiled = query.order_by(None).compile(dialect=connection.dialect)
+    params = compiled.params
+    if compiled.positiontup is not None:
+        # Positional paramstyles (asyncpg) take a tuple in placeholder order
+        params = tuple(params[name] for name in compiled.positiontup)
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,71 @@
+"""Cache of authenticated principals (id, email, role) keyed by token subject.
+
+Entries are invalidated whenever a User row's role or email changes or the
+user is deleted through the ORM in this process; changes made elsewhere (other
+workers, scripts, raw SQL) become visible after PRINCIPAL_CACHE_TTL_SECONDS.
+"""
+import os
+from dataclasses import dataclass
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from . import models
+from .cache import LRUCache
+
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    role: str
+
+    @property
+    def is_admin(self):
+        return self.role == models.UserRole.ADMIN
+
+cache = LRUCache(max_entries=PRINCIPAL_CACHE_MAX_ENTRIES, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+def get(subject: str):
+    return cache.get(subject)
+
+def put(principal: Principal):
+    cache.set(principal.email, principal)
+
+def invalidate(subject: str):
+    cache.delete(subject)
+
+def _changed_subjects(session):
+    subjects = set()
+    for user in session.deleted:
+        if isinstance(user, models.User):
+            subjects.add(user.email)
+    for user in session.dirty:
+        if not isinstance(user, models.User):
+            continue
+        state = inspect(user)
+        role = state.attrs.role.history
+        email = state.attrs.email.history
+        if role.has_changes() or email.has_changes():
+            subjects.add(user.email)
+            subjects.update(value for value in email.deleted if value)
+    return subjects
+
+@event.listens_for(Session, "before_flush")
+def _collect_principal_changes(session, flush_context, instances):
+    subjects = _changed_subjects(session)
+    if subjects:
+        session.info.setdefault("principal_invalidations", set()).update(subjects)
+        for subject in subjects:
+            invalidate(subject)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    # Invalidate again once the change is visible, in case another request
+    # re-cached the old row between flush and commit
+    for subject in session.info.pop("principal_invalidations", ()):
+        invalidate(subject)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_principal_changes(session):
+    session.info.pop("principal_invalidations", None)
@@ -0,0 +1,380 @@
+"""Sampling profiler for individual requests.
+
+A request is profiled when it wins the PROFILE_SAMPLE_RATE draw, or when it
+carries the PROFILE_HEADER header together with an admin bearer token.
+While any profile is active, a sampler thread wakes every
+PROFILE_INTERVAL_SECONDS and reads every thread's stack with
+sys._current_frames(). A sample counts toward a profile when:
+
+- the event loop is running one of the request's tasks (tasks are tagged at
+  creation through a task factory, from a context variable set by the
+  middleware), or
+- a worker thread is running a call submitted from the request's context
+  (sync endpoints and run_in_threadpool).
+
+While none of the request's code is running, the await chain of its latest
+task is recorded instead, so the wall-clock profile also shows what the
+request was waiting on. The CPU profile weights running samples by the
+thread's CPU time since the previous sample (pthread CPU clocks; Linux and
+other POSIX systems only).
+
+Samples are classified as sql (SQLAlchemy and driver frames, including
+awaiting the database), serialization (pydantic, JSON encoding, response
+rendering), python (other running code) or waiting (other awaits).
+Finished profiles go into a ring buffer of PROFILE_BUFFER_SIZE and are served
+as collapsed stacks ("frame;frame;frame weight"), the input format of
+flamegraph.pl, speedscope and similar tools.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import random
+import sys
+import sysconfig
+import threading
+import time
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from . import auth_utils
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "50"))
+# Requests running longer (e.g. streaming) stop being sampled after this
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "128"))
+
+KINDS = ("wall", "cpu")
+CATEGORIES = ("sql", "serialization", "python", "waiting")
+
+SQL_MARKERS = ("/sqlalchemy/", "/asyncpg/", "/psycopg2/", "/greenlet/")
+SERIALIZATION_MARKERS = ("/pydantic/", "/json/", "/fastapi/encoders.py")
+SERIALIZATION_FUNCTIONS = {"serialize_response", "_prepare_response_content", "jsonable_encoder", "model_dump_json", "render"}
+
+_current = contextvars.ContextVar("profile", default=None)
+_ids = itertools.count(1)
+
+_active = set()
+_active_lock = threading.Lock()
+profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+_loop = None
+_loop_thread_id = None
+
+class Profile:
+    def __init__(self, method, path, trigger):
+        self.id = str(next(_ids))
+        self.method = method
+        self.path = path
+        self.route = None
+        self.trigger = trigger
+        self.status = None
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.tasks = weakref.WeakSet()
+        # Same tasks in creation order, to find the innermost one still pending
+        self._task_refs = []
+        # kind -> stack (tuple of frame labels) -> microseconds
+        self.stacks = {kind: {} for kind in KINDS}
+        self.split = {kind: dict.fromkeys(CATEGORIES, 0) for kind in KINDS}
+        self.samples = 0
+        # Guards the sample data: the sampler can still be adding while the
+        # request finishes
+        self._lock = threading.Lock()
+        self.wall_ms = None
+        self.sql_ms = None
+        self.queries = None
+
+    def add_task(self, task):
+        self.tasks.add(task)
+        self._task_refs.append(weakref.ref(task))
+
+    def latest_pending_task(self):
+        for ref in reversed(self._task_refs):
+            task = ref()
+            if task is not None and not task.done():
+                return task
+        return None
+
+    def add(self, kind, stack, category, micros):
+        if micros <= 0:
+            return
+        with self._lock:
+            stacks = self.stacks[kind]
+            stacks[stack] = stacks.get(stack, 0) + micros
+            self.split[kind][category] += micros
+
+    def summary(self):
+        with self._lock:
+            split = {kind: dict(categories) for kind, categories in self.split.items()}
+
+        def shares(kind):
+            total = sum(split[kind].values())
+            return {
+                category: {"ms": round(micros / 1000, 3), "share": round(micros / total, 4) if total else 0.0}
+                for category, micros in split[kind].items()
+            }
+        return {
+            "id": self.id,
+            "method": self.method,
+            "route": self.route,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "wall_ms": self.wall_ms,
+            "cpu_ms": round(sum(split["cpu"].values()) / 1000, 3),
+            # Measured around each statement by query_stats, not sampled
+            "sql_ms": self.sql_ms,
+            "queries": self.queries,
+            "samples": self.samples,
+            "wall": shares("wall"),
+            "cpu": shares("cpu")
+        }
+
+    def collapsed(self, kind):
+        with self._lock:
+            stacks = sorted(self.stacks[kind].items(), key=lambda item: -item[1])
+        return "".join(f"{';'.join(stack)} {micros}\n" for stack, micros in stacks)
+
+# --- Triggering ---
+
+def _is_admin_token(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = auth_utils.jwt.decode(token, auth_utils.SECRET_KEY, algorithms=[auth_utils.ALGORITHM])
+    except auth_utils.JWTError:
+        return False
+    # The role claim is signed; admin access is revalidated by the endpoints
+    # that serve profiles
+    return payload.get("role") == "admin"
+
+def start(request):
+    """Begin profiling the request if it is selected. Returns (profile, token) or None."""
+    if request.headers.get(PROFILE_HEADER):
+        if not _is_admin_token(request.headers.get("authorization")):
+            return None
+        trigger = "header"
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = "sampled"
+    else:
+        return None
+    if _loop is None:
+        return None
+
+    profile = Profile(request.method, request.url.path, trigger)
+    profile.add_task(asyncio.current_task())
+    token = _current.set(profile)
+    with _active_lock:
+        _active.add(profile)
+    sampler.wake()
+    return profile, token
+
+def finish(started, route, status, query_stats=None):
+    profile, token = started
+    _current.reset(token)
+    with _active_lock:
+        _active.discard(profile)
+    profile.route = route
+    profile.status = status
+    profile.wall_ms = round((time.perf_counter() - profile.start) * 1000, 3)
+    if query_stats is not None:
+        profile.sql_ms = round(query_stats.duration * 1000, 3)
+        profile.queries = query_stats.count
+    profiles.append(profile)
+    return profile
+
+def get(profile_id):
+    for profile in list(profiles):
+        if profile.id == profile_id:
+            return profile
+    return None
+
+def summaries():
+    return [profile.summary() for profile in reversed(list(profiles))]
+
+# --- Task tagging ---
+
+def _task_factory(previous):
+    def factory(loop, coro, context=None):
+        kwargs = {} if context is None else {"context": context}
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profile = context.get(_current) if context is not None else _current.get()
+        if profile is not None:
+            profile.add_task(task)
+        return task
+    return factory
+
+def install(loop):
+    """Tag tasks of profiled requests on this loop. Call from the running loop."""
+    global _loop, _loop_thread_id
+    if _loop is loop:
+        return
+    loop.set_task_factory(_task_factory(loop.get_task_factory()))
+    _loop = loop
+    _loop_thread_id = threading.get_ident()
+
+# --- Sampling ---
+
+# Path prefixes dropped from frame labels
+_PATH_MARKERS = ("site-packages/", sysconfig.get_paths()["stdlib"] + "/", "/backend/")
+
+def _label(code):
+    filename = code.co_filename
+    for marker in _PATH_MARKERS:
+        index = filename.rfind(marker)
+        if index >= 0:
+            filename = filename[index + len(marker):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+def _classify(codes, running):
+    # Innermost match wins: SQL run while serializing (lazy loads) is SQL
+    for code in reversed(codes):
+        filename = code.co_filename
+        if any(marker in filename for marker in SQL_MARKERS):
+            return "sql"
+        if any(marker in filename for marker in SERIALIZATION_MARKERS) or code.co_name in SERIALIZATION_FUNCTIONS:
+            return "serialization"
+    return "python" if running else "waiting"
+
+def _frame_codes(frame):
+    codes = []
+    while frame is not None and len(codes) < PROFILE_MAX_DEPTH:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    return codes
+
+def _await_codes(task):
+    """Code objects along a suspended task's await chain, outermost first."""
+    codes = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(codes) < PROFILE_MAX_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        codes.append(frame.f_code)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return codes
+
+def _worker_profile(frame):
+    # anyio worker threads run each call as context.run(func, ...) from their
+    # run() loop; the submitting request's context holds its profile
+    while frame is not None:
+        if frame.f_code.co_name == "run" and "/anyio/" in frame.f_code.co_filename:
+            context = frame.f_locals.get("context")
+            if isinstance(context, contextvars.Context):
+                return context.get(_current)
+            return None
+        frame = frame.f_back
+    return None
+
+def _thread_cpu_time(thread_id):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+class Sampler:
+    """Background thread sampling stacks while any profile is active."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._cpu = {}
+
+    def wake(self):
+        with self._wakeup:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def stop(self):
+        with self._wakeup:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._wakeup.notify()
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while True:
+            with self._wakeup:
+                while not self._stopping and not _active:
+                    self._wakeup.wait()
+                    last = time.perf_counter()
+                if self._stopping:
+                    return
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            micros = int((now - last) * 1_000_000)
+            last = now
+            try:
+                self._sample(own_id, micros, now)
+            except Exception as e:
+                print(f"Warning: Profiler sample failed. Error: {e}")
+
+    def _cpu_delta(self, thread_id):
+        cpu = _thread_cpu_time(thread_id)
+        if cpu is None:
+            return 0
+        previous = self._cpu.get(thread_id, cpu)
+        self._cpu[thread_id] = cpu
+        return int((cpu - previous) * 1_000_000)
+
+    def _sample(self, own_id, micros, now):
+        with _active_lock:
+            active = [profile for profile in _active if now - profile.start < PROFILE_MAX_SECONDS]
+        if not active:
+            return
+        frames = sys._current_frames()
+        running = {}
+
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            cpu = self._cpu_delta(thread_id)
+            if thread_id == _loop_thread_id:
+                task = asyncio.current_task(_loop)
+                profile = next((profile for profile in active if task is not None and task in profile.tasks), None)
+            else:
+                profile = _worker_profile(frame)
+            if profile is None or profile not in active:
+                continue
+            codes = _frame_codes(frame)
+            stack = tuple(_label(code) for code in codes)
+            category = _classify(codes, running=True)
+            profile.add("wall", stack, category, micros)
+            profile.add("cpu", stack, category, cpu)
+            running[profile] = True
+        # Threads that exited no longer need a CPU baseline
+        for thread_id in list(self._cpu):
+            if thread_id not in frames:
+                del self._cpu[thread_id]
+
+        for profile in active:
+            profile.samples += 1
+            if profile in running:
+                continue
+            task = profile.latest_pending_task()
+            if task is None:
+                continue
+            codes = _await_codes(task)
+            stack = tuple(_label(code) for code in codes) + ("[await]",)
+            profile.add("wall", stack, _classify(codes, running=False), micros)
+
+sampler = Sampler(PROFILE_INTERVAL_SECONDS)
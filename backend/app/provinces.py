@@ -0,0 +1,192 @@
+import math
+from sqlalchemy import text
+
+# Coordinates for Thai provinces (approximate centers)
+PROVINCE_COORDINATES = {
+    "Bangkok": (13.7563, 100.5018),
+    "Samut Prakan": (13.5991, 100.5968),
+    "Nonthaburi": (13.8591, 100.5217),
+    "Pathum Thani": (14.0208, 100.5250),
+    "Phra Nakhon Si Ayutthaya": (14.3532, 100.5684),
+    "Ang Thong": (14.5896, 100.4551),
+    "Lopburi": (14.7995, 100.6534),
+    "Sing Buri": (14.8905, 100.4142),
+    "Chai Nat": (15.1852, 100.1251),
+    "Saraburi": (14.5289, 100.9101),
+    "Chon Buri": (13.3611, 100.9847),
+    "Rayong": (12.6815, 101.2816),
+    "Chanthaburi": (12.6114, 102.1039),
+    "Trat": (12.2428, 102.5175),
+    "Chachoengsao": (13.6904, 101.0780),
+    "Prachin Buri": (14.0620, 101.3783),
+    "Nakhon Nayok": (14.2069, 101.2131),
+    "Sa Kaeo": (13.8141, 102.0726),
+    "Nakhon Ratchasima": (14.9799, 102.0978),
+    "Buri Ram": (14.9930, 103.1029),
+    "Surin": (14.8829, 103.4936),
+    "Si Sa Ket": (15.1186, 104.3220),
+    "Ubon Ratchathani": (15.2448, 104.8473),
+    "Yasothon": (15.7924, 104.1453),
+    "Chaiyaphum": (15.8105, 102.0288),
+    "Amnat Charoen": (15.8657, 104.6258),
+    "Nong Bua Lam Phu": (17.2032, 102.4408),
+    "Khon Kaen": (16.4322, 102.8236),
+    "Udon Thani": (17.4156, 102.7872),
+    "Loei": (17.4860, 101.7223),
+    "Nong Khai": (17.8783, 102.7413),
+    "Maha Sarakham": (16.1858, 103.3033),
+    "Roi Et": (16.0538, 103.6520),
+    "Kalasin": (16.4328, 103.5066),
+    "Sakon Nakhon": (17.1664, 104.1486),
+    "Nakhon Phanom": (17.3920, 104.7696),
+    "Mukdahan": (16.5436, 104.7114),
+    "Chiang Mai": (18.7932, 98.9847),
+    "Lamphun": (18.5748, 99.0087),
+    "Lampang": (18.2858, 99.4910),
+    "Uttaradit": (17.6201, 100.0993),
+    "Phrae": (18.1446, 100.1403),
+    "Nan": (18.7832, 100.7782),
+    "Phayao": (19.1965, 99.9025),
+    "Chiang Rai": (19.9072, 99.8325),
+    "Mae Hong Son": (19.3020, 97.9654),
+    "Nakhon Sawan": (15.7047, 100.1372),
+    "Uthai Thani": (15.3835, 100.0246),
+    "Kamphaeng Phet": (16.4828, 99.5227),
+    "Tak": (16.8837, 99.1258),
+    "Sukhothai": (17.0077, 99.8230),
+    "Phitsanulok": (16.8211, 100.2659),
+    "Phichit": (16.4418, 100.3486),
+    "Phetchabun": (16.4190, 101.1562),
+    "Ratchaburi": (13.5283, 99.8135),
+    "Kanchanaburi": (14.0228, 99.5328),
+    "Suphan Buri": (14.4745, 100.1177),
+    "Nakhon Pathom": (13.8198, 100.0601),
+    "Samut Sakhon": (13.5475, 100.2744),
+    "Samut Songkhram": (13.4098, 100.0023),
+    "Phetchaburi": (13.1069, 99.9438),
+    "Prachuap Khiri Khan": (11.8124, 99.7973),
+    "Nakhon Si Thammarat": (8.4309, 99.9631),
+    "Krabi": (8.0863, 98.9063),
+    "Phangnga": (8.4501, 98.5255),
+    "Phuket": (7.8804, 98.3923),
+    "Surat Thani": (9.1482, 99.3262),
+    "Ranong": (9.9658, 98.6348),
+    "Chumphon": (10.4930, 99.1800),
+    "Songkhla": (7.1988, 100.5951),
+    "Satun": (6.6238, 100.0674),
+    "Trang": (7.5563, 99.6114),
+    "Phatthalung": (7.6172, 100.0708),
+    "Pattani": (6.8696, 101.2501),
+    "Yala": (6.5411, 101.2804),
+    "Narathiwat": (6.4255, 101.8253),
+    "Bueng Kan": (18.3624, 103.6532)
+}
+
+# Number of nearest candidates fetched through the GiST index (planar `<->`
+# distance) before re-ranking them by true spherical distance.
+KNN_CANDIDATES = 5
+
+# Correlated lookup of the nearest province for a point expression.
+# Used as a LATERAL subquery so the planner does one index probe per point.
+NEAREST_PROVINCE_SQL = """
+    SELECT c.id FROM (
+        SELECT id, location FROM provinces
+        ORDER BY location <-> {point}
+        LIMIT {candidates}
+    ) c
+    ORDER BY ST_DistanceSphere(c.location, {point})
+    LIMIT 1
+"""
+
+def nearest_province_sql(point_expr):
+    return NEAREST_PROVINCE_SQL.format(point=point_expr, candidates=KNN_CANDIDATES)
+
+# Province ids follow the order of PROVINCE_COORDINATES, so new provinces
+# must be appended to the end of the mapping.
+PROVINCE_IDS = {name: province_id for province_id, name in enumerate(PROVINCE_COORDINATES, start=1)}
+
+def seed_provinces(connection):
+    rows = [
+        {"id": PROVINCE_IDS[name], "name": name, "lat": lat, "lng": lng}
+        for name, (lat, lng) in PROVINCE_COORDINATES.items()
+    ]
+    connection.execute(text("""
+        INSERT INTO provinces (id, name, location)
+        VALUES (:id, :name, ST_SetSRID(ST_MakePoint(:lng, :lat), 4326))
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name, location = EXCLUDED.location
+    """), rows)
+
+def _unit_vector(lat, lng):
+    # Straight-line distance between points on the unit sphere grows
+    # monotonically with great-circle distance, so a 3D KD-tree over these
+    # vectors returns the same nearest province as haversine would.
+    lat_r = math.radians(lat)
+    lng_r = math.radians(lng)
+    return (
+        math.cos(lat_r) * math.cos(lng_r),
+        math.cos(lat_r) * math.sin(lng_r),
+        math.sin(lat_r)
+    )
+
+class ProvinceIndex:
+    """In-memory KD-tree for nearest-province lookups at ingest time."""
+
+    def __init__(self, coordinates):
+        points = [(_unit_vector(lat, lng), PROVINCE_IDS[name]) for name, (lat, lng) in coordinates.items()]
+        self._root = self._build(points, 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        mid = len(points) // 2
+        return (points[mid], axis, self._build(points[:mid], depth + 1), self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lng):
+        target = _unit_vector(lat, lng)
+        best = [None, float('inf')]
+        self._search(self._root, target, best)
+        return best[0]
+
+    def _search(self, node, target, best):
+        if node is None:
+            return
+        (vector, province_id), axis, left, right = node
+        dist = sum((a - b) ** 2 for a, b in zip(vector, target))
+        if dist < best[1]:
+            best[0], best[1] = province_id, dist
+
+        diff = target[axis] - vector[axis]
+        near, far = (left, right) if diff < 0 else (right, left)
+        self._search(near, target, best)
+        if diff * diff < best[1]:
+            self._search(far, target, best)
+
+province_index = ProvinceIndex(PROVINCE_COORDINATES)
+
+def backfill_visitor_provinces(connection, batch_size=10000):
+    if not connection.execute(text("SELECT EXISTS (SELECT 1 FROM provinces)")).scalar():
+        raise RuntimeError("The provinces table is empty; seed provinces before backfilling")
+    total = 0
+    last_id = 0
+    while True:
+        # Walk forward by id, so rows left NULL (e.g. without a location)
+        # are not picked up again
+        ids = connection.execute(text(f"""
+            UPDATE visitor_locations v
+            SET province_id = ({nearest_province_sql("v.location")})
+            WHERE v.id IN (
+                SELECT id FROM visitor_locations
+                WHERE province_id IS NULL AND id > :last_id
+                ORDER BY id
+                LIMIT :batch_size
+            )
+            RETURNING v.id
+        """), {"batch_size": batch_size, "last_id": last_id}).scalars().all()
+        connection.commit()
+        if not ids:
+            return total
+        total += len(ids)
+        last_id = max(ids)
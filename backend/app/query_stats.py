@@ -0,0 +1,143 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from . import metrics
+
+# Expose X-DB-Query-Count / X-DB-Time-Ms response headers (development only)
+DEBUG_QUERY_HEADERS = os.getenv("DEBUG_QUERY_HEADERS", "false").lower() == "true"
+# Executions of one statement within a single request reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.duration += other.duration
+        for statement, count in other.statements.items():
+            self.statements[statement] = self.statements.get(statement, 0) + count
+
+    def repeated_statements(self, threshold):
+        return sorted(
+            ((statement, count) for statement, count in self.statements.items() if count >= threshold),
+            key=lambda item: item[1],
+            reverse=True
+        )
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+_current = contextvars.ContextVar("query_stats", default=None)
+
+# Active query budgets (tests). Requests run on the server's event loop, not
+# in the test's context, so each tracked request's stats are added to every
+# budget when it finishes; background threads are never tracked.
+_budgets = []
+_budgets_lock = threading.Lock()
+
+# Per-route totals for production monitoring: route -> [requests, queries, seconds]
+route_totals = {}
+_route_lock = threading.Lock()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, duration)
+
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get("query_start_time")
+        if starts:
+            starts.pop()
+
+def install(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+@contextmanager
+def track():
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if _budgets:
+            with _budgets_lock:
+                for budget_stats in _budgets:
+                    budget_stats.merge(stats)
+
+def record_route(route, stats):
+    with _route_lock:
+        totals = route_totals.setdefault(route, [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += stats.count
+        totals[2] += stats.duration
+
+    repeated = stats.repeated_statements(N_PLUS_ONE_THRESHOLD)
+    if repeated:
+        statement, count = repeated[0]
+        print(f"Warning: Possible N+1 on {route}: statement ran {count} times: {' '.join(statement.split())[:200]}")
+
+def route_summary():
+    with _route_lock:
+        return {
+            route: {
+                "requests": requests,
+                "queries": queries,
+                "db_time_ms": round(seconds * 1000, 3),
+                "avg_queries": round(queries / requests, 2),
+                "avg_db_time_ms": round(seconds * 1000 / requests, 3)
+            }
+            for route, (requests, queries, seconds) in route_totals.items()
+        }
+
+def _metrics():
+    with _route_lock:
+        totals = list(route_totals.items())
+    return [
+        ("db_queries_total", "counter", "SQL statements run by requests, by route template.",
+         [({"route": route}, queries) for route, (requests, queries, seconds) in totals]),
+        ("db_query_seconds_total", "counter", "Time spent in SQL statements by requests, by route template.",
+         [({"route": route}, seconds) for route, (requests, queries, seconds) in totals]),
+    ]
+
+metrics.register_collector(_metrics)
+
+@contextmanager
+def budget(max_queries):
+    """Raise QueryBudgetExceeded if requests finished in the block ran more than max_queries statements."""
+    stats = QueryStats()
+    with _budgets_lock:
+        _budgets.append(stats)
+    try:
+        yield stats
+    finally:
+        with _budgets_lock:
+            _budgets.remove(stats)
+
+    if stats.count > max_queries:
+        details = "\n".join(
+            f"  {count}x {' '.join(statement.split())[:160]}"
+            for statement, count in stats.repeated_statements(2)
+        )
+        raise QueryBudgetExceeded(
+            f"Expected at most {max_queries} queries, {stats.count} were executed"
+            + (f"\nRepeated statements:\n{details}" if details else "")
+        )
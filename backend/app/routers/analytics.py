@@ -1,124 +1,33 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from .. import models, database, schemas
-from .auth import get_current_user, get_db
-from geoalchemy2.shape import to_shape
-import json
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import func, text, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, database, schemas, visitor_buffer, order_rollups, query_stats, auth_utils, outbound, principals, profiling
+from .auth import get_current_principal
+from ..provinces import PROVINCE_COORDINATES, nearest_province_sql, province_index
 
 router = APIRouter(
     prefix="/analytics",
     tags=["analytics"]
 )
 
-# Coordinates for Thai provinces (approximate centers)
-PROVINCE_COORDINATES = {
-    "Bangkok": (13.7563, 100.5018),
-    "Samut Prakan": (13.5991, 100.5968),
-    "Nonthaburi": (13.8591, 100.5217),
-    "Pathum Thani": (14.0208, 100.5250),
-    "Phra Nakhon Si Ayutthaya": (14.3532, 100.5684),
-    "Ang Thong": (14.5896, 100.4551),
-    "Lopburi": (14.7995, 100.6534),
-    "Sing Buri": (14.8905, 100.4142),
-    "Chai Nat": (15.1852, 100.1251),
-    "Saraburi": (14.5289, 100.9101),
-    "Chon Buri": (13.3611, 100.9847),
-    "Rayong": (12.6815, 101.2816),
-    "Chanthaburi": (12.6114, 102.1039),
-    "Trat": (12.2428, 102.5175),
-    "Chachoengsao": (13.6904, 101.0780),
-    "Prachin Buri": (14.0620, 101.3783),
-    "Nakhon Nayok": (14.2069, 101.2131),
-    "Sa Kaeo": (13.8141, 102.0726),
-    "Nakhon Ratchasima": (14.9799, 102.0978),
-    "Buri Ram": (14.9930, 103.1029),
-    "Surin": (14.8829, 103.4936),
-    "Si Sa Ket": (15.1186, 104.3220),
-    "Ubon Ratchathani": (15.2448, 104.8473),
-    "Yasothon": (15.7924, 104.1453),
-    "Chaiyaphum": (15.8105, 102.0288),
-    "Amnat Charoen": (15.8657, 104.6258),
-    "Nong Bua Lam Phu": (17.2032, 102.4408),
-    "Khon Kaen": (16.4322, 102.8236),
-    "Udon Thani": (17.4156, 102.7872),
-    "Loei": (17.4860, 101.7223),
-    "Nong Khai": (17.8783, 102.7413),
-    "Maha Sarakham": (16.1858, 103.3033),
-    "Roi Et": (16.0538, 103.6520),
-    "Kalasin": (16.4328, 103.5066),
-    "Sakon Nakhon": (17.1664, 104.1486),
-    "Nakhon Phanom": (17.3920, 104.7696),
-    "Mukdahan": (16.5436, 104.7114),
-    "Chiang Mai": (18.7932, 98.9847),
-    "Lamphun": (18.5748, 99.0087),
-    "Lampang": (18.2858, 99.4910),
-    "Uttaradit": (17.6201, 100.0993),
-    "Phrae": (18.1446, 100.1403),
-    "Nan": (18.7832, 100.7782),
-    "Phayao": (19.1965, 99.9025),
-    "Chiang Rai": (19.9072, 99.8325),
-    "Mae Hong Son": (19.3020, 97.9654),
-    "Nakhon Sawan": (15.7047, 100.1372),
-    "Uthai Thani": (15.3835, 100.0246),
-    "Kamphaeng Phet": (16.4828, 99.5227),
-    "Tak": (16.8837, 99.1258),
-    "Sukhothai": (17.0077, 99.8230),
-    "Phitsanulok": (16.8211, 100.2659),
-    "Phichit": (16.4418, 100.3486),
-    "Phetchabun": (16.4190, 101.1562),
-    "Ratchaburi": (13.5283, 99.8135),
-    "Kanchanaburi": (14.0228, 99.5328),
-    "Suphan Buri": (14.4745, 100.1177),
-    "Nakhon Pathom": (13.8198, 100.0601),
-    "Samut Sakhon": (13.5475, 100.2744),
-    "Samut Songkhram": (13.4098, 100.0023),
-    "Phetchaburi": (13.1069, 99.9438),
-    "Prachuap Khiri Khan": (11.8124, 99.7973),
-    "Nakhon Si Thammarat": (8.4309, 99.9631),
-    "Krabi": (8.0863, 98.9063),
-    "Phangnga": (8.4501, 98.5255),
-    "Phuket": (7.8804, 98.3923),
-    "Surat Thani": (9.1482, 99.3262),
-    "Ranong": (9.9658, 98.6348),
-    "Chumphon": (10.4930, 99.1800),
-    "Songkhla": (7.1988, 100.5951),
-    "Satun": (6.6238, 100.0674),
-    "Trang": (7.5563, 99.6114),
-    "Phatthalung": (7.6172, 100.0708),
-    "Pattani": (6.8696, 101.2501),
-    "Yala": (6.5411, 101.2804),
-    "Narathiwat": (6.4255, 101.8253),
-    "Bueng Kan": (18.3624, 103.6532)
-}
-
-import math
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in km
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    a = math.sin(dLat / 2) * math.sin(dLat / 2) + \
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
-        math.sin(dLon / 2) * math.sin(dLon / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
 @router.get("/locations")
-def get_order_locations(db: Session = Depends(get_db)):
+async def get_order_locations(db: AsyncSession = Depends(database.get_async_db)):
     features = []
 
     # 1. Get Order Locations (grouped by city/province)
-    order_counts = db.query(
-        models.Address.province,
-        func.count(models.Order.id).label("count")
-    ).join(models.Order, models.Order.address_id == models.Address.id)\
-     .filter(models.Order.status.in_([
-         models.OrderStatus.PAID,
-         models.OrderStatus.SHIPPED,
-         models.OrderStatus.COMPLETED
-     ]))\
-     .group_by(models.Address.province).all()
+    order_counts = (await db.execute(
+        select(
+            models.Address.province,
+            func.count(models.Order.id).label("count")
+        ).join(models.Order, models.Order.address_id == models.Address.id)
+         .where(models.Order.status.in_([
+             models.OrderStatus.PAID.value,
+             models.OrderStatus.SHIPPED.value,
+             models.OrderStatus.COMPLETED.value
+         ]))
+         .group_by(models.Address.province)
+    )).all()
 
     for province, count in order_counts:
         coords = PROVINCE_COORDINATES.get(province)
@@ -142,41 +51,34 @@ def get_order_locations(db: Session = Depends(get_db)):
                 }
             })
             
-    # 2. Get Visitor Locations and Aggregate by Province
-    visitor_results = db.query(
-        func.ST_AsGeoJSON(models.VisitorLocation.location).label("geojson")
-    ).all()
-    
-    visitor_province_counts = {}
-
-    for row in visitor_results:
-        if row.geojson:
-            geometry = json.loads(row.geojson)
-            # GeoJSON coordinates are [lng, lat]
-            lng, lat = geometry['coordinates']
-            
-            # Find nearest province
-            nearest_province = None
-            min_dist = float('inf')
-            
-            for p_name, p_coords in PROVINCE_COORDINATES.items():
-                # p_coords is (lat, lng)
-                dist = haversine(lat, lng, p_coords[0], p_coords[1])
-                if dist < min_dist:
-                    min_dist = dist
-                    nearest_province = p_name
-            
-            if nearest_province:
-                visitor_province_counts[nearest_province] = visitor_province_counts.get(nearest_province, 0) + 1
+    # 2. Aggregate Visitor Locations by Province
+    # Visitors are stamped with a province at ingest; rows recorded before
+    # that (province_id IS NULL) fall back to a KNN lookup in PostGIS.
+    visitor_province_counts = (await db.execute(text(f"""
+        SELECT p.name, ST_X(p.location) AS lng, ST_Y(p.location) AS lat, sum(counts.count) AS count
+        FROM (
+            SELECT province_id, count(*) AS count
+            FROM visitor_locations
+            WHERE province_id IS NOT NULL
+            GROUP BY province_id
+            UNION ALL
+            SELECT nearest.id, count(*)
+            FROM visitor_locations v
+            CROSS JOIN LATERAL ({nearest_province_sql("v.location")}) nearest
+            WHERE v.province_id IS NULL
+            GROUP BY nearest.id
+        ) counts
+        JOIN provinces p ON p.id = counts.province_id
+        GROUP BY p.id
+    """))).all()
 
     # Add aggregated visitor features
-    for province, count in visitor_province_counts.items():
-        coords = PROVINCE_COORDINATES[province]
+    for province, lng, lat, count in visitor_province_counts:
         features.append({
             "type": "Feature",
             "geometry": {
                 "type": "Point",
-                "coordinates": [coords[1], coords[0]]
+                "coordinates": [lng, lat]
             },
             "properties": {
                 "type": "visitor_province",
@@ -191,55 +93,134 @@ def get_order_locations(db: Session = Depends(get_db)):
     }
 
 @router.get("/users/count")
-def get_user_count(db: Session = Depends(get_db)):
-    count = db.query(models.User).count()
+async def get_user_count(db: AsyncSession = Depends(database.get_async_db)):
+    count = await db.scalar(select(func.count()).select_from(models.User))
     return {"count": count}
 
 @router.post("/visitor")
-def record_visitor_location(location_data: schemas.VisitorLocationCreate, db: Session = Depends(get_db)):
+async def record_visitor_location(location_data: schemas.VisitorLocationCreate, db: AsyncSession = Depends(database.get_async_db)):
+    province_id = province_index.nearest(location_data.latitude, location_data.longitude)
+
+    if visitor_buffer.VISITOR_INGEST_MODE == "buffered":
+        try:
+            visitor_buffer.buffer.add(location_data.longitude, location_data.latitude, province_id)
+        except visitor_buffer.BufferFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Visitor ingestion is overloaded",
+                headers={"Retry-After": "1"}
+            )
+        return {"message": "Visitor location recorded"}
+
     location_wkt = f"POINT({location_data.longitude} {location_data.latitude})"
-    visitor_location = models.VisitorLocation(location=location_wkt)
+    visitor_location = models.VisitorLocation(location=location_wkt, province_id=province_id)
     db.add(visitor_location)
-    db.commit()
+    await db.commit()
     return {"message": "Visitor location recorded"}
 
+@router.get("/visitor/ingest-stats")
+async def get_visitor_ingest_stats():
+    return visitor_buffer.buffer.stats()
+
+@router.get("/db/queries")
+async def get_query_stats():
+    return query_stats.route_summary()
+
+@router.get("/db/pool")
+async def get_pool_stats():
+    return database.pool_stats()
+
+@router.get("/auth/hashing")
+async def get_hashing_stats():
+    return auth_utils.hash_pool_stats()
+
+@router.get("/outbound")
+async def get_outbound_stats():
+    return outbound.stats()
+
+@router.get("/profiles")
+async def list_profiles(principal: principals.Principal = Depends(get_current_principal)):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return profiling.summaries()
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    kind: str = "wall",
+    principal: principals.Principal = Depends(get_current_principal)
+):
+    """Collapsed stacks (flamegraph.pl / speedscope input), weighted in microseconds."""
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if kind not in profiling.KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(profiling.KINDS)}")
+    profile = profiling.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile.collapsed(kind),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}-{kind}.folded"'}
+    )
+
 @router.get("/visitors/count")
-def get_visitor_count(db: Session = Depends(get_db)):
-    count = db.query(models.VisitorLocation).count()
+async def get_visitor_count(db: AsyncSession = Depends(database.get_async_db)):
+    count = await db.scalar(select(func.count()).select_from(models.VisitorLocation))
     return {"count": count}
 
 @router.get("/orders/stats")
-def get_order_stats(db: Session = Depends(get_db)):
-    total_orders = db.query(models.Order).count()
-    total_revenue = db.query(func.sum(models.Order.total_price)).scalar() or 0.0
+async def get_order_stats(db: AsyncSession = Depends(database.get_async_db)):
+    # Totals come from the rollup table (one row per status)
+    rollups = (await db.scalars(select(models.OrderStatusRollup))).all()
+    total_orders = sum(row.order_count for row in rollups)
+    total_revenue = sum(row.revenue for row in rollups)
+    status_counts = {row.status: row.order_count for row in rollups if row.order_count}
     
-    status_counts = db.query(
-        models.Order.status,
-        func.count(models.Order.id)
-    ).group_by(models.Order.status).all()
-    
-    recent_orders = db.query(models.Order).order_by(models.Order.created_at.desc()).limit(5).all()
+    recent_orders = (await db.scalars(
+        select(models.Order).order_by(models.Order.created_at.desc()).limit(5)
+    )).all()
     
     return {
         "total_orders": total_orders,
         "total_revenue": total_revenue,
-        "status_counts": {status: count for status, count in status_counts},
+        "status_counts": status_counts,
         "recent_orders": recent_orders
     }
 
+@router.get("/orders/timeseries")
+async def get_order_timeseries(granularity: str = "day", limit: int = 30, db: AsyncSession = Depends(database.get_async_db)):
+    if granularity not in order_rollups.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(order_rollups.GRANULARITIES)}")
+
+    buckets = (await db.scalars(
+        select(models.OrderTimeRollup)
+        .where(models.OrderTimeRollup.granularity == granularity)
+        .order_by(models.OrderTimeRollup.bucket_start.desc())
+        .limit(limit)
+    )).all()
+
+    return {
+        "granularity": granularity,
+        "buckets": [
+            {"bucket_start": bucket.bucket_start, "order_count": bucket.order_count, "revenue": bucket.revenue}
+            for bucket in reversed(buckets)
+        ]
+    }
+
 from typing import Optional
 
 @router.get("/products/stats")
-def get_product_stats(q: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_product_stats(q: Optional[str] = None, db: AsyncSession = Depends(database.get_async_db)):
     if q:
         # Search products by name
-        search_results = db.query(
-            models.Product,
-            func.sum(models.OrderItem.quantity).label("total_sold")
-        ).outerjoin(models.OrderItem)\
-         .filter(models.Product.name.ilike(f"%{q}%"))\
-         .group_by(models.Product.id)\
-         .all()
+        search_results = (await db.execute(
+            select(
+                models.Product,
+                func.sum(models.OrderItem.quantity).label("total_sold")
+            ).outerjoin(models.OrderItem)
+             .where(models.Product.name.ilike(f"%{q}%"))
+             .group_by(models.Product.id)
+        )).all()
          
         results_data = []
         for product, total_sold in search_results:
@@ -255,13 +236,15 @@ def get_product_stats(q: Optional[str] = None, db: Session = Depends(get_db)):
         return {"search_results": results_data}
 
     # Top selling products
-    top_selling = db.query(
-        models.Product,
-        func.sum(models.OrderItem.quantity).label("total_sold")
-    ).join(models.OrderItem)\
-     .group_by(models.Product.id)\
-     .order_by(func.sum(models.OrderItem.quantity).desc())\
-     .limit(5).all()
+    top_selling = (await db.execute(
+        select(
+            models.Product,
+            func.sum(models.OrderItem.quantity).label("total_sold")
+        ).join(models.OrderItem)
+         .group_by(models.Product.id)
+         .order_by(func.sum(models.OrderItem.quantity).desc())
+         .limit(5)
+    )).all()
      
     top_selling_data = []
     for product, total_sold in top_selling:
@@ -273,7 +256,7 @@ def get_product_stats(q: Optional[str] = None, db: Session = Depends(get_db)):
         })
 
     # Low stock products
-    low_stock = db.query(models.Product).filter(models.Product.stock < 10).all()
+    low_stock = (await db.scalars(select(models.Product).where(models.Product.stock < 10))).all()
     
     return {
         "top_selling": top_selling_data,
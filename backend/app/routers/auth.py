@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from .. import models, schemas, database, auth_utils
+from .. import models, schemas, database, auth_utils, principals
+from ..database import get_db
 from datetime import timedelta
 
 router = APIRouter(
@@ -11,33 +14,39 @@ router = APIRouter(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+
+def _hashing_unavailable():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, try again shortly",
+        headers={"Retry-After": "1"},
+    )
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
+    db_user = await db.scalar(select(models.User.id).where(models.User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth_utils.get_password_hash(user.password)
+    # Hashing runs in the password worker pool, off the event loop and the
+    # shared threadpool
+    try:
+        hashed_password = await auth_utils.get_password_hash_async(user.password)
+    except auth_utils.HashingOverloaded:
+        raise _hashing_unavailable()
     new_user = models.User(
         email=user.email,
         password_hash=hashed_password,
         full_name=user.full_name
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.post("/login", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -45,38 +54,77 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             headers={"WWW-Authenticate": "Bearer"},
         )
         
-    if not auth_utils.verify_password(form_data.password, user.password_hash):
+    try:
+        valid, new_hash = await auth_utils.verify_and_update_password_async(form_data.password, user.password_hash)
+    except auth_utils.HashingOverloaded:
+        raise _hashing_unavailable()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Upgrade hashes created with older settings (e.g. fewer rounds)
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
     
     access_token_expires = timedelta(minutes=auth_utils.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth_utils.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id, "role": user.role}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-# Dependency to get current user
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _token_data(token: str) -> schemas.TokenData:
     try:
         payload = auth_utils.jwt.decode(token, auth_utils.SECRET_KEY, algorithms=[auth_utils.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+            raise _credentials_exception()
+        # Tokens issued before uid/role claims existed only carry the email
+        token_data = schemas.TokenData(email=email, user_id=payload.get("uid"), role=payload.get("role"))
     except auth_utils.JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
-    if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    return token_data
+
+def _user_filter(token_data: schemas.TokenData):
+    if token_data.user_id is not None:
+        return models.User.id == token_data.user_id
+    return models.User.email == token_data.email
+
+# Dependency for handlers that only need the caller's id and role. Served
+# from the principal cache, so it normally doesn't touch the users table.
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_async_db)
+) -> principals.Principal:
+    token_data = _token_data(token)
+    principal = principals.get(token_data.email)
+    if principal is None:
+        row = (await db.execute(
+            select(models.User.id, models.User.email, models.User.role).where(_user_filter(token_data))
+        )).first()
+        # The id claim must still belong to the token's subject
+        if row is None or row.email != token_data.email:
+            raise _credentials_exception()
+        principal = principals.Principal(id=row.id, email=row.email, role=row.role)
+        principals.put(principal)
+    return principal
+
+# Dependency to get current user
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    token_data = _token_data(token)
+    user = db.query(models.User).filter(_user_filter(token_data)).first()
+    if user is None or user.email != token_data.email:
+        raise _credentials_exception()
     return user
 
 @router.get("/me", response_model=schemas.UserResponse)
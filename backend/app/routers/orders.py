@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-from .. import models, schemas, database
+from .. import models, schemas, order_rollups, catalog_cache, inventory
 from .auth import get_current_user, get_db
 
 router = APIRouter(
@@ -15,45 +15,42 @@ def create_order(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Calculate total price and verify stock
-    total_price = 0
-    db_items = []
-    
-    for item in order.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        if product.stock < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Not enough stock for {product.name}")
-        
-        # Deduct stock
-        product.stock -= item.quantity
-        
-        price = product.price * item.quantity
-        total_price += price
-        
-        db_item = models.OrderItem(
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price_at_time=product.price
-        )
-        db_items.append(db_item)
-    
+    if any(item.quantity <= 0 for item in order.items):
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+
+    # Verify and deduct stock for all lines in one statement
+    try:
+        reserved = inventory.reserve_stock(db, inventory.merge_lines(
+            (item.product_id, item.quantity) for item in order.items
+        ))
+    except inventory.ProductNotFound as e:
+        db.rollback()
+        raise HTTPException(status_code=404, detail=f"Product {e.product_id} not found")
+    except inventory.InsufficientStock as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Not enough stock for {e.product_name}")
+
+    total_price = sum(reserved[item.product_id][1] * item.quantity for item in order.items)
     new_order = models.Order(
         user_id=current_user.id,
         address_id=order.address_id, # Assuming address exists and belongs to user (should validate)
         total_price=total_price,
-        status=models.OrderStatus.PENDING
+        status=models.OrderStatus.PENDING,
+        # Flushed as a single multi-row insert after the order row
+        items=[
+            models.OrderItem(
+                product_id=item.product_id,
+                quantity=item.quantity,
+                price_at_time=reserved[item.product_id][1]
+            )
+            for item in order.items
+        ]
     )
     db.add(new_order)
+    order_rollups.record_order_created(db, new_order.status, total_price)
     db.commit()
-    db.refresh(new_order)
-    
-    for item in db_items:
-        item.order_id = new_order.id
-        db.add(item)
-    
-    db.commit()
+    # Stock changed for every ordered product
+    catalog_cache.invalidate_products(list(reserved))
     db.refresh(new_order)
     return new_order
 
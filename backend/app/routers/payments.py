@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from sqlalchemy.orm import Session
-from .. import models, database
-from .auth import get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import database, principals, cart_store, stripe_events, checkout, outbound
+from .auth import get_current_principal
+import math
 import stripe
 import os
 from dotenv import load_dotenv
@@ -16,27 +17,31 @@ router = APIRouter(
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def _provider_unavailable(e: outbound.ProviderUnavailable):
+    return HTTPException(
+        status_code=503,
+        detail="Payment provider is unavailable, try again shortly",
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
 
 @router.post("/create-checkout-session")
-def create_checkout_session(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    cart = current_user.cart
-    if not cart or not cart.items:
+async def create_checkout_session(
+    principal: principals.Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # The cart store returns a consistent snapshot of the cart
+    cart = await cart_store.store.get_cart(db, principal.id)
+    if not cart["items"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
     line_items = []
-    for item in cart.items:
+    for item in cart["items"]:
         line_items.append({
             'price_data': {
                 'currency': 'thb',
                 'product_data': {
                     'name': item.product.name,
-                    'images': [item.product.image_url] if item.product.image_url else [],
+                    'images': [item.product.images[0].image_url] if item.product.images else [],
                 },
                 'unit_amount': int(item.product.price * 100), # Stripe expects amount in cents/satang
             },
@@ -44,35 +49,36 @@ def create_checkout_session(current_user: models.User = Depends(get_current_user
         })
 
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await outbound.stripe_api.call(
+            stripe.checkout.Session.create,
             payment_method_types=['card'],
             line_items=line_items,
             mode='payment',
             success_url=f'{FRONTEND_URL}/success?session_id={{CHECKOUT_SESSION_ID}}',
             cancel_url=f'{FRONTEND_URL}/cancel',
-            client_reference_id=str(current_user.id),
+            client_reference_id=str(principal.id),
             metadata={
-                'user_id': current_user.id
+                'user_id': principal.id
             }
         )
         return {"url": checkout_session.url}
+    except outbound.ProviderUnavailable as e:
+        raise _provider_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/verify-session")
-def verify_session(session_id: str, db: Session = Depends(get_db)):
+async def verify_session(session_id: str, db: AsyncSession = Depends(database.get_async_db)):
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        if session.payment_status == 'paid':
-            handle_checkout_session(session, db)
-            return {"status": "success"}
-        else:
-            return {"status": "pending"}
+        status = await checkout.verify_session(session_id, db)
+    except outbound.ProviderUnavailable as e:
+        raise _provider_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success" if status == checkout.PAID else "pending"}
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, stripe_signature: str = Header(None), db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, stripe_signature: str = Header(None), db: AsyncSession = Depends(database.get_async_db)):
     payload = await request.body()
     sig_header = stripe_signature
     endpoint_secret = os.getenv("STRIPE_WEBHOOK_SECRET") # Optional: Verify webhook signature
@@ -85,9 +91,8 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None),
         #     payload, sig_header, endpoint_secret
         # )
         # For now, we'll just parse the payload directly since we might not have the secret yet
-        event = stripe.Event.construct_from(
-            await request.json(), stripe.api_key
-        )
+        data = await request.json()
+        event = stripe.Event.construct_from(data, stripe.api_key)
     except ValueError as e:
         # Invalid payload
         raise HTTPException(status_code=400, detail="Invalid payload")
@@ -95,60 +100,13 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None),
         # Invalid signature
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        handle_checkout_session(session, db)
+    if not event.get('id') or not event.get('type'):
+        raise HTTPException(status_code=400, detail="Invalid payload")
 
+    # Only record the event here; workers process it (redeliveries are ignored)
+    await stripe_events.record_event(db, event['id'], event['type'], data)
     return {"status": "success"}
 
-def handle_checkout_session(session, db: Session):
-    user_id = session.get('client_reference_id')
-    if not user_id:
-        return
-
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
-    if not user:
-        return
-
-    # Create Order
-    # Note: In a real app, you might want to store more details from the session
-    # For now, we'll create an order based on the user's current cart
-    # This assumes the cart hasn't changed since the checkout session was created
-    # A more robust way is to pass cart items in metadata or retrieve line items from Stripe
-    
-    cart = user.cart
-    if not cart or not cart.items:
-        return
-
-    total_price = sum(item.product.price * item.quantity for item in cart.items)
-    
-    # Create Order
-    new_order = models.Order(
-        user_id=user.id,
-        total_price=total_price,
-        status=models.OrderStatus.PAID
-    )
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-
-    # Create Order Items
-    for item in cart.items:
-        order_item = models.OrderItem(
-            order_id=new_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price_at_time=item.product.price
-        )
-        db.add(order_item)
-        
-        # Decrement Stock
-        item.product.stock -= item.quantity
-        db.add(item.product)
-    
-    # Clear Cart
-    for item in cart.items:
-        db.delete(item)
-    
-    db.commit()
+@router.get("/events/stats")
+async def get_event_stats(db: AsyncSession = Depends(database.get_async_db)):
+    return await stripe_events.stats(db)
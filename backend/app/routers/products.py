@@ -1,56 +1,182 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, database
-from .auth import get_current_user, get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
+from sqlalchemy import tuple_, select, delete, func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from .. import models, schemas, database, pagination, catalog_cache, principals, inventory
+from .. import images as image_assets
+from ..search import product_search_filter, product_search_rank
+from .auth import get_current_principal
 
 router = APIRouter(
     prefix="/products",
     tags=["products"]
 )
 
+# Sort column and direction for each sort_by option; ties are broken by id
+SORT_OPTIONS = {
+    "price_asc": (models.Product.price, "asc"),
+    "price_desc": (models.Product.price, "desc"),
+    "name_asc": (models.Product.name, "asc"),
+}
+# Python type of each ordering's sort value, for validating cursors
+SORT_VALUE_TYPES = {
+    "price_asc": float,
+    "price_desc": float,
+    "name_asc": str,
+    "relevance": float,
+}
+MAX_PAGE_SIZE = 500
+
+def _json_response(body: bytes, cache_status: str):
+    return Response(content=body, media_type="application/json", headers={"X-Cache": cache_status})
+
 @router.get("/", response_model=schemas.PaginatedProductResponse)
-def get_products(
-    skip: int = 0, 
-    limit: int = 100, 
+async def get_products(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     search: str = None,
-    sort_by: str = None, # price_asc, price_desc, name_asc
-    db: Session = Depends(get_db)
+    sort_by: str = None, # price_asc, price_desc, name_asc, relevance (with search)
+    paginate: str = "offset", # offset, cursor
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # Normalize parameters so equivalent queries share a cache entry
+    search = search.strip() if search and search.strip() else None
+    if sort_by not in SORT_OPTIONS and not (sort_by == "relevance" and search):
+        sort_by = None
+    params = {
+        "skip": skip,
+        "limit": limit,
+        "search": search,
+        "sort_by": sort_by,
+        "paginate": paginate,
+        "cursor": cursor,
+        "include_total": include_total
+    }
+
+    epoch = catalog_cache.current_epoch()
+    key = catalog_cache.list_key(epoch, params)
+    body = catalog_cache.get(key)
+    if body is not None:
+        return _json_response(body, "HIT")
+
+    result = await list_products(db, **params)
+    body = schemas.PaginatedProductResponse.model_validate(result, from_attributes=True).model_dump_json().encode()
+    catalog_cache.store(key, body, epoch)
+    return _json_response(body, "MISS")
+
+async def list_products(
+    db: AsyncSession,
+    skip: int,
+    limit: int,
+    search: Optional[str],
+    sort_by: Optional[str],
+    paginate: str,
+    cursor: Optional[str],
+    include_total: Optional[bool]
 ):
-    query = db.query(models.Product)
+    query = select(models.Product).options(selectinload(models.Product.images))
     
     if search:
-        search_filter = f"%{search}%"
-        query = query.filter(models.Product.name.ilike(search_filter) | models.Product.description.ilike(search_filter))
+        query = query.where(product_search_filter(search))
         
-    if sort_by == "price_asc":
-        query = query.order_by(models.Product.price.asc())
-    elif sort_by == "price_desc":
-        query = query.order_by(models.Product.price.desc())
-    elif sort_by == "name_asc":
-        query = query.order_by(models.Product.name.asc())
+    if sort_by == "relevance" and search:
+        sort_column, direction = product_search_rank(search), "desc"
     else:
+        sort_column, direction = SORT_OPTIONS.get(sort_by, (None, "asc"))
+    if sort_column is None:
+        sort_by = "id"
         query = query.order_by(models.Product.id.asc())
-        
-    total = query.count()
-    products = query.offset(skip).limit(limit).all()
-    return {"items": products, "total": total}
+    elif direction == "asc":
+        query = query.order_by(sort_column.asc(), models.Product.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), models.Product.id.desc())
+
+    use_cursor = paginate == "cursor" or cursor is not None
+    if include_total is None:
+        include_total = not use_cursor
+
+    if include_total:
+        total = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    else:
+        total = await pagination.estimate_count(db, query)
+
+    if not use_cursor:
+        products = (await db.scalars(query.offset(skip).limit(limit))).all()
+        return {"items": products, "total": total, "total_is_estimate": not include_total}
+
+    # Keyset pagination: continue strictly after the last row of the previous page
+    if cursor:
+        try:
+            value_types = (int,) if sort_column is None else (SORT_VALUE_TYPES[sort_by], int)
+            values = pagination.decode_cursor(cursor, sort_by, value_types)
+        except pagination.InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if sort_column is None:
+            query = query.where(models.Product.id > values[-1])
+        elif direction == "asc":
+            query = query.where(tuple_(sort_column, models.Product.id) > tuple_(*values))
+        else:
+            query = query.where(tuple_(sort_column, models.Product.id) < tuple_(*values))
+
+    # Select the sort key alongside each product so the cursor can be built
+    # from computed orderings such as relevance
+    if sort_column is not None:
+        query = query.add_columns(sort_column)
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = [last[0].id] if sort_column is None else [last[1], last[0].id]
+        next_cursor = pagination.encode_cursor(sort_by, values)
+    products = [row[0] for row in rows]
+
+    return {
+        "items": products,
+        "total": total,
+        "total_is_estimate": not include_total,
+        "next_cursor": next_cursor
+    }
+
+@router.get("/cache/stats")
+async def get_catalog_cache_stats():
+    return catalog_cache.stats()
+
+async def _load_product(db: AsyncSession, product_id: int, *relationships):
+    # populate_existing refreshes objects already in the session, e.g. after
+    # their images were replaced
+    query = select(models.Product)\
+        .where(models.Product.id == product_id)\
+        .options(selectinload(models.Product.images), *(selectinload(rel) for rel in relationships))\
+        .execution_options(populate_existing=True)
+    return await db.scalar(query)
 
 @router.get("/{product_id}", response_model=schemas.ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+async def get_product(product_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    key = catalog_cache.product_key(product_id)
+    body = catalog_cache.get(key)
+    if body is not None:
+        return _json_response(body, "HIT")
+
+    epoch = catalog_cache.current_epoch()
+    product = await _load_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    body = schemas.ProductResponse.model_validate(product).model_dump_json().encode()
+    catalog_cache.store(key, body, epoch)
+    return _json_response(body, "MISS")
 
 @router.post("/", response_model=schemas.ProductResponse)
-def create_product(
+async def create_product(
     product: schemas.ProductCreate, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
 ):
     # Check if admin
-    if current_user.role != models.UserRole.ADMIN:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
         
     # Validate max 5 images
@@ -62,34 +188,38 @@ def create_product(
     
     new_product = models.Product(**product_data)
     db.add(new_product)
-    db.flush() # Get ID
+    await db.flush() # Get ID
     
+    variants = await image_assets.variants_for(db, images)
     for img_url in images:
-        db_image = models.ProductImage(product_id=new_product.id, image_url=img_url)
+        db_image = models.ProductImage(product_id=new_product.id, image_url=img_url, variants=variants.get(img_url))
         db.add(db_image)
         
-    db.commit()
-    db.refresh(new_product)
-    return new_product
-
-    return new_product
+    await db.commit()
+    catalog_cache.invalidate_products([new_product.id])
+    return await _load_product(db, new_product.id)
 
 @router.put("/{product_id}", response_model=schemas.ProductResponse)
-def update_product(
+async def update_product(
     product_id: int,
     product_update: schemas.ProductCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
 ):
-    if current_user.role != models.UserRole.ADMIN:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    db_product = await db.scalar(select(models.Product).where(models.Product.id == product_id))
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     product_data = product_update.dict()
     images = product_data.pop('images', None)
+
+    # During a flash sale stock lives in the shards and products.stock is
+    # overwritten by reconciliation
+    if db_product.flash_sale and product_data["stock"] != db_product.stock:
+        raise HTTPException(status_code=409, detail="Disable the flash sale before changing stock")
     
     for key, value in product_data.items():
         setattr(db_product, key, value)
@@ -99,30 +229,70 @@ def update_product(
             raise HTTPException(status_code=400, detail="Maximum 5 images allowed")
             
         # Delete existing images
-        db.query(models.ProductImage).filter(models.ProductImage.product_id == product_id).delete()
+        await db.execute(delete(models.ProductImage).where(models.ProductImage.product_id == product_id))
         
         # Add new images
+        variants = await image_assets.variants_for(db, images)
         for img_url in images:
-            db_image = models.ProductImage(product_id=product_id, image_url=img_url)
+            db_image = models.ProductImage(product_id=product_id, image_url=img_url, variants=variants.get(img_url))
             db.add(db_image)
     
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    await db.commit()
+    catalog_cache.invalidate_products([product_id])
+    return await _load_product(db, product_id)
+
+@router.post("/{product_id}/flash-sale", response_model=schemas.ProductResponse)
+async def enable_flash_sale(
+    product_id: int,
+    shards: int = inventory.FLASH_SALE_SHARDS,
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
+):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if shards < 1:
+        raise HTTPException(status_code=400, detail="shards must be at least 1")
+
+    try:
+        await db.run_sync(inventory.enable_flash_sale, product_id, shards)
+    except inventory.ProductNotFound:
+        raise HTTPException(status_code=404, detail="Product not found")
+    await db.commit()
+    catalog_cache.invalidate_products([product_id])
+    return await _load_product(db, product_id)
+
+@router.delete("/{product_id}/flash-sale", response_model=schemas.ProductResponse)
+async def disable_flash_sale(
+    product_id: int,
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
+):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    try:
+        await db.run_sync(inventory.disable_flash_sale, product_id)
+    except inventory.ProductNotFound:
+        raise HTTPException(status_code=404, detail="Product not found")
+    await db.commit()
+    catalog_cache.invalidate_products([product_id])
+    return await _load_product(db, product_id)
 
 @router.delete("/{product_id}")
-def delete_product(
+async def delete_product(
     product_id: int, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
 ):
-    if current_user.role != models.UserRole.ADMIN:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    # Relationships touched by the delete cascade have to be loaded up front
+    product = await _load_product(db, product_id, models.Product.order_items)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
         
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await db.commit()
+    catalog_cache.invalidate_products([product_id])
     return {"message": "Product deleted"}
@@ -1,9 +1,17 @@
 import cloudinary
 import cloudinary.uploader
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from .. import models
-from .auth import get_current_user
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from .. import models, schemas, database, principals, outbound, catalog_cache, images
+from ..storage import storage, InvalidUpload
+from .auth import get_current_principal
+from .products import _load_product
+import io
+import math
 import os
+from typing import Union
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,12 +36,87 @@ cloudinary.config(
   api_secret = api_secret 
 )
 
+@router.post("/sign")
+async def sign_upload(principal: principals.Principal = Depends(get_current_principal)):
+    """Short-lived parameters for uploading one image straight to storage."""
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        return storage.sign_upload()
+    except InvalidUpload as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/local/{key:path}")
+async def upload_local(key: str, expires: int, token: str, request: Request):
+    # Target of signed uploads for the local storage backend; the token
+    # stands in for authentication, like a presigned URL
+    if storage.name != "local":
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        storage.check_upload_token(key, expires, token)
+        chunks, size = [], 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > storage.max_bytes:
+                raise InvalidUpload(f"File is larger than {storage.max_bytes} bytes")
+            chunks.append(chunk)
+        return await run_in_threadpool(storage.save, key, chunks)
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/finalize", response_model=Union[schemas.ProductResponse, schemas.UploadedImage])
+async def finalize_upload(
+    upload: schemas.UploadFinalize,
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
+):
+    """Register an image uploaded with /upload/sign, on a product if one is given."""
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        url = storage.verify_upload(upload.public_id, upload.version, upload.signature)
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if upload.product_id is None:
+        await images.register(db, url)
+        variants = await images.variants_for(db, [url])
+        await db.commit()
+        images.workers.notify()
+        return {"url": url, "variants": variants.get(url)}
+
+    # Lock the product so concurrent finalizes can't exceed the image limit
+    product_id = await db.scalar(
+        select(models.Product.id).where(models.Product.id == upload.product_id).with_for_update()
+    )
+    if product_id is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    image_count = await db.scalar(
+        select(func.count()).select_from(models.ProductImage).where(models.ProductImage.product_id == product_id)
+    )
+    if image_count >= 5:
+        raise HTTPException(status_code=400, detail="Maximum 5 images allowed")
+
+    await images.register(db, url)
+    variants = await images.variants_for(db, [url])
+    db.add(models.ProductImage(product_id=product_id, image_url=url, variants=variants.get(url)))
+    await db.commit()
+    images.workers.notify()
+    catalog_cache.invalidate_products([product_id])
+    return await _load_product(db, product_id)
+
+@router.get("/images/stats")
+async def get_image_stats(db: AsyncSession = Depends(database.get_async_db)):
+    return await images.stats(db)
+
+# Proxies the file through the API; kept for clients that don't use /sign
 @router.post("/image")
 async def upload_image(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(database.get_async_db),
+    principal: principals.Principal = Depends(get_current_principal)
 ):
-    if current_user.role != models.UserRole.ADMIN:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
         
     if not cloud_name:
@@ -44,12 +127,31 @@ async def upload_image(
     print(f"Debug: API Key present: {bool(api_key)}")
     print(f"Debug: API Secret present: {bool(api_secret)}")
 
+    data = await file.read()
+    sha256 = images.content_hash(data)
+    # Identical content was uploaded before: reuse it and its variants
+    existing = await images.find_by_hash(db, sha256)
+    if existing is not None:
+        return {"url": existing.source_url, "variants": existing.variants}
+
     try:
         # Upload to Cloudinary
         print("Attempting upload to Cloudinary...")
-        result = cloudinary.uploader.upload(file.file)
+        result = await outbound.cloudinary_api.call(
+            cloudinary.uploader.upload, io.BytesIO(data), timeout=outbound.CLOUDINARY_TIMEOUT_SECONDS
+        )
         print("Upload successful")
-        return {"url": result.get("secure_url")}
+        url = result.get("secure_url")
+        await images.register(db, url, sha256)
+        await db.commit()
+        images.workers.notify()
+        return {"url": url, "variants": None}
+    except outbound.ProviderUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Image provider is unavailable, try again shortly",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         print(f"Upload error details: {type(e).__name__}: {str(e)}")
         import traceback
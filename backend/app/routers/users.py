@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from .. import models, schemas, database
-from .auth import get_current_user
+from .. import models, schemas
+from .auth import get_current_user, get_db
 from geoalchemy2.shape import to_shape
 
 router = APIRouter(
@@ -9,13 +9,6 @@ router = APIRouter(
     tags=["users"]
 )
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 from typing import List
 
 @router.get("/me/addresses", response_model=List[schemas.AddressResponse])
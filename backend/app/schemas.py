@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, validator
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 # --- Token ---
@@ -9,6 +9,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[int] = None
+    role: Optional[str] = None
 
 # --- Address ---
 class AddressBase(BaseModel):
@@ -64,9 +66,18 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
+class ImageVariant(BaseModel):
+    width: int
+    height: int
+    jpeg: str
+    webp: str
+
 class ProductResponse(ProductBase):
     id: int
     created_at: datetime
+    flash_sale: bool = False
+    # One entry per image (thumbnail, card, full); None until processed
+    image_variants: List[Optional[Dict[str, ImageVariant]]] = []
 
     class Config:
         from_attributes = True
@@ -83,6 +94,21 @@ class ProductResponse(ProductBase):
 class PaginatedProductResponse(BaseModel):
     items: List[ProductResponse]
     total: int
+    total_is_estimate: bool = False
+    next_cursor: Optional[str] = None
+
+# --- Upload ---
+class UploadFinalize(BaseModel):
+    public_id: str
+    signature: str
+    version: Optional[str] = None
+    # Without a product the image is only registered, and its url is
+    # returned for the product form to save
+    product_id: Optional[int] = None
+
+class UploadedImage(BaseModel):
+    url: str
+    variants: Optional[Dict[str, ImageVariant]] = None
 
 # --- Order ---
 class OrderItemBase(BaseModel):
@@ -0,0 +1,25 @@
+from sqlalchemy import func, or_, cast, Float, literal_column
+from . import models
+
+def _tsquery(term: str):
+    config = literal_column(f"'{models.PRODUCT_SEARCH_CONFIG}'::regconfig")
+    return func.websearch_to_tsquery(config, term)
+
+def product_search_filter(term: str):
+    # Every branch is served by a GIN index: full-text match on search_vector,
+    # substring ILIKE and fuzzy `%` similarity through the pg_trgm indexes
+    pattern = f"%{term}%"
+    return or_(
+        models.Product.search_vector.op("@@")(_tsquery(term)),
+        models.Product.name.ilike(pattern),
+        models.Product.description.ilike(pattern),
+        models.Product.name.op("%")(term)
+    )
+
+def product_search_rank(term: str):
+    # Cast to double precision so the value survives a round trip through a
+    # pagination cursor unchanged
+    return cast(
+        func.ts_rank(models.Product.search_vector, _tsquery(term)) + func.similarity(models.Product.name, term),
+        Float
+    )
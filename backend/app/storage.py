@@ -0,0 +1,177 @@
+"""Media storage backends for direct-from-browser uploads.
+
+Both backends follow the same contract: sign_upload() returns where and how
+the browser should send the file, the storage answers the upload with a
+public_id and signature, and verify_upload() checks that signature and
+returns the url the API registers. MEDIA_STORAGE=local stores files under
+LOCAL_MEDIA_DIR (served at LOCAL_MEDIA_URL) for offline testing.
+"""
+import hashlib
+import hmac
+import io
+import os
+import time
+import urllib.request
+import uuid
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+from starlette.concurrency import run_in_threadpool
+from . import outbound
+from .auth_utils import SECRET_KEY
+from .outbound import CLOUDINARY_UPLOAD_PREFIX
+
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "cloudinary")
+UPLOAD_SIGNATURE_TTL_SECONDS = int(os.getenv("UPLOAD_SIGNATURE_TTL_SECONDS", "600"))
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "products")
+LOCAL_MEDIA_DIR = os.getenv("LOCAL_MEDIA_DIR", "media")
+LOCAL_MEDIA_URL = os.getenv("LOCAL_MEDIA_URL", "/media")
+LOCAL_MEDIA_MAX_BYTES = int(os.getenv("LOCAL_MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+# Largest original the image pipeline will fetch back from storage
+MEDIA_READ_MAX_BYTES = int(os.getenv("MEDIA_READ_MAX_BYTES", str(20 * 1024 * 1024)))
+
+class InvalidUpload(Exception):
+    pass
+
+class CloudinaryStorage:
+    name = "cloudinary"
+
+    def sign_upload(self, folder=UPLOAD_FOLDER):
+        config = cloudinary.config()
+        if not config.cloud_name or not config.api_key or not config.api_secret:
+            raise InvalidUpload("Cloudinary credentials are not configured")
+        timestamp = int(time.time())
+        params = {"timestamp": timestamp, "folder": folder}
+        prefix = CLOUDINARY_UPLOAD_PREFIX or "https://api.cloudinary.com"
+        return {
+            "backend": self.name,
+            "method": "POST",
+            "upload_url": f"{prefix}/v1_1/{config.cloud_name}/image/upload",
+            "fields": {
+                **params,
+                "api_key": config.api_key,
+                "signature": cloudinary.utils.api_sign_request(params, config.api_secret)
+            },
+            # Cloudinary itself rejects signed requests older than an hour
+            "expires_at": timestamp + min(UPLOAD_SIGNATURE_TTL_SECONDS, 3600)
+        }
+
+    def verify_upload(self, public_id, version, signature):
+        # The upload response is signed over public_id and version only, so
+        # the URL is built from those rather than taken from the client
+        if not version or not cloudinary.utils.verify_api_response_signature(public_id, version, signature):
+            raise InvalidUpload("Upload signature does not match")
+        url, _ = cloudinary.utils.cloudinary_url(public_id, version=version, secure=True)
+        return url
+
+    def _download(self, url):
+        with urllib.request.urlopen(url, timeout=outbound.CLOUDINARY_TIMEOUT_SECONDS) as response:
+            data = response.read(MEDIA_READ_MAX_BYTES + 1)
+        if len(data) > MEDIA_READ_MAX_BYTES:
+            raise InvalidUpload(f"File is larger than {MEDIA_READ_MAX_BYTES} bytes")
+        return data
+
+    async def read(self, url):
+        return await outbound.cloudinary_api.call(self._download, url)
+
+    async def put(self, key, data, format):
+        """Store bytes under key (without extension); returns the public URL."""
+        # public_id is unique regardless of format, so each format needs its own
+        result = await outbound.cloudinary_api.call(
+            cloudinary.uploader.upload,
+            io.BytesIO(data),
+            public_id=f"{key}-{format}",
+            format=format,
+            overwrite=True,
+            timeout=outbound.CLOUDINARY_TIMEOUT_SECONDS
+        )
+        return result.get("secure_url")
+
+class LocalStorage:
+    name = "local"
+
+    def __init__(self, directory, base_url, max_bytes):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.max_bytes = max_bytes
+
+    def _sign(self, *parts):
+        message = ":".join(str(part) for part in parts).encode()
+        return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    def public_url(self, key):
+        return f"{self.base_url}/{key}"
+
+    def path_for(self, key):
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep):
+            raise InvalidUpload("Invalid key")
+        return path
+
+    def sign_upload(self, folder=UPLOAD_FOLDER):
+        key = f"{folder}/{uuid.uuid4().hex}"
+        expires = int(time.time()) + UPLOAD_SIGNATURE_TTL_SECONDS
+        token = self._sign("upload", key, expires, self.max_bytes)
+        return {
+            "backend": self.name,
+            "method": "PUT",
+            "upload_url": f"/upload/local/{key}?expires={expires}&token={token}",
+            "fields": {},
+            "expires_at": expires
+        }
+
+    def check_upload_token(self, key, expires, token):
+        if expires < time.time():
+            raise InvalidUpload("Upload URL has expired")
+        if not hmac.compare_digest(token, self._sign("upload", key, expires, self.max_bytes)):
+            raise InvalidUpload("Invalid upload token")
+
+    def save(self, key, chunks):
+        """Write an iterable of byte chunks to key; returns the upload response."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 0
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise InvalidUpload(f"File is larger than {self.max_bytes} bytes")
+                    f.write(chunk)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return {
+            "public_id": key,
+            "url": self.public_url(key),
+            "bytes": size,
+            "signature": self._sign("uploaded", key)
+        }
+
+    def _read(self, url):
+        if not url.startswith(self.base_url + "/"):
+            raise InvalidUpload("URL is not in local storage")
+        with open(self.path_for(url[len(self.base_url) + 1:]), "rb") as f:
+            return f.read()
+
+    async def read(self, url):
+        return await run_in_threadpool(self._read, url)
+
+    async def put(self, key, data, format):
+        key = f"{key}.{format}"
+        await run_in_threadpool(self.save, key, [data])
+        return self.public_url(key)
+
+    def verify_upload(self, public_id, version, signature):
+        if not hmac.compare_digest(signature, self._sign("uploaded", public_id)):
+            raise InvalidUpload("Upload signature does not match")
+        if not os.path.exists(self.path_for(public_id)):
+            raise InvalidUpload("Uploaded file not found")
+        return self.public_url(public_id)
+
+if MEDIA_STORAGE == "local":
+    storage = LocalStorage(LOCAL_MEDIA_DIR, LOCAL_MEDIA_URL, LOCAL_MEDIA_MAX_BYTES)
+else:
+    storage = CloudinaryStorage()
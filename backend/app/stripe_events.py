@@ -0,0 +1,156 @@
+"""Outbox of Stripe webhook events and the workers that process it.
+
+The webhook only records each event (keyed by Stripe event id, so
+redeliveries are ignored) and returns. Worker threads claim due events with
+FOR UPDATE SKIP LOCKED and apply them in the same transaction that marks
+them done. Failures are retried with exponential backoff; after
+STRIPE_EVENT_MAX_ATTEMPTS the event is marked dead.
+"""
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, checkout
+from .database import SessionLocal
+
+STRIPE_EVENT_WORKERS = int(os.getenv("STRIPE_EVENT_WORKERS", "2"))
+STRIPE_EVENT_POLL_SECONDS = float(os.getenv("STRIPE_EVENT_POLL_SECONDS", "1.0"))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENT_MAX_ATTEMPTS", "8"))
+STRIPE_EVENT_BACKOFF_SECONDS = float(os.getenv("STRIPE_EVENT_BACKOFF_SECONDS", "2"))
+STRIPE_EVENT_MAX_BACKOFF_SECONDS = float(os.getenv("STRIPE_EVENT_MAX_BACKOFF_SECONDS", "600"))
+
+def _checkout_session_completed(event, db):
+    return checkout.handle_checkout_session(event.payload["data"]["object"], db), checkout.after_checkout_commit
+
+# Event type -> handler(event, db) returning (result, after_commit). Other
+# event types are marked done without doing anything.
+HANDLERS = {
+    "checkout.session.completed": _checkout_session_completed,
+}
+
+async def record_event(db: AsyncSession, event_id: str, event_type: str, payload: dict) -> bool:
+    """Store an incoming event; returns False if it was already recorded."""
+    statement = insert(models.StripeEvent)\
+        .values(id=event_id, type=event_type, payload=payload)\
+        .on_conflict_do_nothing(index_elements=["id"])\
+        .returning(models.StripeEvent.id)
+    inserted = await db.scalar(statement)
+    await db.commit()
+    if inserted is not None:
+        workers.notify()
+    return inserted is not None
+
+def backoff_seconds(attempts):
+    return min(STRIPE_EVENT_BACKOFF_SECONDS * 2 ** (attempts - 1), STRIPE_EVENT_MAX_BACKOFF_SECONDS)
+
+def process_next(db) -> bool:
+    """Claim and process one due event. Returns False if none was due."""
+    event = db.scalar(
+        select(models.StripeEvent)
+        .where(
+            models.StripeEvent.status == models.StripeEventStatus.PENDING.value,
+            models.StripeEvent.next_attempt_at <= func.now()
+        )
+        .order_by(models.StripeEvent.next_attempt_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if event is None:
+        db.rollback()
+        return False
+
+    handler = HANDLERS.get(event.type)
+    result, after_commit = None, None
+    try:
+        # A savepoint keeps the claim (row lock) if the handler fails
+        with db.begin_nested():
+            if handler is not None:
+                result, after_commit = handler(event, db)
+    except Exception as e:
+        event.attempts += 1
+        event.last_error = "".join(traceback.format_exception_only(type(e), e)).strip()[:2000]
+        if event.attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+            event.status = models.StripeEventStatus.DEAD.value
+            print(f"Warning: Stripe event {event.id} ({event.type}) is dead after {event.attempts} attempts: {event.last_error}")
+        else:
+            event.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=backoff_seconds(event.attempts))
+        db.commit()
+        return True
+
+    event.attempts += 1
+    event.status = models.StripeEventStatus.DONE.value
+    event.processed_at = datetime.now(timezone.utc)
+    event.last_error = None
+    db.commit()
+    if after_commit is not None:
+        after_commit(result)
+    return True
+
+def retry_dead(db, event_ids=None):
+    """Put dead events back in the queue. Returns how many were requeued."""
+    query = select(models.StripeEvent).where(models.StripeEvent.status == models.StripeEventStatus.DEAD.value)
+    if event_ids:
+        query = query.where(models.StripeEvent.id.in_(event_ids))
+    events = db.scalars(query.with_for_update()).all()
+    for event in events:
+        event.status = models.StripeEventStatus.PENDING.value
+        event.attempts = 0
+        event.next_attempt_at = datetime.now(timezone.utc)
+    db.commit()
+    workers.notify()
+    return len(events)
+
+async def stats(db: AsyncSession):
+    rows = (await db.execute(
+        select(models.StripeEvent.status, func.count()).group_by(models.StripeEvent.status)
+    )).all()
+    return {status: count for status, count in rows}
+
+class EventWorkers:
+    """Pool of threads draining the events table."""
+
+    def __init__(self, size, poll_interval):
+        self.size = size
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for index in range(self.size):
+            thread = threading.Thread(target=self._run, name=f"stripe-event-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # Events being processed finish; the rest stay pending in the table
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                with SessionLocal() as db:
+                    while not self._stopping and process_next(db):
+                        pass
+            except Exception as e:
+                print(f"Warning: Stripe event worker failed. Error: {e}")
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self.poll_interval)
+
+workers = EventWorkers(STRIPE_EVENT_WORKERS, STRIPE_EVENT_POLL_SECONDS)
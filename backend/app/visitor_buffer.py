@@ -0,0 +1,124 @@
+import io
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from .database import engine
+
+# "direct" writes one row per request, "buffered" queues points in memory
+# and bulk-loads them with COPY from a background thread.
+VISITOR_INGEST_MODE = os.getenv("VISITOR_INGEST_MODE", "direct")
+VISITOR_BUFFER_MAX_SIZE = int(os.getenv("VISITOR_BUFFER_MAX_SIZE", "10000"))
+VISITOR_FLUSH_BATCH_SIZE = int(os.getenv("VISITOR_FLUSH_BATCH_SIZE", "1000"))
+VISITOR_FLUSH_INTERVAL_SECONDS = float(os.getenv("VISITOR_FLUSH_INTERVAL_SECONDS", "1.0"))
+# What to do when the buffer is full: "drop" the point silently or "reject"
+# the request so the caller gets a 503.
+VISITOR_OVERLOAD_POLICY = os.getenv("VISITOR_OVERLOAD_POLICY", "drop")
+
+class BufferFull(Exception):
+    pass
+
+class VisitorLocationBuffer:
+    """Bounded in-process queue of visitor points flushed in bulk."""
+
+    def __init__(self, max_size, batch_size, flush_interval, overload_policy):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overload_policy = overload_policy
+        self._points = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="visitor-buffer-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Wake the flusher and wait until everything queued has been written
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    def add(self, longitude, latitude, province_id):
+        with self._condition:
+            if len(self._points) >= self.max_size:
+                self.dropped += 1
+                if self.overload_policy == "reject":
+                    raise BufferFull()
+                return False
+            self._points.append((longitude, latitude, province_id, datetime.now(timezone.utc)))
+            self.buffered += 1
+            if len(self._points) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def stats(self):
+        return {
+            "mode": VISITOR_INGEST_MODE,
+            "pending": len(self._points),
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "dropped": self.dropped
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._points) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = [self._points.popleft() for _ in range(min(self.batch_size, len(self._points)))]
+                done = self._stopping and not self._points
+
+            if batch:
+                self._write(batch)
+            if done:
+                return
+
+    def _write(self, batch):
+        data = io.StringIO()
+        for longitude, latitude, province_id, created_at in batch:
+            province = "\\N" if province_id is None else str(province_id)
+            data.write(f"SRID=4326;POINT({longitude} {latitude})\t{province}\t{created_at.isoformat()}\n")
+        data.seek(0)
+
+        try:
+            connection = engine.raw_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.copy_expert(
+                        "COPY visitor_locations (location, province_id, created_at) FROM STDIN",
+                        data
+                    )
+                connection.commit()
+            finally:
+                connection.close()
+            with self._condition:
+                self.flushed += len(batch)
+        except Exception as e:
+            with self._condition:
+                self.dropped += len(batch)
+            print(f"Warning: Could not flush {len(batch)} visitor locations. Error: {e}")
+
+buffer = VisitorLocationBuffer(
+    max_size=VISITOR_BUFFER_MAX_SIZE,
+    batch_size=VISITOR_FLUSH_BATCH_SIZE,
+    flush_interval=VISITOR_FLUSH_INTERVAL_SECONDS,
+    overload_policy=VISITOR_OVERLOAD_POLICY
+)
@@ -0,0 +1,11 @@
+from app.database import engine
+from app.provinces import backfill_visitor_provinces
+
+def backfill():
+    with engine.connect() as connection:
+        print("Assigning provinces to visitor locations...")
+        total = backfill_visitor_provinces(connection)
+        print(f"Backfilled {total} visitor locations.")
+
+if __name__ == "__main__":
+    backfill()
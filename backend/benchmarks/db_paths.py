@@ -0,0 +1,110 @@
+"""Load-test the sync (psycopg2 + threadpool) and async (asyncpg) database paths.
+
+Runs the product list query the API serves, optionally padded with pg_sleep
+to mimic a slow database, at a fixed number of concurrent clients. The sync
+path goes through a thread pool sized like Starlette's default (40 threads),
+the async path through AsyncSession on the event loop.
+
+    python -m benchmarks.db_paths --requests 2000 --concurrency 200 --sleep-ms 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload
+from app import models
+from app.database import SessionLocal, AsyncSessionLocal, engine, async_engine
+
+STARLETTE_THREADPOOL_SIZE = 40
+
+def _list_query(limit):
+    return select(models.Product)\
+        .options(selectinload(models.Product.images))\
+        .order_by(models.Product.id)\
+        .limit(limit)
+
+def _summary(name, latencies, elapsed):
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    return {
+        "path": name,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": percentile(0.95),
+        "p99": percentile(0.99)
+    }
+
+def run_sync(requests, concurrency, sleep_ms, limit):
+    def handle_request():
+        with SessionLocal() as db:
+            if sleep_ms:
+                db.execute(select(func.pg_sleep(sleep_ms / 1000)))
+            db.scalars(_list_query(limit)).all()
+
+    # Each client hands its request to a pool sized like Starlette's, so
+    # latency includes time spent queued for a worker thread
+    pool = ThreadPoolExecutor(max_workers=STARLETTE_THREADPOOL_SIZE)
+    per_client = requests // concurrency
+
+    def client():
+        latencies = []
+        for _ in range(per_client):
+            start = time.perf_counter()
+            pool.submit(handle_request).result()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda _: client(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return _summary("sync", [latency for latencies in results for latency in latencies], elapsed)
+
+async def run_async(requests, concurrency, sleep_ms, limit):
+    per_client = requests // concurrency
+
+    async def client():
+        latencies = []
+        for _ in range(per_client):
+            start = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                if sleep_ms:
+                    await db.execute(select(func.pg_sleep(sleep_ms / 1000)))
+                (await db.scalars(_list_query(limit))).all()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await async_engine.dispose()
+    return _summary("async", [latency for latencies in results for latency in latencies], elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--sleep-ms", type=float, default=0)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [
+        run_sync(args.requests, args.concurrency, args.sleep_ms, args.limit),
+        asyncio.run(run_async(args.requests, args.concurrency, args.sleep_ms, args.limit))
+    ]
+    engine.dispose()
+
+    print(f"{'path':>6} | {'req/s':>8} | {'p50':>8} {'p95':>8} {'p99':>8}")
+    for result in results:
+        print(
+            f"{result['path']:>6} | {result['throughput']:>8.1f} | "
+            f"{result['p50']:>6.1f}ms {result['p95']:>6.1f}ms {result['p99']:>6.1f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure login throughput against catalog latency under mixed load.
+
+Drives a running API with two groups of clients at once: login clients that
+post credentials to /auth/login in a loop, and catalog clients that fetch
+/products/. A healthy server keeps catalog latency flat while logins are
+limited by the password worker pool (503s count as rejected logins).
+
+    python -m benchmarks.login --url http://localhost:8000 --duration 20 \\
+        --login-clients 50 --catalog-clients 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+BENCH_EMAIL = "login-bench@example.com"
+BENCH_PASSWORD = "login-bench-password"
+
+def _percentiles(latencies):
+    if not latencies:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    return {"p50": statistics.median(latencies) * 1000, "p95": percentile(0.95), "p99": percentile(0.99)}
+
+async def _ensure_user(client):
+    response = await client.post("/auth/register", json={
+        "email": BENCH_EMAIL,
+        "password": BENCH_PASSWORD,
+        "full_name": "Login Bench"
+    })
+    if response.status_code not in (200, 400):
+        response.raise_for_status()
+
+async def _login_client(client, deadline, results):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post("/auth/login", data={"username": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        elapsed = time.perf_counter() - start
+        if response.status_code == 200:
+            results["latencies"].append(elapsed)
+        elif response.status_code == 503:
+            results["rejected"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+        else:
+            results["errors"] += 1
+
+async def _catalog_client(client, deadline, results):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/products/", params={"limit": 20})
+        elapsed = time.perf_counter() - start
+        if response.status_code == 200:
+            results["latencies"].append(elapsed)
+        else:
+            results["errors"] += 1
+
+async def _run_phase(url, duration, login_clients, catalog_clients):
+    logins = {"latencies": [], "rejected": 0, "errors": 0}
+    catalog = {"latencies": [], "errors": 0}
+    limits = httpx.Limits(max_connections=login_clients + catalog_clients + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        await _ensure_user(client)
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(_login_client(client, deadline, logins) for _ in range(login_clients)),
+            *(_catalog_client(client, deadline, catalog) for _ in range(catalog_clients))
+        )
+    return {
+        "login_clients": login_clients,
+        "logins_per_second": len(logins["latencies"]) / duration,
+        "logins_rejected": logins["rejected"],
+        "login": _percentiles(logins["latencies"]),
+        "catalog_per_second": len(catalog["latencies"]) / duration,
+        "catalog": _percentiles(catalog["latencies"]),
+        "errors": logins["errors"] + catalog["errors"]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--login-clients", type=int, default=50)
+    parser.add_argument("--catalog-clients", type=int, default=20)
+    args = parser.parse_args()
+
+    # Baseline without logins, then the same catalog load with a login burst
+    phases = [
+        asyncio.run(_run_phase(args.url, args.duration, 0, args.catalog_clients)),
+        asyncio.run(_run_phase(args.url, args.duration, args.login_clients, args.catalog_clients))
+    ]
+
+    print(f"{'logins':>6} | {'login/s':>8} {'503s':>6} {'login p95':>10} | {'catalog/s':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for phase in phases:
+        print(
+            f"{phase['login_clients']:>6} | {phase['logins_per_second']:>8.1f} {phase['logins_rejected']:>6} "
+            f"{phase['login']['p95']:>8.1f}ms | {phase['catalog_per_second']:>9.1f} "
+            f"{phase['catalog']['p50']:>6.1f}ms {phase['catalog']['p95']:>6.1f}ms {phase['catalog']['p99']:>6.1f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compare legacy ILIKE product search with the indexed full-text/trigram path.
+
+Builds a scratch copy of the products table in the ``search_bench`` schema at
+each size, times the old ``ilike('%term%')`` query without indexes and the new
+filter with its GIN indexes, then drops the schema.
+
+    python -m benchmarks.search --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+from sqlalchemy import text
+from app.database import engine
+from app.models import PRODUCT_SEARCH_CONFIG, PRODUCT_SEARCH_VECTOR_SQL
+
+WORDS = [
+    "sensor", "temperature", "humidity", "esp32", "arduino", "raspberry", "relay", "module",
+    "board", "wifi", "bluetooth", "lora", "zigbee", "camera", "motion", "ultrasonic",
+    "display", "oled", "servo", "stepper", "driver", "battery", "solar", "gateway",
+    "controller", "kit", "cable", "adapter", "gps", "accelerometer", "gyroscope", "pressure"
+]
+
+# Exact words, multi-word queries, substrings and typos
+TERMS = ["sensor", "esp32 wifi", "ultrason", "temprature", "oled display", "gatway", "lora", "kit"]
+
+LEGACY_QUERY = """
+    SELECT id, name FROM search_bench.products
+    WHERE name ILIKE :pattern OR description ILIKE :pattern
+    ORDER BY id
+    LIMIT 20
+"""
+
+INDEXED_QUERY = f"""
+    SELECT id, name FROM search_bench.products
+    WHERE search_vector @@ websearch_to_tsquery('{PRODUCT_SEARCH_CONFIG}', :term)
+       OR name ILIKE :pattern OR description ILIKE :pattern
+       OR name % :term
+    ORDER BY ts_rank(search_vector, websearch_to_tsquery('{PRODUCT_SEARCH_CONFIG}', :term))
+           + similarity(name, :term) DESC, id
+    LIMIT 20
+"""
+
+def _sql_words():
+    return "ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "]"
+
+def build_table(connection, size):
+    connection.execute(text("DROP SCHEMA IF EXISTS search_bench CASCADE"))
+    connection.execute(text("CREATE SCHEMA search_bench"))
+    connection.execute(text(f"""
+        CREATE TABLE search_bench.products (
+            id serial PRIMARY KEY,
+            name varchar NOT NULL,
+            description varchar,
+            search_vector tsvector GENERATED ALWAYS AS ({PRODUCT_SEARCH_VECTOR_SQL}) STORED
+        )
+    """))
+    words = _sql_words()
+    connection.execute(text(f"""
+        INSERT INTO search_bench.products (name, description)
+        SELECT
+            initcap(w[1 + (g * 7) % cardinality(w)]) || ' ' || w[1 + (g * 13) % cardinality(w)] || ' ' || g,
+            'A ' || w[1 + (g * 3) % cardinality(w)] || ' ' || w[1 + (g * 11) % cardinality(w)]
+                || ' for your ' || w[1 + (g * 17) % cardinality(w)] || ' projects.'
+        FROM generate_series(1, :size) AS g, (SELECT {words} AS w) AS vocabulary
+    """), {"size": size})
+    connection.execute(text("ANALYZE search_bench.products"))
+
+def create_indexes(connection):
+    connection.execute(text("CREATE INDEX ON search_bench.products USING gin (search_vector)"))
+    connection.execute(text("CREATE INDEX ON search_bench.products USING gin (name gin_trgm_ops)"))
+    connection.execute(text("CREATE INDEX ON search_bench.products USING gin (description gin_trgm_ops)"))
+    connection.execute(text("ANALYZE search_bench.products"))
+
+def time_query(connection, sql, repeats):
+    samples = []
+    for _ in range(repeats):
+        for term in TERMS:
+            params = {"term": term, "pattern": f"%{term}%"}
+            start = time.perf_counter()
+            connection.execute(text(sql), params).all()
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def run(sizes, repeats):
+    results = []
+    with engine.connect() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for size in sizes:
+            print(f"Building {size} products...")
+            build_table(connection, size)
+            connection.commit()
+            legacy = time_query(connection, LEGACY_QUERY, repeats)
+            create_indexes(connection)
+            connection.commit()
+            indexed = time_query(connection, INDEXED_QUERY, repeats)
+            results.append((size, legacy, indexed))
+        connection.execute(text("DROP SCHEMA IF EXISTS search_bench CASCADE"))
+        connection.commit()
+
+    print()
+    print(f"{'products':>10} | {'ilike p50':>10} {'ilike p95':>10} | {'indexed p50':>11} {'indexed p95':>11}")
+    for size, (legacy_p50, legacy_p95), (indexed_p50, indexed_p95) in results:
+        print(f"{size:>10} | {legacy_p50:>8.2f}ms {legacy_p95:>8.2f}ms | {indexed_p50:>9.2f}ms {indexed_p95:>9.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.repeats)
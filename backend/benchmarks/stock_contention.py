@@ -0,0 +1,107 @@
+"""Contend for the stock of a single product with the legacy and set-based paths.
+
+Creates a scratch product with --stock units, then lets --workers threads
+buy one unit at a time until they have made --attempts purchases between
+them. The legacy path reads the row, checks stock in Python and writes the
+decremented value back (as create_order used to); the reserve path is
+inventory.reserve_stock, and the flash path is the same with the product in
+flash-sale mode (stock split over shard rows). Oversold is the number of
+successful purchases beyond the initial stock, plus any stock below zero.
+
+    python -m benchmarks.stock_contention --stock 500 --attempts 2000 --workers 32
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, delete
+from app import models, inventory
+from app.database import SessionLocal, engine
+
+def _legacy_purchase(db, product_id):
+    product = db.scalar(select(models.Product).where(models.Product.id == product_id))
+    if product.stock < 1:
+        db.rollback()
+        return False
+    product.stock -= 1
+    db.commit()
+    return True
+
+def _reserve_purchase(db, product_id):
+    try:
+        inventory.reserve_stock(db, {product_id: 1})
+    except inventory.InsufficientStock:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+PATHS = {"legacy": _legacy_purchase, "reserve": _reserve_purchase, "flash": _reserve_purchase}
+
+def run(path, stock, attempts, workers):
+    with SessionLocal() as db:
+        product = models.Product(name="stock-contention-bench", description="", price=1.0, stock=stock)
+        db.add(product)
+        db.commit()
+        product_id = product.id
+        if path == "flash":
+            inventory.enable_flash_sale(db, product_id)
+            db.commit()
+
+    purchase = PATHS[path]
+    remaining = [attempts]
+    succeeded = [0]
+    lock = threading.Lock()
+
+    def worker():
+        with SessionLocal() as db:
+            while True:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                if purchase(db, product_id):
+                    with lock:
+                        succeeded[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker) for _ in range(workers)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    with SessionLocal() as db:
+        if path == "flash":
+            inventory.reconcile_flash_sales(db)
+        final_stock = db.scalar(select(models.Product.stock).where(models.Product.id == product_id))
+        db.execute(delete(models.Product).where(models.Product.id == product_id))
+        db.commit()
+
+    return {
+        "path": path,
+        "throughput": attempts / elapsed,
+        "succeeded": succeeded[0],
+        "final_stock": final_stock,
+        "oversold": max(0, succeeded[0] - stock) + max(0, -final_stock)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    args = parser.parse_args()
+
+    results = [run(path, args.stock, args.attempts, args.workers) for path in args.paths]
+    engine.dispose()
+
+    print(f"{'path':>8} | {'attempts/s':>10} | {'sold':>6} {'final stock':>11} {'oversold':>8}")
+    for result in results:
+        print(
+            f"{result['path']:>8} | {result['throughput']:>10.1f} | "
+            f"{result['succeeded']:>6} {result['final_stock']:>11} {result['oversold']:>8}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""Endpoint benchmark suite with latency percentiles and regression gating.
+
+Drives every router of a running API one scenario at a time at a fixed
+concurrency and writes throughput, error counts and p50/p95/p99 latency per
+endpoint to JSON. compare checks a run against a stored baseline and exits
+non-zero when an endpoint regressed by more than the threshold.
+
+    python -m benchmarks.suite seed --scale 1 --seed 42
+    python -m benchmarks.suite run --url http://localhost:8000 --concurrency 32 \\
+        --duration 15 --output bench.json
+    python -m benchmarks.suite compare baseline.json bench.json --threshold 0.10
+
+Runs are only comparable against the same seeded data, concurrency and
+hardware; the scale and settings are recorded in each result file.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import httpx
+
+BENCH_PASSWORD = "suite-bench-password"
+SEARCH_TERMS = ["sensor", "wireless relay", "esp32", "mini display", "contrl", "industrial kit", "antena"]
+
+def _percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": len(latencies) / duration,
+        "p50": 0.0,
+        "p95": 0.0,
+        "p99": 0.0
+    }
+    if latencies:
+        summary.update(p50=_percentile(latencies, 0.5), p95=_percentile(latencies, 0.95), p99=_percentile(latencies, 0.99))
+    return summary
+
+class Recorder:
+    """Latencies and errors per endpoint name for one scenario."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    async def request(self, name, send, expected=(200,)):
+        start = time.perf_counter()
+        try:
+            response = await send
+        except httpx.HTTPError:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        elapsed = time.perf_counter() - start
+        self.latencies.setdefault(name, [])
+        if response.status_code in expected:
+            self.latencies[name].append(elapsed)
+        else:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            statuses = self.statuses.setdefault(name, {})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return response
+
+class Context:
+    """Users, tokens and products shared by the scenarios."""
+
+    def __init__(self, tokens, product_ids, rng):
+        self.tokens = tokens
+        self.product_ids = product_ids
+        self.rng = rng
+
+    def auth(self):
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+# --- Scenarios: one iteration each, recording every request it makes ---
+
+async def products_list(ctx, client, rec):
+    await rec.request("products.list", client.get("/products/", params={"limit": 20, "skip": ctx.rng.randrange(0, 200, 20)}))
+
+async def products_list_cursor(ctx, client, rec):
+    sort_by = ctx.rng.choice(["price_asc", "price_desc", "name_asc"])
+    await rec.request("products.list_cursor", client.get("/products/", params={"limit": 20, "paginate": "cursor", "sort_by": sort_by}))
+
+async def products_search(ctx, client, rec):
+    params = {"limit": 20, "search": ctx.rng.choice(SEARCH_TERMS), "sort_by": "relevance"}
+    await rec.request("products.search", client.get("/products/", params=params))
+
+async def products_detail(ctx, client, rec):
+    await rec.request("products.detail", client.get(f"/products/{ctx.rng.choice(ctx.product_ids)}"))
+
+async def cart_crud(ctx, client, rec):
+    headers = ctx.auth()
+    product_id = ctx.rng.choice(ctx.product_ids)
+    response = await rec.request("cart.add", client.post(
+        "/cart/items", json={"product_id": product_id, "quantity": 1}, headers=headers
+    ))
+    await rec.request("cart.get", client.get("/cart/", headers=headers))
+    if response is None or response.status_code != 200:
+        return
+    line = next((item for item in response.json()["items"] if item["product_id"] == product_id), None)
+    if line is None:
+        return
+    # Another client of the same user may have removed the line meanwhile
+    await rec.request("cart.update", client.put(
+        f"/cart/items/{line['id']}", json={"quantity": 2}, headers=headers
+    ), expected=(200, 404))
+    await rec.request("cart.remove", client.delete(f"/cart/items/{line['id']}", headers=headers), expected=(200, 404))
+
+async def users_addresses(ctx, client, rec):
+    headers = ctx.auth()
+    await rec.request("users.addresses", client.get("/users/me/addresses", headers=headers))
+    address = {"address_line": "1 Bench Road", "city": "Bangkok", "province": "Bangkok", "zip_code": "10200"}
+    # Users hold at most three addresses; other clients may fill the slots
+    response = await rec.request("users.address_create", client.post(
+        "/users/me/addresses", json=address, headers=headers
+    ), expected=(200, 400))
+    if response is None or response.status_code != 200:
+        return
+    address_id = response.json()["id"]
+    await rec.request("users.address_update", client.put(
+        f"/users/me/addresses/{address_id}", json={**address, "address_line": "2 Bench Road"}, headers=headers
+    ))
+    await rec.request("users.address_delete", client.delete(f"/users/me/addresses/{address_id}", headers=headers), expected=(204,))
+
+async def orders_create(ctx, client, rec):
+    items = [{"product_id": product_id, "quantity": 1} for product_id in ctx.rng.sample(ctx.product_ids, 2)]
+    await rec.request("orders.create", client.post("/orders/", json={"items": items}, headers=ctx.auth()))
+
+async def orders_mine(ctx, client, rec):
+    await rec.request("orders.mine", client.get("/orders/my-orders", headers=ctx.auth()))
+
+ANALYTICS_GETS = [
+    ("analytics.locations", "/analytics/locations", None),
+    ("analytics.users_count", "/analytics/users/count", None),
+    ("analytics.visitors_count", "/analytics/visitors/count", None),
+    ("analytics.orders_stats", "/analytics/orders/stats", None),
+    ("analytics.orders_timeseries_day", "/analytics/orders/timeseries", {"granularity": "day"}),
+    ("analytics.orders_timeseries_hour", "/analytics/orders/timeseries", {"granularity": "hour", "limit": 48}),
+    ("analytics.products_stats", "/analytics/products/stats", None),
+    ("analytics.products_stats_search", "/analytics/products/stats", {"q": "sensor"}),
+    ("analytics.ingest_stats", "/analytics/visitor/ingest-stats", None),
+    ("analytics.db_queries", "/analytics/db/queries", None),
+    ("analytics.db_pool", "/analytics/db/pool", None),
+    ("analytics.auth_hashing", "/analytics/auth/hashing", None),
+    ("analytics.outbound", "/analytics/outbound", None),
+]
+
+async def analytics(ctx, client, rec):
+    name, path, params = ctx.rng.choice(ANALYTICS_GETS)
+    await rec.request(name, client.get(path, params=params))
+
+async def analytics_visitor(ctx, client, rec):
+    location = {"latitude": ctx.rng.uniform(5.6, 20.5), "longitude": ctx.rng.uniform(97.3, 105.6)}
+    await rec.request("analytics.visitor", client.post("/analytics/visitor", json=location))
+
+async def auth_login(ctx, client, rec):
+    email = f"suite-bench-{ctx.rng.randrange(len(ctx.tokens))}@example.com"
+    await rec.request("auth.login", client.post("/auth/login", data={"username": email, "password": BENCH_PASSWORD}))
+
+async def auth_me(ctx, client, rec):
+    await rec.request("auth.me", client.get("/auth/me", headers=ctx.auth()))
+
+SCENARIOS = {
+    "products_list": products_list,
+    "products_list_cursor": products_list_cursor,
+    "products_search": products_search,
+    "products_detail": products_detail,
+    "cart_crud": cart_crud,
+    "users_addresses": users_addresses,
+    "orders_create": orders_create,
+    "orders_mine": orders_mine,
+    "analytics": analytics,
+    "analytics_visitor": analytics_visitor,
+    "auth_login": auth_login,
+    "auth_me": auth_me,
+}
+
+async def setup(client, users, rng):
+    """Register and log in the bench users and collect in-stock products."""
+    tokens = []
+    for index in range(users):
+        email = f"suite-bench-{index}@example.com"
+        response = await client.post("/auth/register", json={
+            "email": email, "password": BENCH_PASSWORD, "full_name": f"Suite Bench {index}"
+        })
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+        response = await client.post("/auth/login", data={"username": email, "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        tokens.append(response.json()["access_token"])
+
+    product_ids, cursor = [], None
+    while len(product_ids) < 1000:
+        params = {"limit": 100, "paginate": "cursor", "include_total": False}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/products/", params=params)
+        response.raise_for_status()
+        page = response.json()
+        product_ids.extend(product["id"] for product in page["items"] if product["stock"] > 0)
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    if len(product_ids) < 2:
+        raise SystemExit("Need at least two products in stock; seed the database first")
+    return Context(tokens, product_ids, rng)
+
+async def run_scenario(ctx, client, scenario, concurrency, duration, warmup):
+    async def worker(deadline, rec):
+        while time.perf_counter() < deadline:
+            await scenario(ctx, client, rec)
+
+    # Warm caches and connections; results are discarded
+    if warmup:
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(worker(deadline, Recorder()) for _ in range(concurrency)))
+
+    rec = Recorder()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(start + duration, rec) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    results = {}
+    for name in set(rec.latencies) | set(rec.errors):
+        results[name] = summarize(rec.latencies.get(name, []), rec.errors.get(name, 0), elapsed)
+        if name in rec.statuses:
+            results[name]["error_statuses"] = {str(status): count for status, count in rec.statuses[name].items()}
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        ctx = await setup(client, args.users, rng)
+        results = {}
+        for name in args.scenarios:
+            print(f"Running {name} ({args.concurrency} clients, {args.duration:g}s)...", flush=True)
+            results.update(await run_scenario(ctx, client, SCENARIOS[name], args.concurrency, args.duration, args.warmup))
+
+    report = {
+        "meta": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "scale": args.scale,
+            "seed": args.seed,
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat()
+        },
+        "results": dict(sorted(results.items()))
+    }
+    print_results(report["results"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+def print_results(results):
+    print(f"{'endpoint':<36} {'req/s':>9} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<36} {result['throughput']:>9.1f} {result['errors']:>7} "
+            f"{result['p50']:>7.1f}ms {result['p95']:>7.1f}ms {result['p99']:>7.1f}ms"
+        )
+
+def compare(baseline, current, threshold, metrics):
+    """Return (rows, regressions) comparing each endpoint present in both runs."""
+    rows, regressions = [], []
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name], current[name]
+        for metric in metrics:
+            before, after = old[metric], new[metric]
+            change = (after - before) / before if before else 0.0
+            # Lower throughput is worse, higher latency is worse
+            regressed = (-change if metric == "throughput" else change) > threshold
+            rows.append((name, metric, before, after, change, regressed))
+            if regressed:
+                regressions.append((name, metric))
+        # Error rates are compared in absolute terms: a rise of more than a
+        # tenth of the threshold (1 point at 10%) counts. Some scenarios
+        # expect a few errors from clients racing on the same user's data.
+        old_rate = old["errors"] / old["requests"] if old["requests"] else 0.0
+        new_rate = new["errors"] / new["requests"] if new["requests"] else 0.0
+        if new_rate > old_rate + threshold / 10:
+            rows.append((name, "error_rate", old_rate, new_rate, new_rate - old_rate, True))
+            regressions.append((name, "error_rate"))
+    return rows, regressions
+
+def run_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for key in ("concurrency", "scale"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"Warning: runs differ in {key} ({baseline['meta'].get(key)} vs {current['meta'].get(key)})")
+
+    rows, regressions = compare(baseline["results"], current["results"], args.threshold, args.metrics)
+    print(f"{'endpoint':<36} {'metric':<11} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, metric, before, after, change, regressed in rows:
+        if args.only_regressions and not regressed:
+            continue
+        print(f"{name:<36} {metric:<11} {before:>10.2f} {after:>10.2f} {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"Missing from current run: {', '.join(missing)}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+def run_seed(args):
+    # Imported here so run and compare don't need the app's dependencies
+    import seed_bulk
+    until = datetime.fromisoformat(args.until).replace(tzinfo=timezone.utc)
+    seed_bulk.seed_bulk(args.scale, args.seed, until, seed_bulk.DEFAULT_PASSWORD)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="load data with seed_bulk.py")
+    seed.add_argument("--scale", type=float, default=1.0)
+    seed.add_argument("--seed", type=int, default=42)
+    seed.add_argument("--until", default="2026-01-01", help="fixed so seeded runs are identical")
+
+    run_parser = commands.add_parser("run", help="benchmark a running API")
+    run_parser.add_argument("--url", default="http://localhost:8000")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--duration", type=float, default=15, help="seconds measured per scenario")
+    run_parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each scenario")
+    run_parser.add_argument("--timeout", type=float, default=30)
+    run_parser.add_argument("--users", type=int, default=20, help="bench users sharing the load")
+    run_parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument("--scale", type=float, default=None, help="scale the database was seeded at, for the record")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", help="write results to this JSON file")
+
+    compare_parser = commands.add_parser("compare", help="check a run against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    compare_parser.add_argument("--metrics", nargs="+", choices=["throughput", "p50", "p95", "p99"], default=["throughput", "p95", "p99"])
+    compare_parser.add_argument("--only-regressions", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        run_seed(args)
+    elif args.command == "run":
+        asyncio.run(run(args))
+    else:
+        sys.exit(run_compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import pytest
+
+# Tests that need Postgres run against TEST_DATABASE_URL only, since they
+# create and delete rows freely; they are skipped when it isn't set. It must
+# be in place before app.database is first imported.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+from app import query_stats
+
+@pytest.fixture(scope="session")
+def database():
+    """The test database with the app's schema applied."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    # Importing the app creates the tables and applies SCHEMA_UPGRADES
+    import app.main
+    return app.main.engine
+
+@pytest.fixture(scope="session")
+def client(database):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    # Entering the client runs the lifespan, so background workers run too
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def query_budget():
+    """Fail the test when requests made in the block run more SQL statements than declared.
+
+        def test_list_products(client, query_budget):
+            with query_budget(3):
+                client.get("/products/")
+    """
+    return query_stats.budget
@@ -0,0 +1,148 @@
+"""Local stand-in for the Stripe and Cloudinary APIs, with latency and failure injection.
+
+Point the API at it with
+
+    STRIPE_API_BASE=http://localhost:12111 STRIPE_SECRET_KEY=sk_test_fake
+    CLOUDINARY_UPLOAD_PREFIX=http://localhost:12111
+
+and start it with e.g.
+
+    python fake_providers.py --port 12111 --latency-ms 200 --error-rate 0.1
+
+Injection settings can be changed while running:
+
+    curl -X POST localhost:12111/_control -d '{"latency_ms": 5000, "error_rate": 0}'
+
+Supported: creating and retrieving checkout sessions, and image uploads.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+settings = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "error_rate": 0.0,
+    # Share of requests that never answer within any sane timeout
+    "hang_rate": 0.0,
+    "hang_seconds": 120.0,
+    # payment_status returned when a session is retrieved
+    "payment_status": "paid"
+}
+settings_lock = threading.Lock()
+sessions = {}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _inject(self):
+        """Apply latency and failures; returns False if the request failed."""
+        with settings_lock:
+            current = dict(settings)
+        if random.random() < current["hang_rate"]:
+            time.sleep(current["hang_seconds"])
+        delay = current["latency_ms"] + random.uniform(0, current["jitter_ms"])
+        if delay:
+            time.sleep(delay / 1000)
+        if random.random() < current["error_rate"]:
+            self._send(500, {"error": {"type": "api_error", "message": "Injected failure"}})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path.startswith("/v1/checkout/sessions/"):
+            if not self._inject():
+                return
+            session_id = self.path.rsplit("/", 1)[-1].split("?")[0]
+            session = sessions.get(session_id)
+            if session is None:
+                self._send(404, {"error": {"type": "invalid_request_error", "message": f"No such checkout.session: {session_id}"}})
+                return
+            with settings_lock:
+                session["payment_status"] = settings["payment_status"]
+            self._send(200, session)
+        elif self.path == "/_control":
+            with settings_lock:
+                self._send(200, settings)
+        else:
+            self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == "/_control":
+            with settings_lock:
+                settings.update(json.loads(body or b"{}"))
+                self._send(200, settings)
+            return
+        if not self._inject():
+            return
+
+        if self.path == "/v1/checkout/sessions":
+            session_id = f"cs_test_{uuid.uuid4().hex}"
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"http://localhost/fake-checkout/{session_id}",
+                "payment_status": "unpaid",
+                "client_reference_id": None,
+                "metadata": {}
+            }
+            # Form-encoded like the real API; only the reference id matters here
+            for pair in body.decode().split("&"):
+                key, _, value = pair.partition("=")
+                if key == "client_reference_id":
+                    session["client_reference_id"] = value
+            sessions[session_id] = session
+            self._send(200, session)
+        elif self.path.endswith("/image/upload"):
+            public_id = uuid.uuid4().hex
+            self._send(200, {
+                "public_id": public_id,
+                "secure_url": f"https://res.cloudinary.com/fake/image/upload/{public_id}.jpg",
+                "bytes": len(body)
+            })
+        else:
+            self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--hang-rate", type=float, default=0)
+    parser.add_argument("--payment-status", default="paid")
+    args = parser.parse_args()
+    settings.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "hang_rate": args.hang_rate,
+        "payment_status": args.payment_status
+    })
+
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), Handler)
+    print(f"Fake providers listening on :{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Post fake Stripe webhook events to a running API.
+
+Sends checkout.session.completed events for the given users (plus some
+event types the app ignores), redelivering a share of them the way Stripe
+does on timeouts, then waits for the events table to drain and prints its
+status counts.
+
+    python fake_stripe_events.py --url http://localhost:8000 --users 1 2 3 \\
+        --count 200 --duplicates 0.3 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import httpx
+
+IGNORED_TYPES = ["payment_intent.created", "charge.succeeded", "customer.updated"]
+
+def fake_event(user_id, event_type="checkout.session.completed"):
+    session_id = f"cs_test_{uuid.uuid4().hex}"
+    return {
+        "id": f"evt_test_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "client_reference_id": str(user_id),
+                "payment_status": "paid",
+                "metadata": {"user_id": str(user_id)}
+            }
+        }
+    }
+
+async def send(client, event, semaphore, results):
+    async with semaphore:
+        start = time.perf_counter()
+        response = await client.post(
+            "/payments/webhook",
+            content=json.dumps(event),
+            headers={"Content-Type": "application/json", "Stripe-Signature": "t=0,v1=fake"}
+        )
+        results.append((response.status_code, time.perf_counter() - start))
+
+async def run(args):
+    rng = random.Random(args.seed)
+    events = []
+    for _ in range(args.count):
+        if rng.random() < args.ignored:
+            events.append(fake_event(rng.choice(args.users), rng.choice(IGNORED_TYPES)))
+        else:
+            events.append(fake_event(rng.choice(args.users)))
+    # Redeliveries reuse the original event id
+    deliveries = events + [rng.choice(events) for _ in range(int(len(events) * args.duplicates))]
+    rng.shuffle(deliveries)
+
+    results = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        await asyncio.gather(*(send(client, event, semaphore, results) for event in deliveries))
+
+        latencies = sorted(latency for _, latency in results)
+        failed = sum(1 for status, _ in results if status >= 300)
+        print(f"Sent {len(deliveries)} deliveries ({len(events)} unique events), {failed} non-2xx")
+        print(f"Webhook latency p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}ms")
+
+        # Wait for the workers to drain the outbox
+        deadline = time.monotonic() + args.wait
+        while True:
+            stats = (await client.get("/payments/events/stats")).json()
+            if not stats.get("pending") or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.5)
+        print(f"Events by status: {stats}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, nargs="+", required=True)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of events delivered twice")
+    parser.add_argument("--ignored", type=float, default=0.1, help="share of event types the app ignores")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--wait", type=float, default=30, help="seconds to wait for processing")
+    parser.add_argument("--seed", type=int, default=None)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from app.database import SessionLocal
+from app.order_rollups import rebuild
+
+def rebuild_order_rollups():
+    db = SessionLocal()
+    try:
+        print("Rebuilding order rollups...")
+        drift = rebuild(db)
+        if drift:
+            print("Rollups had drifted from the orders table:")
+            for status, stored, actual in drift:
+                print(f"  {status}: stored (count, revenue)={stored}, actual={actual}")
+        else:
+            print("No drift detected.")
+        print("Order rollups rebuilt.")
+    except Exception as e:
+        print(f"Error rebuilding order rollups: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_order_rollups()
@@ -0,0 +1,19 @@
+from app.database import SessionLocal
+from app.inventory import reconcile_flash_sales
+
+def main():
+    db = SessionLocal()
+    try:
+        print("Reconciling flash-sale stock...")
+        reconciled = reconcile_flash_sales(db)
+        for product_id, stock in reconciled.items():
+            print(f"  product {product_id}: stock={stock}")
+        print(f"Reconciled {len(reconciled)} flash-sale products.")
+    except Exception as e:
+        print(f"Error reconciling flash-sale stock: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
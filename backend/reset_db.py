@@ -1,11 +1,15 @@
 from app.database import engine, Base
-from app.models import User, Product, ProductImage, Address, Order, OrderItem, Cart, CartItem, VisitorLocation
+from app.models import User, Product, ProductImage, Address, Order, OrderItem, Cart, CartItem, VisitorLocation, Province, OrderStatusRollup, OrderTimeRollup
+from app.provinces import seed_provinces
 
 def reset_db():
     print("Dropping all tables...")
     Base.metadata.drop_all(bind=engine)
     print("Creating all tables...")
     Base.metadata.create_all(bind=engine)
+    print("Seeding provinces...")
+    with engine.begin() as connection:
+        seed_provinces(connection)
     print("Database reset complete.")
 
 if __name__ == "__main__":
@@ -15,4 +15,7 @@ python seed_pending_orders.py
 echo "Seeding analytics..."
 python seed_analytics.py
 
+echo "Rebuilding order rollups..."
+python rebuild_order_rollups.py
+
 echo "Seeding completed successfully!"
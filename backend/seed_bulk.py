@@ -0,0 +1,258 @@
+"""Generate a large, reproducible dataset for load testing.
+
+Products, users, addresses, orders, order items, carts, cart items and
+visitor points are streamed into Postgres with COPY. Every user gets the
+same precomputed password hash (for --password), so logins work without
+hashing millions of passwords. Scale 1 is about 1.9M rows; the mix per unit
+of scale is in ROWS_PER_SCALE.
+
+    python seed_bulk.py --scale 10 --seed 42
+
+Ids continue after the rows already present, so on an empty database
+(reset_db.py) the same --scale, --seed and --until produce identical data.
+Sequences, order rollups and planner statistics are brought up to date at
+the end.
+"""
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from app.auth_utils import get_password_hash
+from app.database import engine, SessionLocal
+from app.models import OrderStatus
+from app.order_rollups import rebuild
+from app.provinces import PROVINCE_COORDINATES, PROVINCE_IDS
+
+ROWS_PER_SCALE = {
+    "products": 50_000,
+    "users": 100_000,
+    "orders": 300_000,
+    # Share of users holding a cart
+    "carts": 30_000,
+    "visitor_locations": 500_000,
+}
+ITEMS_PER_ORDER = (1, 4)
+ITEMS_PER_CART = (1, 5)
+HISTORY_DAYS = 365
+DEFAULT_PASSWORD = "password123"
+CATEGORIES = ["Sensors", "Boards", "Modules", "Accessories", "Displays", "Power", "Kits", "Tools"]
+NOUNS = ["Sensor", "Board", "Module", "Relay", "Display", "Shield", "Controller", "Adapter", "Kit", "Antenna"]
+ADJECTIVES = ["Smart", "Mini", "Pro", "Ultra", "Wireless", "Compact", "Industrial", "Low-Power", "Dual", "Rugged"]
+# Completed and paid orders dominate, like a shop that has been open a while
+ORDER_STATUSES = [
+    (OrderStatus.COMPLETED.value, 55),
+    (OrderStatus.PAID.value, 15),
+    (OrderStatus.SHIPPED.value, 12),
+    (OrderStatus.PENDING.value, 10),
+    (OrderStatus.CANCELLED.value, 8),
+]
+PROVINCES = list(PROVINCE_COORDINATES.items())
+
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def copy_line(values):
+    """One row in COPY text format."""
+    return ("\t".join("\\N" if value is None else str(value).translate(_ESCAPES) for value in values) + "\n").encode()
+
+class RowStream:
+    """File-like object feeding generated rows to COPY without holding them all."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._rest = b""
+        self.count = 0
+
+    def read(self, size=-1):
+        size = size if size and size > 0 else 1 << 16
+        parts, length = [self._rest], len(self._rest)
+        while length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = copy_line(row)
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        data = b"".join(parts)
+        self._rest = data[size:]
+        return data[:size]
+
+    readline = read
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+def copy_table(connection, table, columns, source, report, count=None):
+    """COPY rows from a RowStream, or count rows from a spooled file, and commit."""
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", source)
+    connection.commit()
+    elapsed = time.perf_counter() - start
+    if count is None:
+        count = source.count
+    report[table] = (count, elapsed)
+    print(f"  {table:<18} {count:>12,} rows {elapsed:8.1f}s {count / max(elapsed, 1e-9):>12,.0f} rows/s")
+
+def timestamp(rng, until):
+    return (until - timedelta(seconds=rng.random() * HISTORY_DAYS * 86400)).isoformat()
+
+def seed_bulk(scale, seed, until, password):
+    counts = {table: max(1, int(rows * scale)) for table, rows in ROWS_PER_SCALE.items()}
+    # One RNG per table: a table's data doesn't depend on what came before it
+    rng = {table: random.Random(f"{seed}:{table}") for table in
+           ("products", "users", "orders", "carts", "visitor_locations")}
+    password_hash = get_password_hash(password)
+    status_values = [status for status, _ in ORDER_STATUSES]
+    status_weights = [weight for _, weight in ORDER_STATUSES]
+    report = {}
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            # Bulk load: losing the tail of it in a crash is fine
+            cursor.execute("SET synchronous_commit = off")
+            first = {table: next_id(cursor, table) for table in
+                     ("products", "users", "addresses", "orders", "order_items", "carts", "cart_items")}
+        connection.commit()
+        print(f"Seeding at scale {scale} with seed {seed}:")
+
+        # Products; prices are kept to price order items
+        r = rng["products"]
+        prices = [round(r.uniform(20, 5000), 2) for _ in range(counts["products"])]
+
+        def products():
+            for index, price in enumerate(prices):
+                product_id = first["products"] + index
+                name = f"{r.choice(ADJECTIVES)} {r.choice(NOUNS)} {product_id}"
+                yield (product_id, name, f"{name}, load test item. Works with ESP32, Arduino and Raspberry Pi.",
+                       price, r.randint(0, 500), r.choice(CATEGORIES), timestamp(r, until))
+
+        copy_table(connection, "products",
+                   ("id", "name", "description", "price", "stock", "category", "created_at"),
+                   RowStream(products()), report)
+
+        # Users, each with one address in a province
+        r = rng["users"]
+        user_provinces = [r.randrange(len(PROVINCES)) for _ in range(counts["users"])]
+
+        def users():
+            for index in range(counts["users"]):
+                user_id = first["users"] + index
+                yield (user_id, f"load{user_id}@example.com", password_hash,
+                       f"Load User {user_id}", "user", timestamp(r, until))
+
+        def addresses():
+            for index, province in enumerate(user_provinces):
+                name = PROVINCES[province][0]
+                yield (first["addresses"] + index, first["users"] + index,
+                       f"{r.randint(1, 999)} {name} Road", name, name, f"{r.randint(10000, 96999)}")
+
+        copy_table(connection, "users",
+                   ("id", "email", "password_hash", "full_name", "role", "created_at"),
+                   RowStream(users()), report)
+        copy_table(connection, "addresses",
+                   ("id", "user_id", "address_line", "city", "province", "zip_code"),
+                   RowStream(addresses()), report)
+
+        # Orders; their items are spooled to a file as totals are computed,
+        # then copied once the orders they reference exist
+        r = rng["orders"]
+        with tempfile.TemporaryFile() as order_items:
+            item_id = first["order_items"]
+
+            def orders():
+                nonlocal item_id
+                for index in range(counts["orders"]):
+                    order_id = first["orders"] + index
+                    user = r.randrange(counts["users"])
+                    total = 0.0
+                    for product in r.sample(range(len(prices)), min(len(prices), r.randint(*ITEMS_PER_ORDER))):
+                        quantity = r.randint(1, 3)
+                        price = prices[product]
+                        total += price * quantity
+                        order_items.write(copy_line((item_id, order_id, first["products"] + product, quantity, price)))
+                        item_id += 1
+                    status = r.choices(status_values, status_weights)[0]
+                    yield (order_id, first["users"] + user, first["addresses"] + user,
+                           round(total, 2), status, timestamp(r, until))
+
+            copy_table(connection, "orders",
+                       ("id", "user_id", "address_id", "total_price", "status", "created_at"),
+                       RowStream(orders()), report)
+            order_items.seek(0)
+            copy_table(connection, "order_items",
+                       ("id", "order_id", "product_id", "quantity", "price_at_time"),
+                       order_items, report, count=item_id - first["order_items"])
+
+        # Carts for a sample of the new users, each product at most once per cart
+        r = rng["carts"]
+        cart_users = r.sample(range(counts["users"]), min(counts["carts"], counts["users"]))
+
+        def carts():
+            for index, user in enumerate(cart_users):
+                created_at = timestamp(r, until)
+                yield (first["carts"] + index, first["users"] + user, created_at, created_at)
+
+        def cart_items():
+            cart_item_id = first["cart_items"]
+            for index in range(len(cart_users)):
+                for product in r.sample(range(len(prices)), min(len(prices), r.randint(*ITEMS_PER_CART))):
+                    yield (cart_item_id, first["carts"] + index, first["products"] + product,
+                           r.randint(1, 4), timestamp(r, until))
+                    cart_item_id += 1
+
+        copy_table(connection, "carts", ("id", "user_id", "created_at", "updated_at"), RowStream(carts()), report)
+        copy_table(connection, "cart_items", ("id", "cart_id", "product_id", "quantity", "added_at"),
+                   RowStream(cart_items()), report)
+
+        # Visitor points scattered around province centres
+        r = rng["visitor_locations"]
+
+        def visitor_locations():
+            for _ in range(counts["visitor_locations"]):
+                name, (lat, lng) = PROVINCES[r.randrange(len(PROVINCES))]
+                yield (f"SRID=4326;POINT({lng + r.gauss(0, 0.25):.6f} {lat + r.gauss(0, 0.25):.6f})",
+                       PROVINCE_IDS[name], timestamp(r, until))
+
+        copy_table(connection, "visitor_locations", ("location", "province_id", "created_at"),
+                   RowStream(visitor_locations()), report)
+
+        print("Updating sequences and planner statistics...")
+        with connection.cursor() as cursor:
+            for table in list(first) + ["visitor_locations"]:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                )
+            connection.commit()
+            # ANALYZE can't run inside a transaction block
+            connection.autocommit = True
+            for table in list(first) + ["visitor_locations"]:
+                cursor.execute(f"ANALYZE {table}")
+            connection.autocommit = False
+    finally:
+        connection.close()
+
+    with SessionLocal() as db:
+        print("Rebuilding order rollups...")
+        rebuild(db)
+
+    rows = sum(count for count, _ in report.values())
+    elapsed = sum(seconds for _, seconds in report.values())
+    print(f"Seeded {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--until", type=lambda value: datetime.fromisoformat(value).replace(tzinfo=timezone.utc),
+                        default=None, help="newest timestamp to generate (ISO date, default: today)")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password of every generated user")
+    args = parser.parse_args()
+    until = args.until or datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    seed_bulk(args.scale, args.seed, until, args.password)
+
+if __name__ == "__main__":
+    main()
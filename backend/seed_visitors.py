@@ -1,5 +1,6 @@
 from app.database import SessionLocal
 from app.models import VisitorLocation
+from app.provinces import province_index
 import random
 
 def seed_visitors():
@@ -19,7 +20,7 @@ def seed_visitors():
             # Create WKT point
             location_wkt = f"POINT({lon} {lat})"
             
-            visitor = VisitorLocation(location=location_wkt)
+            visitor = VisitorLocation(location=location_wkt, province_id=province_index.nearest(lat, lon))
             db.add(visitor)
             
         db.commit()
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from app import cart_store, checkout, models
+from app.cart_store import MemoryCartStore, _CachedCart
+from app.database import SessionLocal, ASYNC_DATABASE_URL
+
+USER_ID = 7
+ADDED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+class FakeDb:
+    """Answers the product check and hands out line ids for add_item."""
+
+    def __init__(self):
+        self.next_id = 500
+
+    async def scalar(self, statement):
+        if "nextval" in str(statement):
+            self.next_id += 1
+            return self.next_id
+        return 1
+
+def memory_store(writes):
+    store = MemoryCartStore(shards=1, max_carts_per_shard=100, batch_size=1000, flush_interval=60)
+    store._write = lambda snapshots: writes.append([changes for _, _, changes in snapshots])
+    _, carts = store._shard(USER_ID)
+    # A cart rehydrated from cart_items: line 10 is product 1, quantity 2
+    carts[USER_ID] = _CachedCart(3, {10: [1, 2, ADDED_AT]})
+    return store
+
+def lines(store):
+    _, carts = store._shard(USER_ID)
+    return {item_id: (line[0], line[1]) for item_id, line in carts[USER_ID].lines.items()}
+
+def test_only_changed_lines_are_written():
+    writes = []
+    store = memory_store(writes)
+    asyncio.run(store.add_item(FakeDb(), USER_ID, 2, 1))
+    asyncio.run(store.set_quantity(None, USER_ID, 10, 5))
+    store.flush_user(USER_ID)
+    assert len(writes) == 1
+    inserts, updates, deletes = writes[0][0]
+    assert [(item_id, product_id, quantity) for item_id, product_id, quantity, _ in inserts] == [(501, 2, 1)]
+    assert updates == [(10, 5)]
+    assert deletes == []
+
+    asyncio.run(store.remove_item(None, USER_ID, 10))
+    store.flush_user(USER_ID)
+    assert writes[1] == [([], [], [10])]
+
+def test_checkout_keeps_lines_added_during_it():
+    writes = []
+    store = memory_store(writes)
+    # Checkout writes the cart, reads line 10 (quantity 2) and deletes its row
+    store.flush_user(USER_ID)
+    purchased = {10: 2}
+
+    # Meanwhile the user adds a product and one more of the purchased one
+    asyncio.run(store.add_item(FakeDb(), USER_ID, 2, 1))
+    asyncio.run(store.add_item(FakeDb(), USER_ID, 1, 1))
+    store.flush_user(USER_ID)
+    # The purchased line is only updated, which is a no-op once its row is gone
+    inserts, updates, deletes = writes[-1][0]
+    assert [item_id for item_id, *_ in inserts] == [501]
+    assert updates == [(10, 3)]
+
+    store.forget_items(USER_ID, purchased)
+    store.flush_user(USER_ID)
+    # The extra unit goes back in as a row of its own
+    inserts, updates, deletes = writes[-1][0]
+    assert [(item_id, product_id, quantity) for item_id, product_id, quantity, _ in inserts] == [(10, 1, 1)]
+    assert updates == [] and deletes == []
+    assert lines(store) == {10: (1, 1), 501: (2, 1)}
+
+def test_fully_purchased_lines_are_dropped_without_a_write():
+    writes = []
+    store = memory_store(writes)
+    store.flush_user(USER_ID)
+    store.forget_items(USER_ID, {10: 2})
+    store.flush_user(USER_ID)
+    assert writes == []
+    assert lines(store) == {}
+
+def test_failed_write_keeps_the_changes():
+    writes = []
+    store = memory_store(writes)
+
+    def fail(snapshots):
+        raise ConnectionError("database went away")
+
+    store._write = fail
+    asyncio.run(store.set_quantity(None, USER_ID, 10, 4))
+    store.flush_user(USER_ID)
+    asyncio.run(store.add_item(FakeDb(), USER_ID, 2, 1))
+    store._write = lambda snapshots: writes.append([changes for _, _, changes in snapshots])
+    store.flush_user(USER_ID)
+    inserts, updates, deletes = writes[0][0]
+    assert [item_id for item_id, *_ in inserts] == [501]
+    assert updates == [(10, 4)]
+
+# --- Against Postgres ---
+
+def run_async(fn, *args):
+    # A pool-less engine of its own: the app's async pool belongs to the
+    # test client's event loop
+    async def main():
+        engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await fn(db, *args)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture
+def memory_cart_store(database, monkeypatch):
+    store = MemoryCartStore(shards=4, max_carts_per_shard=100, batch_size=1000, flush_interval=60)
+    monkeypatch.setattr(cart_store, "store", store)
+    return store
+
+def test_add_item_during_checkout_does_not_restore_purchased_lines(memory_cart_store):
+    store = memory_cart_store
+    tag = uuid.uuid4().hex[:12]
+    with SessionLocal() as db:
+        user = models.User(email=f"cart-{tag}@example.com", password_hash="x")
+        bought = models.Product(name=f"{tag} bought", price=10, stock=10)
+        extra = models.Product(name=f"{tag} extra", price=5, stock=10)
+        db.add_all([user, bought, extra])
+        db.commit()
+        user_id, bought_id, extra_id = user.id, bought.id, extra.id
+
+    run_async(store.add_item, user_id, bought_id, 2)
+    session = {"id": f"cs_test_{tag}", "client_reference_id": str(user_id)}
+    with SessionLocal() as db:
+        result = checkout.handle_checkout_session(session, db)
+        assert result is not None
+
+        # The user keeps shopping while the order transaction is open, and
+        # the background flush runs; it waits on the rows checkout deleted
+        run_async(store.add_item, user_id, extra_id, 1)
+        run_async(store.add_item, user_id, bought_id, 1)
+        flusher = threading.Thread(target=store._flush, args=([user_id],))
+        flusher.start()
+        time.sleep(0.2)
+        db.commit()
+    flusher.join(10)
+    assert not flusher.is_alive()
+    checkout.after_checkout_commit(result)
+    store.flush_user(user_id)
+
+    with SessionLocal() as db:
+        order = db.scalars(select(models.Order).where(models.Order.checkout_session_id == session["id"])).one()
+        assert [(item.product_id, item.quantity) for item in order.items] == [(bought_id, 2)]
+        cart_id = db.scalar(select(models.Cart.id).where(models.Cart.user_id == user_id))
+        rows = db.execute(
+            select(models.CartItem.product_id, models.CartItem.quantity).where(models.CartItem.cart_id == cart_id)
+        ).all()
+    # Only what was added during checkout is left in the cart
+    assert sorted(rows) == sorted([(bought_id, 1), (extra_id, 1)])
@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import pytest
+from sqlalchemy import delete, update, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from app import models, images
+from app.database import SessionLocal, ASYNC_DATABASE_URL
+
+SOURCE_URL = "/static/uploads/test-image.jpg"
+VARIANTS = {"thumb": {"width": 1, "height": 1, "jpeg": "/thumb.jpg", "webp": "/thumb.webp"}}
+
+# The tests call these directly; the app's workers get no-ops while they run
+process_next = images.process_next
+requeue_stale = images.requeue_stale
+
+async def nothing_to_do(db):
+    return False
+
+@pytest.fixture
+def assets(database, monkeypatch):
+    """An image_assets table holding one pending asset, hidden from the app's image workers."""
+    monkeypatch.setattr(images, "process_next", nothing_to_do)
+    monkeypatch.setattr(images, "requeue_stale", nothing_to_do)
+    with SessionLocal() as db:
+        db.execute(delete(models.ImageAsset))
+        db.add(models.ImageAsset(source_url=SOURCE_URL))
+        db.commit()
+    yield
+
+def run(work):
+    # A pool-less engine of its own: the app's async pool belongs to the
+    # test client's event loop
+    async def main():
+        engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await work(db)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+def load():
+    with SessionLocal() as db:
+        return db.query(models.ImageAsset).filter(models.ImageAsset.source_url == SOURCE_URL).one()
+
+def test_no_transaction_is_held_while_rendering(assets, monkeypatch):
+    seen = {}
+
+    async def read(url):
+        return b"original"
+
+    def render_and_store(db):
+        async def render(data, sha256):
+            seen["in_transaction"] = db.in_transaction()
+            seen["status"] = load().status
+            return VARIANTS
+        return render
+
+    monkeypatch.setattr(images.storage, "read", read)
+
+    async def work(db):
+        monkeypatch.setattr(images, "_render_and_store", render_and_store(db))
+        return await process_next(db), await process_next(db)
+
+    assert run(work) == (True, False)
+    assert seen == {"in_transaction": False, "status": models.ImageAssetStatus.PROCESSING.value}
+    asset = load()
+    assert (asset.status, asset.variants, asset.attempts, asset.claimed_at) == (models.ImageAssetStatus.READY.value, VARIANTS, 1, None)
+
+def test_lapsed_claim_is_requeued_and_its_late_result_discarded(assets, monkeypatch):
+    async def read(url):
+        # The claim lapses and another worker requeues the asset meanwhile
+        with SessionLocal() as other:
+            other.execute(
+                update(models.ImageAsset)
+                .where(models.ImageAsset.source_url == url)
+                .values(claimed_at=func.now() - timedelta(seconds=images.IMAGE_LEASE_SECONDS + 1))
+            )
+            other.commit()
+        with ThreadPoolExecutor(1) as other_worker:
+            assert other_worker.submit(run, requeue_stale).result() == 1
+        return b"original"
+
+    async def render_and_store(data, sha256):
+        return VARIANTS
+
+    monkeypatch.setattr(images.storage, "read", read)
+    monkeypatch.setattr(images, "_render_and_store", render_and_store)
+
+    assert run(process_next) is True
+    asset = load()
+    assert (asset.status, asset.variants, asset.attempts, asset.claimed_at) == (models.ImageAssetStatus.PENDING.value, None, 1, None)
@@ -0,0 +1,72 @@
+import threading
+from app import metrics
+
+def lines_for(name):
+    return [line for line in metrics.render().splitlines() if line.split("{")[0].split(" ")[0].startswith(name)]
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_latency_seconds", "Test latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0, 3.0):
+        histogram.observe(value, "/items/{item_id}")
+
+    assert lines_for("test_latency_seconds") == [
+        'test_latency_seconds_bucket{route="/items/{item_id}",le="0.1"} 2',
+        'test_latency_seconds_bucket{route="/items/{item_id}",le="1.0"} 3',
+        'test_latency_seconds_bucket{route="/items/{item_id}",le="+Inf"} 5',
+        'test_latency_seconds_sum{route="/items/{item_id}"} 5.65',
+        'test_latency_seconds_count{route="/items/{item_id}"} 5',
+    ]
+    rendered = metrics.render()
+    assert "# HELP test_latency_seconds Test latency.\n# TYPE test_latency_seconds histogram\n" in rendered
+
+def test_counters_sum_across_threads():
+    counter = metrics.Counter("test_events_total", "Test events.", ("kind",))
+    threads = [threading.Thread(target=lambda: [counter.inc("a") for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("b", amount=2)
+
+    assert sorted(lines_for("test_events_total")) == [
+        'test_events_total{kind="a"} 4000',
+        'test_events_total{kind="b"} 2',
+    ]
+
+def test_gauge_type_and_unlabelled_samples():
+    gauge = metrics.Counter("test_in_flight", "Test gauge.", type="gauge")
+    gauge.inc()
+    gauge.inc()
+    gauge.inc(amount=-1)
+    assert "# TYPE test_in_flight gauge" in metrics.render()
+    assert lines_for("test_in_flight") == ["test_in_flight 1"]
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("test_escaped_total", "Test escaping.", ("path",))
+    counter.inc('a\\b"c\nd')
+    assert lines_for("test_escaped_total") == ['test_escaped_total{path="a\\\\b\\"c\\nd"} 1']
+
+def test_failing_collector_is_skipped():
+    def broken():
+        raise RuntimeError("boom")
+
+    def working():
+        return [("test_collected", "gauge", "Collected.", [({"pool": "x"}, 3)])]
+
+    metrics.register_collector(broken)
+    metrics.register_collector(working)
+    try:
+        assert lines_for("test_collected") == ['test_collected{pool="x"} 3']
+    finally:
+        metrics._collectors.remove(broken)
+        metrics._collectors.remove(working)
+
+def test_requests_are_labelled_by_route_template(client):
+    # Two different products, one label value: the path template
+    for product_id in (987654321, 987654322):
+        assert client.get(f"/products/{product_id}").status_code == 404
+    rendered = client.get("/metrics").text
+
+    assert 'http_requests_total{method="GET",route="/products/{product_id}",status="404"}' in rendered
+    assert 'http_request_duration_seconds_count{method="GET",route="/products/{product_id}"}' in rendered
+    assert "987654321" not in rendered
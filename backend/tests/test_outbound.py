@@ -0,0 +1,185 @@
+import threading
+import time
+import anyio
+import pytest
+from app import outbound
+from app.outbound import CircuitBreaker, Provider, ProviderUnavailable
+
+class FakeTime:
+    """Stands in for the time module in app.outbound; only monotonic() is controlled."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.perf_counter = time.perf_counter
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(outbound, "time", fake)
+    return fake
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.before_call() == 0
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.before_call() == 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 10
+    assert breaker.before_call() == pytest.approx(20)
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+def test_half_open_allows_a_single_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.before_call() == 0
+    assert breaker.state == "half_open"
+    # Everyone else waits for the trial's outcome
+    assert breaker.before_call() == 1
+    assert breaker.before_call() == 1
+
+def test_successful_trial_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.before_call() == 0
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+    assert breaker.before_call() == 0
+    assert breaker.before_call() == 0
+
+def test_failed_trial_reopens_for_a_full_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.before_call() == 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.before_call() == pytest.approx(30)
+
+def test_ignored_trial_lets_another_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.before_call() == 0
+    breaker.record_ignored()
+    assert breaker.state == "half_open"
+    assert breaker.before_call() == 0
+    assert breaker.before_call() == 1
+
+def make_provider(client_errors=(), max_concurrency=4):
+    provider = Provider("test", max_concurrency, client_errors=client_errors)
+    provider.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    return provider
+
+def fail():
+    raise ConnectionError("connection reset")
+
+def test_call_fails_fast_once_open(clock):
+    provider = make_provider()
+    calls = []
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await provider.call(fail)
+        with pytest.raises(ProviderUnavailable) as exc_info:
+            await provider.call(calls.append, "not called")
+        return exc_info.value
+
+    error = anyio.run(main)
+    assert error.provider == "test"
+    assert error.retry_after == pytest.approx(30)
+    assert calls == []
+    assert provider.stats()["state"] == "open"
+    assert (provider.calls, provider.failed, provider.rejected) == (2, 2, 1)
+
+def test_call_closes_after_a_successful_trial(clock):
+    provider = make_provider()
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await provider.call(fail)
+        clock.now += 30
+        return await provider.call(lambda: "ok")
+
+    assert anyio.run(main) == "ok"
+    assert provider.breaker.state == "closed"
+
+def test_client_errors_do_not_trip_the_breaker(clock):
+    provider = make_provider(client_errors=(ValueError,))
+
+    def bad_request():
+        raise ValueError("invalid card")
+
+    async def main():
+        for _ in range(5):
+            with pytest.raises(ValueError):
+                await provider.call(bad_request)
+
+    anyio.run(main)
+    assert provider.breaker.state == "closed"
+    assert provider.breaker.failures == 0
+    assert provider.failed == 0
+
+def test_client_error_on_trial_releases_it(clock):
+    provider = make_provider(client_errors=(ValueError,))
+
+    def bad_request():
+        raise ValueError("invalid card")
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await provider.call(fail)
+        clock.now += 30
+        with pytest.raises(ValueError):
+            await provider.call(bad_request)
+        # Not left waiting on a trial that already finished
+        return await provider.call(lambda: "ok")
+
+    assert anyio.run(main) == "ok"
+    assert provider.breaker.state == "closed"
+
+def test_cancelled_trial_releases_it(clock):
+    provider = make_provider(max_concurrency=1)
+    called = threading.Event()
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await provider.call(fail)
+        clock.now += 30
+        # Hold the only slot so the trial is cancelled while waiting for it
+        holder = object()
+        await provider.limiter.acquire_on_behalf_of(holder)
+        with anyio.move_on_after(0.05) as scope:
+            await provider.call(called.set)
+        assert scope.cancelled_caught
+        assert provider.breaker.state == "half_open"
+        provider.limiter.release_on_behalf_of(holder)
+        return await provider.call(lambda: "ok")
+
+    assert anyio.run(main) == "ok"
+    assert not called.is_set()
+    assert provider.breaker.state == "closed"
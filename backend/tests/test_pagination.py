@@ -0,0 +1,48 @@
+import base64
+import json
+import pytest
+from app.pagination import encode_cursor, decode_cursor, InvalidCursor
+
+def forged(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor("id", [42]), "id", (int,)) == [42]
+    assert decode_cursor(encode_cursor("price_asc", [19.5, 7]), "price_asc", (float, int)) == [19.5, 7]
+    assert decode_cursor(encode_cursor("name_asc", ["Relay", 3]), "name_asc", (str, int)) == ["Relay", 3]
+
+def test_whole_number_prices_are_read_as_floats():
+    values = decode_cursor(forged({"s": "price_desc", "v": [20, 7]}), "price_desc", (float, int))
+    assert values == [20.0, 7]
+    assert isinstance(values[0], float)
+
+@pytest.mark.parametrize("payload, sort_key, value_types", [
+    ({"s": "id", "v": ["x"]}, "id", (int,)),
+    ({"s": "id", "v": [1.5]}, "id", (int,)),
+    ({"s": "id", "v": [True]}, "id", (int,)),
+    ({"s": "id", "v": [None]}, "id", (int,)),
+    ({"s": "id", "v": [2 ** 31]}, "id", (int,)),
+    ({"s": "id", "v": [1, 2]}, "id", (int,)),
+    ({"s": "id", "v": "1"}, "id", (int,)),
+    ({"s": "price_asc", "v": ["cheap", 1]}, "price_asc", (float, int)),
+    ({"s": "price_asc", "v": [1.0, "1"]}, "price_asc", (float, int)),
+    ({"s": "name_asc", "v": [5, 1]}, "name_asc", (str, int)),
+    ({"s": "name_asc", "v": ["a\x00b", 1]}, "name_asc", (str, int)),
+    ({"s": "relevance", "v": [[0.5], 1]}, "relevance", (float, int)),
+    ({"s": "price_asc", "v": [1.0, 1]}, "name_asc", (str, int)),
+])
+def test_tampered_cursors_are_rejected(payload, sort_key, value_types):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(forged(payload), sort_key, value_types)
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", forged(["v"]), forged({"s": "id"})])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "id", (int,))
+
+@pytest.mark.parametrize("params", [
+    {"cursor": forged({"s": "id", "v": ["x"]})},
+    {"cursor": forged({"s": "price_asc", "v": ["x", 1]}), "sort_by": "price_asc"},
+])
+def test_tampered_cursor_is_a_bad_request(client, params):
+    assert client.get("/products/", params=params).status_code == 400
@@ -0,0 +1,59 @@
+import uuid
+import pytest
+from app import models
+from app.database import SessionLocal
+
+PASSWORD = "budget-test-password"
+
+@pytest.fixture(scope="module")
+def tag():
+    return f"budget{uuid.uuid4().hex[:12]}"
+
+@pytest.fixture(scope="module")
+def product_ids(database, tag):
+    # Enough products with several images each that per-row loading would show
+    with SessionLocal() as db:
+        products = [
+            models.Product(
+                name=f"{tag} sensor {index}", price=10 + index, stock=50,
+                images=[models.ProductImage(image_url=f"https://example.com/{tag}/{index}/{n}.jpg") for n in range(3)]
+            )
+            for index in range(5)
+        ]
+        db.add_all(products)
+        db.commit()
+        return [product.id for product in products]
+
+@pytest.fixture(scope="module")
+def auth_headers(client, tag):
+    email = f"{tag}@example.com"
+    client.post("/auth/register", json={"email": email, "password": PASSWORD}).raise_for_status()
+    response = client.post("/auth/login", data={"username": email, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def test_product_list_loads_images_without_n_plus_one(client, query_budget, product_ids, tag):
+    # Count, page and one query for all the page's images
+    with query_budget(3) as stats:
+        response = client.get("/products/", params={"search": tag, "limit": 20})
+    assert response.status_code == 200
+    assert sorted(item["id"] for item in response.json()["items"]) == sorted(product_ids)
+    assert all(len(item["images"]) == 3 for item in response.json()["items"])
+    assert stats.count > 0
+
+def test_cart_read_is_constant_in_items(client, query_budget, product_ids, auth_headers):
+    for product_id in product_ids:
+        client.post("/cart/items", json={"product_id": product_id}, headers=auth_headers).raise_for_status()
+
+    # Cart id, items with their products, and images
+    with query_budget(3):
+        response = client.get("/cart/", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == len(product_ids)
+
+def test_budget_ignores_background_statements(database, query_budget):
+    # Statements outside a tracked request, like the background workers', don't count
+    with query_budget(0) as stats:
+        with SessionLocal() as db:
+            db.execute(models.Product.__table__.select().limit(1))
+    assert stats.count == 0
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import delete, update, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from app import models, stripe_events
+from app.database import SessionLocal, ASYNC_DATABASE_URL
+from fake_stripe_events import fake_event
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(stripe_events, "STRIPE_EVENT_BACKOFF_SECONDS", 2)
+    monkeypatch.setattr(stripe_events, "STRIPE_EVENT_MAX_BACKOFF_SECONDS", 30)
+    assert [stripe_events.backoff_seconds(attempts) for attempts in range(1, 7)] == [2, 4, 8, 16, 30, 30]
+
+@pytest.fixture
+def events(database):
+    """An empty events table, with the app's event workers paused."""
+    running = bool(stripe_events.workers._threads)
+    stripe_events.workers.stop()
+    with SessionLocal() as db:
+        db.execute(delete(models.StripeEvent))
+        db.commit()
+    yield
+    if running:
+        stripe_events.workers.start()
+
+def record(event):
+    # A pool-less engine of its own: the app's async pool belongs to the
+    # test client's event loop
+    async def main():
+        engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+        try:
+            async with async_sessionmaker(engine)() as db:
+                return await stripe_events.record_event(db, event["id"], event["type"], event)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+def load(event_id):
+    with SessionLocal() as db:
+        return db.get(models.StripeEvent, event_id)
+
+def make_due(event_id, ago=timedelta(0)):
+    with SessionLocal() as db:
+        db.execute(
+            update(models.StripeEvent)
+            .where(models.StripeEvent.id == event_id)
+            .values(next_attempt_at=func.now() - ago)
+        )
+        db.commit()
+
+def process_next():
+    with SessionLocal() as db:
+        return stripe_events.process_next(db)
+
+def handle_with(monkeypatch, handler):
+    monkeypatch.setitem(stripe_events.HANDLERS, "checkout.session.completed", handler)
+
+def failing_handler(event, db):
+    raise RuntimeError("provider said no")
+
+def test_redelivered_event_is_recorded_once(events):
+    event = fake_event(1)
+    assert record(event) is True
+    assert record(event) is False
+    with SessionLocal() as db:
+        assert db.query(models.StripeEvent).filter(models.StripeEvent.id == event["id"]).count() == 1
+
+def test_failures_back_off_until_the_event_is_dead(events, monkeypatch):
+    monkeypatch.setattr(stripe_events, "STRIPE_EVENT_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(stripe_events, "STRIPE_EVENT_BACKOFF_SECONDS", 60)
+    handle_with(monkeypatch, failing_handler)
+    event = fake_event(1)
+    record(event)
+
+    for attempts in (1, 2):
+        before = datetime.now(timezone.utc)
+        assert process_next() is True
+        stored = load(event["id"])
+        assert stored.status == models.StripeEventStatus.PENDING.value
+        assert stored.attempts == attempts
+        assert "provider said no" in stored.last_error
+        delay = (stored.next_attempt_at - before).total_seconds()
+        assert 60 * 2 ** (attempts - 1) - 5 < delay <= 60 * 2 ** (attempts - 1) + 5
+        # Not due again until the backoff has passed
+        assert process_next() is False
+        make_due(event["id"])
+
+    assert process_next() is True
+    stored = load(event["id"])
+    assert stored.status == models.StripeEventStatus.DEAD.value
+    assert stored.attempts == 3
+    make_due(event["id"])
+    assert process_next() is False
+
+def test_retry_dead_requeues_and_processes(events, monkeypatch):
+    monkeypatch.setattr(stripe_events, "STRIPE_EVENT_MAX_ATTEMPTS", 1)
+    handle_with(monkeypatch, failing_handler)
+    dead, other = fake_event(1), fake_event(2)
+    for event in (dead, other):
+        record(event)
+        assert process_next() is True
+        assert load(event["id"]).status == models.StripeEventStatus.DEAD.value
+
+    with SessionLocal() as db:
+        assert stripe_events.retry_dead(db, [dead["id"]]) == 1
+    stored = load(dead["id"])
+    assert stored.status == models.StripeEventStatus.PENDING.value
+    assert stored.attempts == 0
+    assert load(other["id"]).status == models.StripeEventStatus.DEAD.value
+
+    handled = []
+    handle_with(monkeypatch, lambda event, db: (handled.append(event.id), None))
+    assert process_next() is True
+    assert handled == [dead["id"]]
+    stored = load(dead["id"])
+    assert stored.status == models.StripeEventStatus.DONE.value
+    assert stored.last_error is None
+    assert stored.processed_at is not None
+
+def test_process_next_skips_events_locked_by_another_worker(events, monkeypatch):
+    handled = []
+    handle_with(monkeypatch, lambda event, db: (handled.append(event.id), None))
+    first, second = fake_event(1), fake_event(2)
+    record(first)
+    record(second)
+    make_due(first["id"], timedelta(minutes=2))
+    make_due(second["id"], timedelta(minutes=1))
+
+    with SessionLocal() as other_worker:
+        # Another worker holds the oldest due event
+        other_worker.query(models.StripeEvent).filter(models.StripeEvent.id == first["id"]).with_for_update().one()
+        assert process_next() is True
+        assert handled == [second["id"]]
+        other_worker.rollback()
+
+    assert process_next() is True
+    assert handled == [second["id"], first["id"]]
+    assert process_next() is False
@@ -1,4 +1,5 @@
 import { useState, useEffect } from 'react';
+import axios from 'axios';
 import api from '../api';
 import { useAuth } from '../context/AuthContext';
 import { useNavigate } from 'react-router-dom';
@@ -94,15 +95,27 @@ export default function AdminDashboard() {
             return;
         }
 
-        const formData = new FormData();
-        formData.append('file', file);
-
         setUploading(true);
         try {
-            const response = await api.post('/upload/image', formData, {
-                headers: {
-                    'Content-Type': 'multipart/form-data',
-                },
+            // The file goes straight to storage; the API only signs and verifies
+            const { data: signed } = await api.post('/upload/sign');
+            let uploaded;
+            if (signed.method === 'PUT') {
+                // Local storage: the signed URL is on the API itself
+                ({ data: uploaded } = await api.put(signed.upload_url, file, {
+                    headers: { 'Content-Type': file.type || 'application/octet-stream' },
+                }));
+            } else {
+                const formData = new FormData();
+                Object.entries(signed.fields).forEach(([key, value]) => formData.append(key, value));
+                formData.append('file', file);
+                // Plain axios, so the API token isn't sent to the storage provider
+                ({ data: uploaded } = await axios.post(signed.upload_url, formData));
+            }
+            const response = await api.post('/upload/finalize', {
+                public_id: uploaded.public_id,
+                signature: uploaded.signature,
+                version: uploaded.version != null ? String(uploaded.version) : null,
             });
             setNewProduct(prev => ({
                 ...prev,